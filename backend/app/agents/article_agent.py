@@ -11,6 +11,7 @@ async def generate_article(topic: str) -> str:
     response = await llm_helper.chat_completion(
         messages=messages,
         temperature=0.7,
-        max_tokens=1200
+        max_tokens=1200,
+        cache=True
     )
     return response["choices"][0]["message"]["content"]
@@ -43,10 +43,12 @@ async def summarize_news(news_text):
         {"role": "system", "content": "你是一个资深新闻编辑。"},
         {"role": "user", "content": prompt.format(news=news_text)}
     ]
+    # 每条一句话的摘要，无需大段生成预算
     response = await llm_helper.chat_completion(
         messages=messages,
-        temperature=0.7,
-        max_tokens=800
+        temperature=0.3,
+        max_tokens=400,
+        cache=True
     )
     return response["choices"][0]["message"]["content"]
 
@@ -35,11 +35,11 @@ class ReportAgent:
                 {"role": "user", "content": prompt}
             ]
             
-            # 调用 LLM 生成报告
+            # 调用 LLM 生成报告（相同报告信息直接复用缓存结果）
             response = await llm_helper.chat_completion(
                 messages=messages,
-                temperature=0.7
-                
+                temperature=0.7,
+                cache=True
             )
             
             return response["choices"][0]["message"]["content"]
@@ -8,6 +8,24 @@ WECHAT_APPID = os.getenv("WECHAT_APPID")
 WECHAT_SECRET = os.getenv("WECHAT_SECRET")
 BASE_URL = os.getenv("BASE_URL", "https://api.deepseek.com/v1")
 
+# LLM client
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-chat")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_RATE_LIMIT_RPS = float(os.getenv("LLM_RATE_LIMIT_RPS", "10"))  # 0 = unlimited
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))  # seconds
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "8"))  # seconds
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # seconds
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))  # seconds
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))  # seconds, 0 = no hedged requests
+
+# LLM completion cache (opt-in per call site)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache.sqlite3")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "604800"))  # seconds
+
 # RAG / Files config
 KB_UPLOADS_DIR = os.getenv("KB_UPLOADS_DIR", "./kb_uploads")
 KB_VECTOR_DIR = os.getenv("KB_VECTOR_DIR", "./kb_vectorstores")
@@ -28,3 +46,64 @@ TESSERACT_CMD = os.getenv("TESSERACT_CMD", "")  # e.g. C:\\Program Files\\Tesser
 CONV_TOPK = int(os.getenv("CONV_TOPK", "3"))
 KB_TOPK = int(os.getenv("KB_TOPK", "2"))
 INCLUDE_SOURCES = os.getenv("INCLUDE_SOURCES", "true").lower() in ("1", "true", "yes")
+
+# Concurrent retrieval (chat turn)
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+RETRIEVAL_STAGE_TIMEOUT = float(os.getenv("RETRIEVAL_STAGE_TIMEOUT", "3.0"))  # seconds per stage
+
+# Retrieval engine defaults (per-KB overrides live in <KB_VECTOR_DIR>/<kb>/retrieval.json)
+RETRIEVAL_STRATEGY = os.getenv("RETRIEVAL_STRATEGY", "similarity")  # similarity | mmr | rerank | hybrid | keyword
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")  # e.g. BAAI/bge-reranker-base; empty = ANN order
+
+# Hybrid (BM25 + vector) retrieval
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Names answered by an exact phrase lookup (skipping vector search), comma-separated, e.g. "张三,星河计划".
+# Besides these, only code-like queries (letters/digits with at least one digit, e.g. AX-1000) take that path.
+LEXICAL_EXACT_TERMS = frozenset(t.strip().lower() for t in os.getenv("LEXICAL_EXACT_TERMS", "").split(",") if t.strip())
+MEMORY_HYBRID = os.getenv("MEMORY_HYBRID", "true").lower() in ("1", "true", "yes")
+
+# Federated multi-KB query
+FEDERATED_MAX_KBS = int(os.getenv("FEDERATED_MAX_KBS", "16"))
+FEDERATED_PER_KB_K = int(os.getenv("FEDERATED_PER_KB_K", "5"))
+FEDERATED_KB_TIMEOUT = float(os.getenv("FEDERATED_KB_TIMEOUT", "2.0"))  # seconds per KB
+
+# KB answer cache
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))  # seconds
+ANSWER_CACHE_SEMANTIC = os.getenv("ANSWER_CACHE_SEMANTIC", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_SIM_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIM_THRESHOLD", "0.95"))
+
+# Chat prompt budget
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "6000"))
+CHAT_KNOWLEDGE_RATIO = float(os.getenv("CHAT_KNOWLEDGE_RATIO", "0.5"))  # max share of budget for retrieved knowledge
+CHAT_HISTORY_FETCH = int(os.getenv("CHAT_HISTORY_FETCH", "30"))  # recent messages considered per turn
+# tiktoken encoding for token counts (e.g. cl100k_base); empty = offline CJK-aware estimate.
+# Neither matches DeepSeek's own vocabulary exactly, so budgets are approximate either way.
+CHAT_TOKEN_ENCODING = os.getenv("CHAT_TOKEN_ENCODING", "")
+
+# Rolling conversation summary
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "24"))  # unsummarized messages before folding
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "8"))  # newest messages always left raw
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "600"))
+
+# Group commit for chat messages: bursts of appends share one transaction / fsync
+MESSAGE_GROUP_COMMIT = os.getenv("MESSAGE_GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+MESSAGE_GROUP_COMMIT_WINDOW_MS = int(os.getenv("MESSAGE_GROUP_COMMIT_WINDOW_MS", "5"))  # wait for more writes
+MESSAGE_GROUP_COMMIT_MAX_BATCH = int(os.getenv("MESSAGE_GROUP_COMMIT_MAX_BATCH", "64"))
+
+# Entity extraction: stored per file as counts + top-N values (full list served on demand)
+ENTITY_TOP_N = int(os.getenv("ENTITY_TOP_N", "20"))  # distinct values kept per entity type
+ENTITY_MAX_POSITIONS = int(os.getenv("ENTITY_MAX_POSITIONS", "5"))  # character offsets kept per value
+
+# Document tokenization (jieba): large texts are split across a process pool; tokens cached per document
+TOKENIZE_WORKERS = int(os.getenv("TOKENIZE_WORKERS", str(min(4, os.cpu_count() or 1))))  # set to 1 when started via `python main.py` (spawned workers re-import __main__)
+TOKENIZE_PARALLEL_CHARS = int(os.getenv("TOKENIZE_PARALLEL_CHARS", "200000"))  # below this, tokenize in-process
+TOKEN_CACHE_ENTRIES = int(os.getenv("TOKEN_CACHE_ENTRIES", "16"))  # documents whose tokens stay cached
+
+# Uploads: streamed to disk in fixed-size blocks, hashed (sha256) on the way
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
@@ -1,43 +1,160 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from contextlib import contextmanager, asynccontextmanager
 import os
 
+from app.utils import json_codec
+
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ai_agent.db")
+# 同步与异步引擎各自一个连接池，容量配置相同
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
 
 # 创建引擎
 engine = create_engine(
     DATABASE_URL,
     poolclass=QueuePool,
-    pool_size=10,
-    max_overflow=20,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     pool_pre_ping=True,
+    json_serializer=json_codec.dumps,
+    json_deserializer=json_codec.loads,
     echo=False  # 生产环境设为 False
 )
 
+# SQLite 连接参数：WAL 允许读写并发，synchronous=NORMAL 在 WAL 下只在 checkpoint 时 fsync，
+# busy_timeout 让并发写者排队等待锁而不是立即报 database is locked
+SQLITE_PRAGMAS_ENABLED = os.getenv("SQLITE_PRAGMAS", "true").lower() in ("1", "true", "yes")
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-20000")),  # 负数单位为 KiB
+    "temp_store": "MEMORY",
+}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """每个新连接建立时设置 PRAGMA（同步 pysqlite 与 aiosqlite 适配连接都适用）"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def configure_sqlite(sync_engine):
+    """为 SQLite 引擎注册连接时的 PRAGMA 设置，其他数据库不处理"""
+    if SQLITE_PRAGMAS_ENABLED and sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+
+configure_sqlite(engine)
+
 # 创建会话
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# 创建作用域会话
-ScopedSession = scoped_session(SessionLocal)
+def _async_url(url: str) -> str:
+    """同步驱动 URL 换成对应的 asyncio 驱动（aiosqlite / asyncpg）"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgresql:") or url.startswith("postgresql+psycopg2:"):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    return url
+
+# 异步引擎：聊天热路径使用，DB I/O 不阻塞事件循环
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+# aiosqlite 默认使用 NullPool（不接受 pool_size），与同步引擎一样显式指定连接池
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    json_serializer=json_codec.dumps,
+    json_deserializer=json_codec.loads,
+    echo=False
+)
+configure_sqlite(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # 基础模型
 Base = declarative_base()
 
 def get_db():
-    """获取数据库会话"""
-    db = ScopedSession()
+    """获取数据库会话（FastAPI 依赖，每个请求一个会话，请求结束归还连接）"""
+    db = SessionLocal()
     try:
         yield db
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
 
-def init_db():
-    """初始化数据库"""
+@contextmanager
+def session_scope():
+    """在依赖注入之外（WebSocket、后台任务、服务单例）使用的会话作用域：
+    出错回滚，结束时关闭并把连接还给连接池。提交由调用方（DatabaseService）负责。
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+@asynccontextmanager
+async def async_session_scope():
+    """session_scope 的异步版本"""
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
+
+async def get_async_db():
+    """获取异步数据库会话（FastAPI 依赖）"""
+    async with async_session_scope() as db:
+        yield db
+
+def _queue_pool_status(pool) -> dict:
+    """单个连接池的使用情况，只读公开接口；max_overflow 取配置值"""
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    capacity = pool.size() + DB_MAX_OVERFLOW
+    checked_out = pool.checkedout()
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "utilization": round(checked_out / capacity, 4) if capacity > 0 else 0.0,
+    }
+
+def pool_status() -> dict:
+    """连接池使用情况：同步引擎与异步引擎（聊天热路径）分别统计"""
+    return {
+        "sync": _queue_pool_status(engine.pool),
+        "async": _queue_pool_status(async_engine.sync_engine.pool),
+    }
+
+def init_db(bind=None):
+    """初始化数据库；bind 默认为全局引擎"""
+    bind = bind if bind is not None else engine
     # 导入所有模型
     from app import models
     # 创建所有表
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=bind)
+    # 旧库补齐新增列
+    from app.migrations import run_migrations
+    run_migrations(bind)
     print("数据库表已创建")
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""轻量级表结构迁移。
+
+create_all 只会创建缺失的表，不会给已有表补列、补索引；这里在启动时检查并补齐新增列和模型上声明的索引，
+并把旧列中的数据搬到新表。
+迁移必须是幂等的：重复执行不产生副作用。
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.database import Base
+
+# (表名, 列名, 列定义, 补列后执行的回填 SQL)
+COLUMN_MIGRATIONS = [
+    ("conversations", "summary", "TEXT", None),
+    ("conversations", "summary_upto", "INTEGER DEFAULT 0", None),
+    (
+        "conversations", "next_sequence", "INTEGER NOT NULL DEFAULT 1",
+        "UPDATE conversations SET next_sequence = COALESCE("
+        "(SELECT MAX(sequence) FROM messages WHERE messages.conversation_id = conversations.id), 0) + 1",
+    ),
+    (
+        "conversations", "message_count", "INTEGER NOT NULL DEFAULT 0",
+        "UPDATE conversations SET message_count = "
+        "(SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.id)",
+    ),
+    (
+        "conversations", "last_message_preview", "VARCHAR(60) DEFAULT ''",
+        "UPDATE conversations SET last_message_preview = COALESCE(("
+        "SELECT CASE WHEN length(content) > 50 THEN substr(content, 1, 50) || '...' ELSE content END "
+        "FROM messages WHERE messages.conversation_id = conversations.id "
+        "ORDER BY sequence DESC LIMIT 1), '')",
+    ),
+]
+
+# (表名, 依赖的旧列, SQL)：旧列存在时执行的数据迁移，SQL 必须幂等
+DATA_MIGRATIONS = [
+    # file_records.analysis_data 移到 file_analysis 表，旧列清空（SQLite 不便删列，保留空列）
+    (
+        "file_records", "analysis_data",
+        "INSERT INTO file_analysis (file_id, data, created_at) "
+        "SELECT id, analysis_data, created_at FROM file_records "
+        "WHERE analysis_data IS NOT NULL AND id NOT IN (SELECT file_id FROM file_analysis)",
+    ),
+    ("file_records", "analysis_data", "UPDATE file_records SET analysis_data = NULL WHERE analysis_data IS NOT NULL"),
+]
+
+# 仅 SQLite 执行的数据修正，SQL 必须幂等
+SQLITE_DATA_MIGRATIONS = [
+    # CURRENT_TIMESTAMP 写入的时间没有微秒部分，按字符串比较时与游标参数（含微秒）不一致，补齐为统一格式
+    "UPDATE conversations SET updated_at = updated_at || '.000000' WHERE length(updated_at) = 19",
+    "UPDATE conversations SET created_at = created_at || '.000000' WHERE length(created_at) = 19",
+]
+
+
+def run_migrations(engine: Engine):
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table, column, ddl, backfill in COLUMN_MIGRATIONS:
+            if table not in tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                if backfill:
+                    conn.execute(text(backfill))
+                print(f"迁移: {table}.{column} 已添加")
+
+    with engine.begin() as conn:
+        for table, column, sql in DATA_MIGRATIONS:
+            if table not in tables or column not in {c["name"] for c in inspector.get_columns(table)}:
+                continue
+            result = conn.execute(text(sql))
+            if result.rowcount:
+                print(f"迁移: {table}.{column} 处理 {result.rowcount} 行")
+        if engine.dialect.name == "sqlite" and "conversations" in tables:
+            for sql in SQLITE_DATA_MIGRATIONS:
+                conn.execute(text(sql))
+
+    # 模型上声明的索引（已存在的跳过）
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
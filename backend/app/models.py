@@ -1,19 +1,29 @@
-from sqlalchemy import Column, String, Text, DateTime, Integer, Boolean, JSON, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, String, Text, DateTime, Integer, Boolean, JSON, ForeignKey, Index
 from sqlalchemy.sql import func
+from app.database import Base
 import uuid
-
-Base = declarative_base()
+from datetime import datetime
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 对话列表：WHERE is_active [AND user_id] ORDER BY updated_at DESC, id DESC（keyset 分页）
+        Index("ix_conversations_active_updated", "is_active", "updated_at", "id"),
+        Index("ix_conversations_user_active_updated", "user_id", "is_active", "updated_at", "id"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     title = Column(String(255), default="新对话")
     user_id = Column(String(50), nullable=True)
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # Python 端取时间：经 DateTime 绑定后格式统一（含微秒），keyset 游标比较才与排序一致
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     is_active = Column(Boolean, default=True)
+    summary = Column(Text, nullable=True)  # 滚动摘要
+    summary_upto = Column(Integer, default=0)  # 摘要已覆盖到的消息 sequence
+    next_sequence = Column(Integer, default=1, nullable=False)  # 下一条消息的 sequence
+    message_count = Column(Integer, default=0, nullable=False)  # 随 add_message 维护
+    last_message_preview = Column(String(60), default="")  # 最后一条消息预览，随 add_message 维护
     
     def to_dict(self):
         return {
@@ -22,11 +32,18 @@ class Conversation(Base):
             "user_id": self.user_id,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
-            "is_active": self.is_active
+            "is_active": self.is_active,
+            "message_count": self.message_count or 0,
+            "last_message_preview": self.last_message_preview or ""
         }
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # 按对话取消息（ORDER BY sequence）/ 取最后一条消息（ORDER BY created_at）
+        Index("ix_messages_conversation_sequence", "conversation_id", "sequence"),
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     conversation_id = Column(String, nullable=False)
@@ -48,6 +65,10 @@ class Message(Base):
         }
 class FileRecord(Base):
     __tablename__ = "file_records"
+    __table_args__ = (
+        # 对话的文件列表：WHERE conversation_id AND is_active ORDER BY created_at DESC
+        Index("ix_file_records_conversation_active_created", "conversation_id", "is_active", "created_at"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
@@ -55,8 +76,7 @@ class FileRecord(Base):
     file_path = Column(Text, nullable=False)
     file_size = Column(Integer, nullable=False)
     file_format = Column(String(20), nullable=False)
-    file_info = Column(JSON, nullable=True)  # 存储详细的文件信息
-    analysis_data = Column(JSON, nullable=True)  # 存储分析结果
+    file_info = Column(JSON, nullable=True)  # 存储详细的文件信息（分析结果见 FileAnalysis）
     insights = Column(Text, nullable=True)  # 存储洞察结果
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -71,9 +91,16 @@ class FileRecord(Base):
             "file_size": self.file_size,
             "file_format": self.file_format,
             "file_info": self.file_info,
-            "analysis_data": self.analysis_data,
             "insights": self.insights,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
             "is_active": self.is_active
-        }
\ No newline at end of file
+        }
+
+class FileAnalysis(Base):
+    """文件分析结果。体积大（关键词、实体、摘要），与 file_records 分表存放，文件列表查询不会读取"""
+    __tablename__ = "file_analysis"
+
+    file_id = Column(String, ForeignKey("file_records.id"), primary_key=True)
+    data = Column(Text, nullable=False)  # json_codec 编码后的原文，读取时按需解码
+    created_at = Column(DateTime, default=func.now())
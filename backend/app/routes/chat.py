@@ -1,24 +1,34 @@
-from fastapi import APIRouter, WebSocket, HTTPException, WebSocketDisconnect,File, UploadFile, Form
+from fastapi import APIRouter, WebSocket, HTTPException, WebSocketDisconnect,File, UploadFile, Form, Depends
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import json
 import uuid
 from datetime import datetime
 import asyncio
+import logging
 import os
 from app.utils.llm_helper import llm_helper
-from app.utils.conversation_manager_usesql import conversation_manager
 from app.utils.memory_manager import MemoryManager
 from app.agents.report_agent import  report_agent
 from app.services.file_service import file_service
+from app.services.storage_service import UploadTooLarge
 from app.services.index_service import index_service
 from app.services import chunking_service
-from app.services.db_service import DatabaseService
-from app.database import SessionLocal
+from app.database import get_db
+from sqlalchemy.orm import Session
 from sqlalchemy import text as sql_text
 from app.services.index_service import index_service
 from app.services import extraction_service, chunking_service
-from app.config import CONV_TOPK, KB_TOPK
+from app.config import CONV_TOPK, KB_TOPK, CHAT_HISTORY_FETCH
+from app.services.retrieval_orchestrator import retrieval_orchestrator
+from app.utils.sse import SSE_HEADERS
+from app.utils.context_builder import context_builder
+from app.services.summary_service import conversation_summarizer
+from app.services.chat_repository import chat_repository
+from app.services.message_writer import message_writer
+
+logger = logging.getLogger(__name__)
 
 memory_manager = MemoryManager()
 memory_manager.create_or_load()
@@ -49,6 +59,7 @@ class ConversationItem(BaseModel):
 
 class ConversationListResponse(BaseModel):
     conversations: List[ConversationItem]
+    next_cursor: Optional[str] = None
 
 class ReportGenerateRequest(BaseModel):
     conversation_id: str
@@ -87,10 +98,18 @@ class FileItem(BaseModel):
 
 class FileListResponse(BaseModel):
     files: List[FileItem]
+
+class FileAskMessage(BaseModel):
+    role: str
+    content: str
+
+class FileAskStreamRequest(BaseModel):
+    messages: List[FileAskMessage]
+    summary: Optional[str] = None
 @router.post("/upload", response_model=FileUploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
-    conversation_id: str = Form(...)
+    conversation_id: str = Form(...),
 ):
     """上传并分析文件"""
     try:
@@ -112,8 +131,7 @@ async def upload_file(
         # 我们需要手动保存文件记录到数据库
          # 手动保存文件记录到数据库
         try:
-            db_service = DatabaseService(SessionLocal())
-            file_record = db_service.create_file_record(
+            file_record = await chat_repository.create_file_record(
                 conversation_id=conversation_id,
                 file_name=file.filename,
                 file_path=result["file_path"],
@@ -174,7 +192,7 @@ async def upload_file(
                 "status": "completed"
             }
         }
-        conversation_manager.add_message(conversation_id, analysis_message)
+        await message_writer.add_message(conversation_id, analysis_message)
         
         return FileUploadResponse(
             file_id=file_record["id"],
@@ -185,14 +203,17 @@ async def upload_file(
             conversation_id=conversation_id
         )
         
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
 @router.get("/files/{conversation_id}", response_model=FileListResponse)
 async def list_files(conversation_id: str):
     """获取对话中的文件列表"""
     try:
-        db_service = DatabaseService(SessionLocal())
-        files = db_service.get_files_by_conversation(conversation_id)
+        files = await chat_repository.get_files_by_conversation(conversation_id)
          # 转换为 FileItem 对象
         file_items = []
         for file in files:
@@ -214,6 +235,40 @@ async def list_files(conversation_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取文件列表失败: {str(e)}")
 
+@router.get("/files/{file_id}/analysis")
+async def get_file_analysis(file_id: str):
+    """文件分析结果（文件列表不再返回，按需单独获取；直接返回存储的 JSON 原文）"""
+    data = await chat_repository.get_file_analysis(file_id, decode=False)
+    if data is None:
+        raise HTTPException(status_code=404, detail="分析结果不存在")
+    return Response(content=data, media_type="application/json")
+
+@router.get("/files/{file_id}/entities")
+async def get_file_entities(file_id: str, kind: str = "numbers", offset: int = 0, limit: int = 1000):
+    """某类实体的完整列表（分页）。分析结果里只存 top-N，完整列表从原文件按需重新抽取"""
+    record = await chat_repository.get_file_by_id(file_id, columns=("id", "file_path"))
+    if not record:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    limit = max(1, min(limit, 10000))
+    try:
+        return await asyncio.to_thread(
+            file_service.get_entities, record["file_path"], kind, max(0, offset), limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/files/{file_id}/ask/stream")
+async def ask_file_stream(file_id: str, request: FileAskStreamRequest):
+    """针对单个文件的流式问答（SSE）"""
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="messages 不能为空")
+    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    return StreamingResponse(
+        file_service.ask_file_stream(file_id, messages, request.summary or ""),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
 @router.get("/files/{file_id}/preview")
 async def preview_file(file_id: str):
     """预览文件"""
@@ -241,7 +296,7 @@ async def send_chat_message(request: ChatMessageRequest):
         if not conversation_id:
             # 根据第一条消息生成对话标题
             title = request.message[:20] + "..." if len(request.message) > 20 else request.message
-            conversation_id = conversation_manager.create_conversation(title)
+            conversation_id = await chat_repository.create_conversation(title)
         
         # 添加用户消息
         user_message = {
@@ -250,7 +305,7 @@ async def send_chat_message(request: ChatMessageRequest):
             "content": request.message,
             "timestamp": datetime.now().isoformat()
         }
-        conversation_manager.add_message(conversation_id, user_message)
+        await message_writer.add_message(conversation_id, user_message)
 
         # 检查是否是报告生成请求
         if "生成报告" in request.message or "帮我写报告" in request.message:
@@ -269,7 +324,7 @@ async def send_chat_message(request: ChatMessageRequest):
                     "status": "completed"
                 }
             }
-            conversation_manager.add_message(conversation_id, ai_message)
+            await message_writer.add_message(conversation_id, ai_message)
             
             return ChatMessageResponse(
                 message_id=ai_message["id"],
@@ -280,8 +335,11 @@ async def send_chat_message(request: ChatMessageRequest):
             )
         
         # 获取对话历史
-        messages = conversation_manager.get_messages(conversation_id)
-        formatted_messages = [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+        history_summary, messages = await chat_repository.get_history_context(conversation_id, CHAT_HISTORY_FETCH)
+        formatted_messages, _ = context_builder.build(
+            [{"role": msg["role"], "content": msg["content"]} for msg in messages],
+            summary=history_summary,
+        )
         
         # 调用 DeepSeek API
         response = await llm_helper.chat_completion(
@@ -299,7 +357,8 @@ async def send_chat_message(request: ChatMessageRequest):
             "content": ai_content,
             "timestamp": datetime.now().isoformat()
         }
-        conversation_manager.add_message(conversation_id, ai_message)
+        await message_writer.add_message(conversation_id, ai_message)
+        conversation_summarizer.schedule(conversation_id)
         
         return ChatMessageResponse(
             message_id=ai_message["id"],
@@ -342,7 +401,7 @@ async def websocket_chat(websocket: WebSocket):
                     message = message_data.get("content", "")
                     conversation_id = (
                         message_data.get("conversation_id")
-                        or conversation_manager.create_conversation()
+                        or await chat_repository.create_conversation()
                     )
                     kb_name = message_data.get("kb")
 
@@ -353,70 +412,63 @@ async def websocket_chat(websocket: WebSocket):
                         "content": message,
                         "timestamp": _now(),
                     }
-                    conversation_manager.add_message(conversation_id, user_message)
-                    
-                    memory_manager.add_texts([user_message["content"]])
-
-                    # 2. 检索长期记忆
-                    long_term_results = memory_manager.search(message, k=3)
-                    long_term_context = "\n".join([doc.page_content for doc in long_term_results])
-                    # 3. 取短期记忆
-                    N = 10
-                    short_term_messages = conversation_manager.get_messages(conversation_id)[-N:]
+                    await message_writer.add_message(conversation_id, user_message)
+
+                    # 2. 并发检索：长期记忆 / 会话空间 / 可选 KB 空间
+                    stages = {
+                        "long_term": lambda: memory_manager.search(message, k=3),
+                        "conversation": lambda: index_service.retriever(
+                            f"conv_{conversation_id}", k=CONV_TOPK
+                        ).get_relevant_documents(message),
+                    }
+                    if kb_name:
+                        stages["kb"] = lambda: index_service.retriever(
+                            kb_name, k=KB_TOPK
+                        ).get_relevant_documents(message)
+                    retrieved, retrieval_stats = await retrieval_orchestrator.run(stages)
+                    logger.debug("检索耗时: %s", retrieval_stats)
+
+                    # 检索完成后再写入长期记忆（专用后台线程，不阻塞首 token、不占检索线程，失败记日志）
+                    memory_manager.add_texts_background([user_message["content"]])
+
+                    # 3. 取短期记忆：滚动摘要 + 摘要之后的消息（多取一些，由预算决定最终保留多少）
+                    history_summary, short_term_messages = await chat_repository.get_history_context(
+                        conversation_id, CHAT_HISTORY_FETCH
+                    )
                     short_term_context = [{"role": msg["role"], "content": msg["content"]} for msg in short_term_messages]
 
-                                        # 4. 拼接上下文
-                    if long_term_context:
-                        system_prompt = f"【长期记忆相关内容】\n{long_term_context}\n【当前对话】"
-                        formatted_messages = [{"role": "system", "content": system_prompt}] + short_term_context
-                    else:
-                        formatted_messages = short_term_context
-
-                    # 组合检索：会话空间 + 可选 KB 空间
-                    try:
-                        conv_docs = []
-                        try:
-                            conv_retriever = index_service.retriever(f"conv_{conversation_id}", k=CONV_TOPK)
-                            conv_docs = conv_retriever.get_relevant_documents(message)
-                        except Exception:
-                            conv_docs = []
-                        kb_docs = []
-                        if kb_name:
-                            try:
-                                kb_retriever = index_service.retriever(kb_name, k=KB_TOPK)
-                                kb_docs = kb_retriever.get_relevant_documents(message)
-                            except Exception:
-                                kb_docs = []
-                        kn_segments = []
-                        for d in conv_docs + kb_docs:
-                            if d and getattr(d, 'page_content', None):
-                                kn_segments.append(d.page_content)
-                        if kn_segments:
-                            knowledge_context = "\n".join(kn_segments[:5])
-                            kc_prompt = f"【检索知识】\n{knowledge_context}"
-                            formatted_messages = [{"role": "system", "content": kc_prompt}] + formatted_messages
-                    except Exception:
-                        pass
-                    # messages = conversation_manager.get_messages(conversation_id)
-                    # formatted_messages = [
-                    #     {"role": msg["role"], "content": msg["content"]}
-                    #     for msg in messages
-                    # ]
+                    # 4. 按 token 预算组装上下文：检索知识 > 最近对话 > 长期记忆
+                    kn_segments = [
+                        d.page_content
+                        for d in retrieved["conversation"] + retrieved.get("kb", [])
+                        if d and getattr(d, 'page_content', None)
+                    ]
+                    long_term_segments = [doc.page_content for doc in retrieved["long_term"]]
+                    formatted_messages, context_report = context_builder.build(
+                        short_term_context,
+                        knowledge=[("检索知识", kn_segments), ("长期记忆相关内容", long_term_segments)],
+                        summary=history_summary,
+                        pinned=f"【关联知识库】{kb_name}" if kb_name else None,
+                    )
+                    logger.debug("上下文预算: %s", context_report)
 
                     # 通知前端开始流
                     await websocket.send_text(json.dumps({
                         "type": "stream_start",
-                        "message": "开始生成回复..."
+                        "message": "开始生成回复...",
+                        "retrieval": retrieval_stats,
+                        "context": context_report
                     }))
 
                     full_response = ""
 
+                    # ⚡ 流式返回；出错、break 或连接断开时立即关闭上游流，释放并发名额与连接
+                    stream = llm_helper.chat_completion_stream(
+                        messages=formatted_messages,
+                        temperature=0.7,
+                    )
                     try:
-                        # ⚡ 流式返回
-                        async for chunk in llm_helper.chat_completion_stream(
-                            messages=formatted_messages,
-                            temperature=0.7,
-                        ):
+                        async for chunk in stream:
                             if chunk.get("type") == "stream_chunk":
                                 content = chunk.get("content", "")
                                 if content:
@@ -435,6 +487,8 @@ async def websocket_chat(websocket: WebSocket):
                             "type": "error",
                             "content": f"LLM流式响应异常: {str(e)}"
                         }))
+                    finally:
+                        await stream.aclose()
 
                     # 保存 AI 消息
                     ai_message = {
@@ -443,7 +497,8 @@ async def websocket_chat(websocket: WebSocket):
                         "content": full_response,
                         "timestamp": _now(),
                     }
-                    conversation_manager.add_message(conversation_id, ai_message)
+                    await message_writer.add_message(conversation_id, ai_message)
+                    conversation_summarizer.schedule(conversation_id)
 
                     # 通知前端流结束
                     await websocket.send_text(json.dumps({
@@ -481,8 +536,8 @@ async def websocket_chat(websocket: WebSocket):
 @router.post("/conversations", response_model=dict)
 async def create_conversation(request: ConversationCreateRequest):
     """创建新对话"""
-    conversation_id = conversation_manager.create_conversation(request.title)
-    conversation = conversation_manager.get_conversation(conversation_id)
+    conversation_id = await chat_repository.create_conversation(request.title)
+    conversation = await chat_repository.get_conversation(conversation_id)
     
     return {
         "id": conversation["id"],
@@ -491,36 +546,32 @@ async def create_conversation(request: ConversationCreateRequest):
     }
 
 @router.get("/conversations", response_model=ConversationListResponse)
-async def list_conversations():
-    """获取对话列表"""
-    conversations = conversation_manager.get_all_conversations()
-    
-    # 按更新时间排序（最新的在前面）
-    conversations.sort(key=lambda x: x["updated_at"], reverse=True)
+async def list_conversations(limit: int = 100, cursor: Optional[str] = None, user_id: Optional[str] = None):
+    """获取对话列表（按更新时间倒序，cursor 分页）"""
+    limit = max(1, min(limit, 200))
+    try:
+        conversations, next_cursor = await chat_repository.list_conversations(limit, cursor, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    conversation_items = []
-    for conv in conversations:
-        # 生成预览
-        preview = conversation_manager.get_conversation_preview(conv["id"])
-        
-        # 格式化时间
-        updated_time = datetime.fromisoformat(conv["updated_at"].replace('Z', '+00:00'))
-        time_str = updated_time.strftime("%m-%d %H:%M")
-        
-        conversation_items.append(ConversationItem(
+    conversation_items = [
+        ConversationItem(
             id=conv["id"],
             title=conv["title"],
-            preview=preview,
-            time=time_str,
-            message_count= len(conv.get("messages", []))
-        ))
+            preview=conv["preview"],
+            time=conv["updated_at"].strftime("%m-%d %H:%M") if conv["updated_at"] else "",
+            message_count=conv["message_count"]
+        )
+        for conv in conversations
+    ]
     
-    return ConversationListResponse(conversations=conversation_items)
+    return ConversationListResponse(conversations=conversation_items, next_cursor=next_cursor)
 
 @router.get("/conversations/{conversation_id}")
-async def get_conversation(conversation_id: str):
-    """获取对话详情"""
-    conversation = conversation_manager.get_conversation(conversation_id)
+async def get_conversation(conversation_id: str, limit: int = 100, before: Optional[int] = None):
+    """获取对话详情：最新的 limit 条消息；传入 before（上一页的 next_before）继续向前翻页"""
+    limit = max(1, min(limit, 500))
+    conversation = await chat_repository.get_conversation_page(conversation_id, limit=limit, before=before)
     if not conversation:
         raise HTTPException(status_code=404, detail="对话不存在")
     
@@ -529,7 +580,7 @@ async def get_conversation(conversation_id: str):
 @router.delete("/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str):
     """删除对话"""
-    success = conversation_manager.delete_conversation(conversation_id)
+    success = await chat_repository.delete_conversation(conversation_id)
     if not success:
         raise HTTPException(status_code=404, detail="对话不存在")
     
@@ -538,7 +589,7 @@ async def delete_conversation(conversation_id: str):
 @router.post("/conversations/{conversation_id}/clear")
 async def clear_conversation(conversation_id: str):
     """清空对话消息"""
-    conversation = conversation_manager.get_conversation(conversation_id)
+    conversation = await chat_repository.get_conversation(conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="对话不存在")
     
@@ -556,13 +607,12 @@ async def conv_retrieval_status(conversation_id: str):
         raise HTTPException(status_code=500, detail=f"获取会话检索状态失败: {str(e)}")
 
 @router.post("/conversations/{conversation_id}/retrieval/rebuild")
-async def conv_retrieval_rebuild(conversation_id: str):
+async def conv_retrieval_rebuild(conversation_id: str, db: Session = Depends(get_db)):
     """重建会话检索空间（根据 file_records 重新抽取并入库）"""
     try:
         # 清空向量库目录
         index_service.rebuild(f"conv_{conversation_id}")
         # 读取 file_records
-        db = SessionLocal()
         rows = db.execute(sql_text(
             "SELECT id, file_name, file_path FROM file_records WHERE conversation_id = :cid AND is_active = 1"
         ), {"cid": conversation_id}).fetchall()
@@ -584,12 +634,17 @@ async def conv_retrieval_rebuild(conversation_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"重建失败: {str(e)}")
 
+@router.get("/llm/usage")
+async def llm_usage():
+    """LLM 累计 token 用量与前缀缓存命中率"""
+    return llm_helper.usage_stats()
+
 @router.post("/reports/generate", response_model=ReportResponse)
 async def generate_report(request: ReportGenerateRequest):
     """生成报告"""
     try:
         # 从对话中提取信息
-        report_info = conversation_manager.extract_report_info(request.conversation_id)
+        report_info = await chat_repository.extract_report_info(request.conversation_id)
         
         # 生成报告
         report_content = await report_agent.generate_report(
@@ -612,7 +667,7 @@ async def generate_report(request: ReportGenerateRequest):
                 "status": "completed"
             }
         }
-        conversation_manager.add_message(request.conversation_id, report_message)
+        await message_writer.add_message(request.conversation_id, report_message)
         
         return ReportResponse(
             report_id=str(uuid.uuid4()),
@@ -648,7 +703,7 @@ async def optimize_report(request: ReportOptimizeRequest):
                 "status": "completed"
             }
         }
-        conversation_manager.add_message(request.conversation_id, report_message)
+        await message_writer.add_message(request.conversation_id, report_message)
         
         return ReportResponse(
             report_id=str(uuid.uuid4()),
@@ -663,7 +718,7 @@ async def generate_report_automatically(conversation_id: str) -> str:
     """自动生成报告"""
     try:
         # 从对话中提取信息
-        report_info = conversation_manager.extract_report_info(conversation_id)
+        report_info = await chat_repository.extract_report_info(conversation_id)
         
         # 生成报告
         report_content = await  report_agent.generate_report(report_info, "standard")
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 
 from app.services.rag_service import rag_service
+from app.services.storage_service import UploadTooLarge
 from fastapi.responses import StreamingResponse
+from app.utils.sse import SSE_HEADERS
 import io
 import urllib.parse
 import re
@@ -19,17 +21,46 @@ class QueryRequest(BaseModel):
     top_k: Optional[int] = 5
 
 
+class FederatedQueryRequest(BaseModel):
+    question: str
+    kbs: Optional[List[str]] = None  # 为空表示检索全部 KB
+    top_k: Optional[int] = 5
+    with_answer: bool = True
+
+
+@router.post("/query")
+async def rag_federated_query(body: FederatedQueryRequest):
+    try:
+        return await rag_service.federated_query(body.question, body.kbs, body.top_k or 5, body.with_answer)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"多知识库检索失败: {str(e)}")
+
+
 @router.post("/kb/{kb_name}/upload")
-async def rag_upload(kb_name: str, file: UploadFile = File(...)):
+async def rag_upload(kb_name: str, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     try:
         result = await rag_service.upload_to_kb(kb_name, file)
         if not result.get("success"):
             raise HTTPException(status_code=400, detail=result.get("error", "上传失败"))
+        # 响应返回后在后台生成并持久化文档分析结果（重复内容已有结果，跳过）
+        if result.get("duplicate_of") is None:
+            background_tasks.add_task(_materialize_summary, kb_name, result["file_name"])
         return result
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"知识库上传失败: {str(e)}")
 
 
+async def _materialize_summary(kb_name: str, file_name: str):
+    try:
+        await rag_service.materialize_summary(kb_name, file_name)
+    except Exception as e:
+        print(f"文档分析物化失败({kb_name}/{file_name}): {e}")
+
+
 @router.get("/kb/{kb_name}/status")
 async def rag_status(kb_name: str):
     try:
@@ -38,14 +69,52 @@ async def rag_status(kb_name: str):
         raise HTTPException(status_code=500, detail=f"知识库状态查询失败: {str(e)}")
 
 
+@router.get("/cache/stats")
+async def rag_cache_stats():
+    return rag_service.cache_stats()
+
+
 @router.post("/kb/{kb_name}/query")
 async def rag_query(kb_name: str, body: QueryRequest):
     try:
-        return rag_service.query(kb_name, body.question, body.top_k or 5)
+        return await rag_service.query(kb_name, body.question, body.top_k or 5)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"知识库检索失败: {str(e)}")
 
 
+@router.post("/kb/{kb_name}/query/stream")
+async def rag_query_stream(kb_name: str, body: QueryRequest):
+    return StreamingResponse(
+        rag_service.query_stream(kb_name, body.question, body.top_k or 5),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+class RetrievalSettingsRequest(BaseModel):
+    strategy: Optional[str] = None  # similarity | mmr | rerank | hybrid | keyword
+    fetch_k: Optional[int] = None
+    lambda_mult: Optional[float] = None
+
+
+@router.get("/kb/{kb_name}/retrieval")
+async def rag_retrieval_settings(kb_name: str):
+    try:
+        return rag_service.get_retrieval_settings(kb_name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取检索配置失败: {str(e)}")
+
+
+@router.put("/kb/{kb_name}/retrieval")
+async def rag_update_retrieval_settings(kb_name: str, body: RetrievalSettingsRequest):
+    try:
+        return rag_service.update_retrieval_settings(kb_name, body.strategy, body.fetch_k, body.lambda_mult)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"更新检索配置失败: {str(e)}")
+
+
 @router.get("/kb/{kb_name}/docs")
 async def rag_docs(kb_name: str):
     try:
@@ -81,9 +150,9 @@ async def rag_preview(kb_name: str, file_name: str, max_len: int = 1200):
 
 
 @router.post("/kb/{kb_name}/docs/{file_name}/summarize")
-async def rag_summarize(kb_name: str, file_name: str):
+async def rag_summarize(kb_name: str, file_name: str, refresh: bool = False):
     try:
-        return await rag_service.summarize_document(kb_name, file_name)
+        return await rag_service.summarize_document(kb_name, file_name, refresh=refresh)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -125,9 +194,9 @@ async def rag_download(kb_name: str, file_name: str, format: str = "txt"):
 
 
 @router.get("/kb/{kb_name}/docs/{file_name}/summary/export")
-async def rag_export_summary(kb_name: str, file_name: str, format: str = "txt"):
+async def rag_export_summary(kb_name: str, file_name: str, format: str = "txt", refresh: bool = False):
     try:
-        summary = await rag_service.summarize_document(kb_name, file_name)
+        summary = await rag_service.summarize_document(kb_name, file_name, refresh=refresh)
         data = rag_service.export_summary_text(summary, as_markdown=(format == "md"))
         buf = io.BytesIO(data)
         ext = 'md' if format == 'md' else 'txt'
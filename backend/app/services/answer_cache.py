@@ -0,0 +1,124 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_SEMANTIC,
+    ANSWER_CACHE_SIM_THRESHOLD,
+)
+
+_SPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = "?？。.!！~～ "
+
+
+def normalize_question(question: str) -> str:
+    q = _SPACE_RE.sub(" ", (question or "").strip().lower())
+    return q.rstrip(_TRAILING_PUNCT)
+
+
+class AnswerCache:
+    """知识库问答缓存，key 为 (scope, scope 版本, top_k, 归一化问题)。
+
+    - scope 为 KB 名（文件问答用 file:<file_id>），版本随 KB 写入递增，旧版本条目自然失效
+    - top_k 影响检索到的上下文，按精确值匹配（不参与语义比较）
+    - 可选语义匹配：同一 scope/版本/top_k 下问题向量余弦相似度超过阈值即视为命中；
+      向量为原始问题的 embedding，与检索用的查询向量是同一个
+    - TTL + LRU 条数上限淘汰；KB 写入时按 scope 主动清理
+    """
+
+    def __init__(self, enabled: bool = ANSWER_CACHE_ENABLED, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl: int = ANSWER_CACHE_TTL, semantic: bool = ANSWER_CACHE_SEMANTIC,
+                 threshold: float = ANSWER_CACHE_SIM_THRESHOLD):
+        self.enabled = enabled
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.semantic = semantic
+        self.threshold = threshold
+        self._entries: "OrderedDict[Tuple[str, int, int, str], Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _expired(self, entry: Dict, now: float) -> bool:
+        return self.ttl > 0 and entry["expires_at"] < now
+
+    def get(self, scope: str, version: int, question: str,
+            query_vector: Optional[List[float]] = None, top_k: int = 0) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        key = (scope, version, top_k, normalize_question(question))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._expired(entry, now):
+                del self._entries[key]
+                entry = None
+            if entry is None and self.semantic and query_vector is not None:
+                entry = self._semantic_lookup(key[:3], query_vector, now)
+                if entry is not None:
+                    self._stats["semantic_hits"] += 1
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(entry["key"])
+            self._stats["hits"] += 1
+            return entry["value"]
+
+    def _semantic_lookup(self, prefix: Tuple[str, int, int], query_vector: List[float], now: float) -> Optional[Dict]:
+        candidates = [
+            e for k, e in self._entries.items()
+            if k[:3] == prefix and e["vector"] is not None and not self._expired(e, now)
+        ]
+        if not candidates:
+            return None
+        q = np.asarray(query_vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        matrix = np.stack([e["vector"] for e in candidates])
+        sims = matrix @ q
+        best = int(np.argmax(sims))
+        return candidates[best] if sims[best] >= self.threshold else None
+
+    def put(self, scope: str, version: int, question: str, value: Dict,
+            query_vector: Optional[List[float]] = None, top_k: int = 0):
+        if not self.enabled:
+            return
+        key = (scope, version, top_k, normalize_question(question))
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            self._entries[key] = {"key": key, "value": value, "vector": vector, "expires_at": time.time() + self.ttl}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, scope: str):
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == scope]
+            for k in stale:
+                del self._entries[k]
+            self._stats["invalidations"] += len(stale)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "semantic": self.semantic,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+# 全局答案缓存实例
+answer_cache = AnswerCache()
@@ -0,0 +1,273 @@
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, update
+
+from app.database import async_session_scope
+from app.models import Conversation, Message, FileRecord, FileAnalysis
+from app.services.db_service import (
+    conversation_page_select,
+    conversation_page_rows,
+    message_window_select,
+    message_rows_to_dicts,
+    next_sequence_update,
+    max_sequence_select,
+    title_update,
+    file_select,
+    files_by_conversation_select,
+    file_rows_to_dicts,
+    encode_analysis,
+)
+from app.utils import json_codec
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncChatRepository:
+    """聊天热路径使用的异步数据访问层（SQLAlchemy asyncio + aiosqlite / asyncpg）。
+
+    语义与 DatabaseService / ConversationManagerUseSql 保持一致，区别在于 DB I/O 通过 await 让出事件循环，
+    一个慢提交不会卡住其他 WebSocket。每次调用在独立的异步会话作用域内完成，返回普通 dict。
+    查询语句与 DatabaseService 共用 db_service 中的构造函数，两边只在执行方式上不同。
+    """
+
+    # 对话
+    async def create_conversation(self, title: Optional[str] = None, user_id: Optional[str] = None) -> str:
+        async with async_session_scope() as db:
+            conversation = Conversation(title=title or "新对话", user_id=user_id)
+            db.add(conversation)
+            await db.commit()
+            return conversation.id
+
+    async def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        async with async_session_scope() as db:
+            conversation = await db.get(Conversation, conversation_id)
+            return conversation.to_dict() if conversation else None
+
+    async def get_conversation_page(self, conversation_id: str, limit: int = 100,
+                                    before: Optional[int] = None) -> Optional[Dict]:
+        """对话及一页消息：sequence < before 的最新 limit 条（按时间正序），见 ConversationManagerUseSql"""
+        conversation = await self.get_conversation(conversation_id)
+        if not conversation:
+            return None
+        messages = await self.get_message_window(conversation_id, before=before, limit=limit + 1, tail=True)
+        has_more = len(messages) > limit
+        if has_more:
+            messages = messages[1:]
+        conversation["messages"] = messages
+        conversation["has_more"] = has_more
+        conversation["next_before"] = messages[0]["sequence"] if has_more else None
+        return conversation
+
+    async def list_conversations(self, limit: int = 50, cursor: Optional[str] = None,
+                                 user_id: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """对话列表 keyset 分页，返回 (当前页, 下一页 cursor)"""
+        stmt = conversation_page_select(user_id, limit, cursor)
+        async with async_session_scope() as db:
+            rows = (await db.execute(stmt)).all()
+        return conversation_page_rows(rows, limit)
+
+    async def delete_conversation(self, conversation_id: str) -> bool:
+        """软删除"""
+        async with async_session_scope() as db:
+            result = await db.execute(
+                update(Conversation).where(Conversation.id == conversation_id).values(is_active=False)
+            )
+            await db.commit()
+            return result.rowcount > 0
+
+    # 消息
+    async def add_message(self, conversation_id: str, message: Dict) -> bool:
+        """单事务追加消息（next_sequence 原子递增 + 插入 + 首条消息生成标题），见 DatabaseService.add_message
+
+        与 ConversationManagerUseSql.add_message 一致，写入失败返回 False（异常连同堆栈记入日志），不中断对话。
+        """
+        try:
+            async with async_session_scope() as db:
+                await self.append_message(db, conversation_id, message)
+                await db.commit()
+            return True
+        except Exception:
+            logger.exception("添加消息失败: conversation_id=%s", conversation_id)
+            return False
+
+    async def append_message(self, db, conversation_id: str, message: Dict):
+        """在调用方的会话中追加一条消息，不提交（供批量写入 / group commit 复用）"""
+        content = message["content"]
+        now = datetime.now()
+        row = (await db.execute(next_sequence_update(conversation_id, content, now))).first()
+        if row is not None:
+            sequence, title = row[0] - 1, row[1]
+        else:
+            sequence, title = (await db.scalar(max_sequence_select(conversation_id)) or 0) + 1, None
+
+        db.add(Message(
+            conversation_id=conversation_id,
+            role=message["role"],
+            content=content,
+            tool_call=message.get("tool_call"),
+            created_at=now,
+            sequence=sequence,
+        ))
+        await db.flush()
+        if sequence == 1 and title == "新对话":
+            await db.execute(title_update(conversation_id, content))
+
+    async def get_message_window(self, conversation_id: str, after: Optional[int] = None,
+                                 before: Optional[int] = None, limit: int = 1000, tail: bool = False,
+                                 columns: Optional[Sequence[str]] = None) -> List[Dict]:
+        """按 sequence 取一段消息，参数含义同 DatabaseService.get_message_window"""
+        stmt, names = message_window_select(conversation_id, after, before, limit, tail, columns)
+        async with async_session_scope() as db:
+            rows = (await db.execute(stmt)).all()
+        return message_rows_to_dicts(rows, names, tail)
+
+    async def get_summary_state(self, conversation_id: str) -> Tuple[str, int]:
+        async with async_session_scope() as db:
+            row = (await db.execute(
+                select(Conversation.summary, Conversation.summary_upto).where(Conversation.id == conversation_id)
+            )).first()
+        if row is None:
+            return "", 0
+        return row[0] or "", row[1] or 0
+
+    async def get_history_context(self, conversation_id: str, limit: int) -> Tuple[str, List[Dict]]:
+        """(滚动摘要, 摘要之后的最近 limit 条消息)，消息只含 role / content"""
+        summary, summary_upto = await self.get_summary_state(conversation_id)
+        messages = await self.get_message_window(
+            conversation_id, after=summary_upto, limit=limit, tail=True, columns=("role", "content")
+        )
+        return summary, messages
+
+    async def get_messages_after(self, conversation_id: str, sequence: int, limit: int = 1000,
+                                 columns: Optional[Sequence[str]] = None) -> List[Dict]:
+        """sequence 之后最早的 limit 条消息（按时间正序），供摘要从 summary_upto 起依次折叠"""
+        return await self.get_message_window(conversation_id, after=sequence, limit=limit, columns=columns)
+
+    async def update_summary(self, conversation_id: str, summary: str, summary_upto: int) -> bool:
+        async with async_session_scope() as db:
+            result = await db.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id)
+                .values(summary=summary, summary_upto=summary_upto)
+            )
+            await db.commit()
+            return result.rowcount > 0
+
+    async def extract_report_info(self, conversation_id: str) -> Dict:
+        """从对话中提取报告信息（主题 / 需求 / 数据点 / 结论 / 原始对话）"""
+        messages = await self.get_message_window(conversation_id, columns=("role", "content"))
+        report_info = _report_info_from_messages(messages)
+        # 如果没有明确主题，使用对话标题
+        if not report_info["topic"]:
+            conversation = await self.get_conversation(conversation_id)
+            if conversation:
+                report_info["topic"] = conversation.get("title", "未命名报告")
+        return report_info
+
+    # 文件记录
+    async def create_file_record(self, conversation_id: str, file_name: str, file_path: str,
+                                 file_size: int, file_format: str, file_info: dict = None,
+                                 analysis_data: dict = None, insights: str = None) -> Dict:
+        now = datetime.now()
+        record = FileRecord(
+            id=str(uuid.uuid4()),
+            conversation_id=conversation_id,
+            file_name=file_name,
+            file_path=file_path,
+            file_size=file_size,
+            file_format=file_format,
+            file_info=file_info or None,
+            insights=insights,
+            created_at=now,
+            updated_at=now,
+            is_active=True,
+        )
+        analysis = encode_analysis(analysis_data)
+        async with async_session_scope() as db:
+            db.add(record)
+            if analysis:
+                db.add(FileAnalysis(file_id=record.id, data=analysis, created_at=now))
+            await db.commit()
+        result = record.to_dict()
+        result["analysis_data"] = analysis_data
+        return result
+
+    async def get_files_by_conversation(self, conversation_id: str, limit: int = 100,
+                                        columns: Optional[Sequence[str]] = None) -> List[Dict]:
+        """文件列表（不含分析结果），参数含义同 DatabaseService.get_files_by_conversation"""
+        stmt = files_by_conversation_select(conversation_id, limit, columns)
+        async with async_session_scope() as db:
+            return file_rows_to_dicts(await db.execute(stmt))
+
+    async def get_file_by_id(self, file_id: str, include_analysis: bool = False,
+                             columns: Optional[Sequence[str]] = None) -> Optional[Dict]:
+        stmt = file_select(columns).where(FileRecord.id == file_id, FileRecord.is_active == True)  # noqa: E712
+        async with async_session_scope() as db:
+            files = file_rows_to_dicts(await db.execute(stmt))
+        if not files:
+            return None
+        if include_analysis:
+            files[0]["analysis_data"] = await self.get_file_analysis(file_id)
+        return files[0]
+
+    async def get_file_analysis(self, file_id: str, decode: bool = True):
+        """文件分析结果；decode=False 返回 JSON 原文"""
+        async with async_session_scope() as db:
+            data = await db.scalar(select(FileAnalysis.data).where(FileAnalysis.file_id == file_id))
+        if data is None:
+            return None
+        return json_codec.loads(data) if decode else data
+
+
+def _report_info_from_messages(messages: List[Dict]) -> Dict:
+    report_info = {
+        "topic": "",
+        "requirements": [],
+        "data_points": [],
+        "conclusions": [],
+        "raw_content": ""
+    }
+
+    # 分析对话内容，提取报告要素
+    for message in messages:
+        if message["role"] == "user":
+            content = message["content"].lower()
+            report_info["raw_content"] += f"用户: {message['content']}\n"
+
+            # 提取主题
+            if not report_info["topic"]:
+                if any(keyword in content for keyword in ["报告", "分析", "研究", "总结"]):
+                    report_info["topic"] = _extract_topic(message["content"])
+
+            # 提取需求
+            if any(keyword in content for keyword in ["需要", "要求", "希望", "想要"]):
+                report_info["requirements"].append(message["content"])
+
+            # 提取数据点
+            if any(keyword in content for keyword in ["数据", "统计", "数字", "百分比"]):
+                report_info["data_points"].append(message["content"])
+
+            # 提取结论观点
+            if any(keyword in content for keyword in ["结论", "总结", "认为", "觉得"]):
+                report_info["conclusions"].append(message["content"])
+
+        elif message["role"] == "assistant":
+            report_info["raw_content"] += f"助手: {message['content']}\n"
+    return report_info
+
+
+def _extract_topic(content: str) -> str:
+    """从内容中提取主题：取“关于 / 有关 / 针对 / 对于”之后的内容，否则取前 30 个字符"""
+    for keyword in ["关于", "有关", "针对", "对于"]:
+        if keyword in content:
+            topic = content[content.find(keyword) + len(keyword):].strip()
+            if topic:
+                return topic[:50] + "..." if len(topic) > 50 else topic
+    return content[:30] + "..." if len(content) > 30 else content
+
+
+# 全局异步仓储实例
+chat_repository = AsyncChatRepository()
@@ -1,12 +1,204 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, asc, text
+from sqlalchemy import desc, asc, text, update, func, tuple_, select
 from fastapi import Depends
-from typing import List, Optional
-from app.models import Conversation, Message
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.models import Conversation, Message, FileRecord, FileAnalysis
 from datetime import datetime
 from app.database import get_db
+from app.utils import json_codec
 import uuid
-import json
+import base64
+
+# Message.to_dict 对应的列，供投影查询使用
+MESSAGE_COLUMNS = ("id", "conversation_id", "role", "content", "tool_call", "created_at", "sequence")
+
+# FileRecord.to_dict 对应的列（分析结果在 file_analysis 表，不在其中）
+FILE_COLUMNS = ("id", "conversation_id", "file_name", "file_path", "file_size", "file_format",
+                "file_info", "insights", "created_at", "updated_at", "is_active")
+
+def file_select(columns: Optional[Sequence[str]] = None):
+    """文件记录的投影查询；未选中的 JSON 列不会被读取和解码"""
+    names = list(columns or FILE_COLUMNS)
+    unknown = set(names) - set(FILE_COLUMNS)
+    if unknown:
+        raise ValueError(f"未知的文件字段: {', '.join(sorted(unknown))}")
+    return select(*[getattr(FileRecord, name) for name in names])
+
+def files_by_conversation_select(conversation_id: str, limit: int = 100, columns: Optional[Sequence[str]] = None):
+    """对话的有效文件记录，按上传时间倒序"""
+    return file_select(columns)\
+        .where(FileRecord.conversation_id == conversation_id, FileRecord.is_active == True)\
+        .order_by(desc(FileRecord.created_at))\
+        .limit(limit)
+
+def file_rows_to_dicts(result) -> List[dict]:
+    files = []
+    for row in result.mappings():
+        item = dict(row)
+        for key in ("created_at", "updated_at"):
+            if item.get(key) is not None:
+                item[key] = item[key].isoformat()
+        if "is_active" in item:
+            item["is_active"] = bool(item["is_active"]) if item["is_active"] is not None else True
+        files.append(item)
+    return files
+
+def encode_analysis(analysis_data: Optional[dict]) -> Optional[str]:
+    """编码分析结果，无法序列化时放弃（不影响文件记录本身）"""
+    if not analysis_data:
+        return None
+    try:
+        return json_codec.dumps(analysis_data)
+    except (TypeError, ValueError):
+        return None
+
+def message_preview(content: str) -> str:
+    """对话列表中展示的最后一条消息预览"""
+    return content[:50] + "..." if len(content) > 50 else content
+
+def extract_title(message: str) -> str:
+    """从首条消息中提取对话标题"""
+    message = message.strip()
+    
+    if len(message) <= 20:
+        return message
+    
+    # 常见的标题关键词
+    title_keywords = [
+        "如何", "怎么", "为什么", "是什么", "介绍", "说明", "解释",
+        "写一篇", "写一个", "生成", "创建", "制作", "设计",
+        "帮忙", "请帮我", "帮我", "需要", "想要", "想了解"
+    ]
+    
+    # 检查是否包含标题关键词
+    for keyword in title_keywords:
+        if keyword in message:
+            keyword_index = message.find(keyword)
+            if keyword_index >= 0:
+                start_index = max(0, keyword_index)
+                end_index = min(len(message), start_index + 30)
+                title_candidate = message[start_index:end_index].strip()
+                if len(title_candidate) > 5:
+                    return title_candidate[:20] + "..." if len(title_candidate) > 20 else title_candidate
+    
+    # 如果没有找到关键词，提取前20个字符
+    title = message[:20].strip()
+    if len(message) > 20:
+        title += "..."
+    
+    return title
+
+def encode_cursor(updated_at: datetime, conversation_id: str) -> str:
+    raw = f"{updated_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        updated_at, conversation_id = raw.split("|", 1)
+        return datetime.fromisoformat(updated_at), conversation_id
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("非法的分页 cursor") from e
+
+def conversations_select(user_id: Optional[str] = None, limit: int = 100):
+    """有效对话（ORM 对象），按更新时间倒序"""
+    stmt = select(Conversation).where(Conversation.is_active == True)
+    if user_id:
+        stmt = stmt.where(Conversation.user_id == user_id)
+    return stmt.order_by(desc(Conversation.updated_at)).limit(limit)
+
+def conversation_page_select(user_id: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None):
+    """对话列表 keyset 分页查询：按 updated_at DESC, id DESC，多取一行用于判断是否还有下一页"""
+    stmt = select(
+        Conversation.id,
+        Conversation.title,
+        Conversation.updated_at,
+        Conversation.message_count,
+        Conversation.last_message_preview,
+    ).where(Conversation.is_active == True)
+    if user_id:
+        stmt = stmt.where(Conversation.user_id == user_id)
+    if cursor:
+        updated_at, last_id = decode_cursor(cursor)
+        # 行值比较，SQLite / PostgreSQL 都能直接走 (is_active, updated_at, id) 索引做范围扫描
+        stmt = stmt.where(tuple_(Conversation.updated_at, Conversation.id) < (updated_at, last_id))
+    return stmt.order_by(desc(Conversation.updated_at), desc(Conversation.id)).limit(limit + 1)
+
+def conversation_page_rows(rows, limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """conversation_page_select 的结果转为 (当前页, 下一页 cursor)"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+    return [
+        {
+            "id": row.id,
+            "title": row.title,
+            "updated_at": row.updated_at,
+            "message_count": row.message_count or 0,
+            "preview": row.last_message_preview or "",
+        }
+        for row in rows
+    ], next_cursor
+
+def message_window_select(conversation_id: str, after: Optional[int] = None, before: Optional[int] = None,
+                          limit: int = 1000, tail: bool = False, columns: Optional[Sequence[str]] = None):
+    """按 sequence 取一段消息的投影查询，返回 (语句, 列名)；参数含义见 DatabaseService.get_message_window"""
+    names = list(columns or MESSAGE_COLUMNS)
+    unknown = set(names) - set(MESSAGE_COLUMNS)
+    if unknown:
+        raise ValueError(f"未知的消息字段: {', '.join(sorted(unknown))}")
+    stmt = select(*[getattr(Message, name) for name in names]).where(Message.conversation_id == conversation_id)
+    if after is not None:
+        stmt = stmt.where(Message.sequence > after)
+    if before is not None:
+        stmt = stmt.where(Message.sequence < before)
+    order = desc(Message.sequence) if tail else asc(Message.sequence)
+    return stmt.order_by(order).limit(limit), names
+
+def message_rows_to_dicts(rows, names: Sequence[str], tail: bool = False) -> List[Dict]:
+    """message_window_select 的结果转为按时间正序的 dict 列表"""
+    rows = list(rows)
+    if tail:
+        rows.reverse()
+    messages = []
+    for row in rows:
+        item = dict(zip(names, row))
+        if item.get("created_at") is not None:
+            item["created_at"] = item["created_at"].isoformat()
+        messages.append(item)
+    return messages
+
+def next_sequence_update(conversation_id: str, content: str, now: datetime):
+    """原子递增 conversations.next_sequence 并维护消息数 / 预览 / 更新时间，RETURNING (next_sequence, title)
+
+    同时持有该对话的写锁，并发追加不会拿到相同序号；分配到的序号为 next_sequence - 1。
+    """
+    return (
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(
+            next_sequence=Conversation.next_sequence + 1,
+            message_count=Conversation.message_count + 1,
+            last_message_preview=message_preview(content),
+            updated_at=now,
+        )
+        .returning(Conversation.next_sequence, Conversation.title)
+    )
+
+def last_message_content_select(conversation_id: str):
+    """对话最后一条消息的内容（按创建时间）"""
+    return select(Message.content).where(Message.conversation_id == conversation_id)\
+        .order_by(desc(Message.created_at)).limit(1)
+
+def max_sequence_select(conversation_id: str):
+    """对话记录不存在（历史遗留数据）时，按已有最大序号分配"""
+    return select(func.max(Message.sequence)).where(Message.conversation_id == conversation_id)
+
+def title_update(conversation_id: str, content: str):
+    """首条消息到达且标题仍是默认值时，用消息内容生成标题"""
+    return update(Conversation).where(Conversation.id == conversation_id).values(title=extract_title(content))
+
 class DatabaseService:
     def __init__(self, db: Session):
         self.db = db
@@ -29,11 +221,7 @@ class DatabaseService:
     
     def get_conversations(self, user_id: Optional[str] = None, limit: int = 100) -> List[Conversation]:
         """获取对话列表"""
-        query = self.db.query(Conversation).filter(Conversation.is_active == True)
-        if user_id:
-            query = query.filter(Conversation.user_id == user_id)
-        
-        return query.order_by(desc(Conversation.updated_at)).limit(limit).all()
+        return self.db.scalars(conversations_select(user_id, limit)).all()
     
     def update_conversation_title(self, conversation_id: str, title: str) -> bool:
         """更新对话标题"""
@@ -54,88 +242,61 @@ class DatabaseService:
             return True
         return False
     
+    def list_conversation_page(self, user_id: Optional[str] = None, limit: int = 50,
+                               cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """对话列表（一次查询）：按 updated_at DESC, id DESC 做 keyset 分页
+
+        预览与消息数取自 add_message 维护的列，不再逐个对话查消息。
+        返回 (当前页, 下一页 cursor)；没有更多数据时 cursor 为 None。
+        """
+        rows = self.db.execute(conversation_page_select(user_id, limit, cursor)).all()
+        return conversation_page_rows(rows, limit)
+
     def get_conversation_preview(self, conversation_id: str) -> str:
         """获取对话预览"""
-        # 获取最后一条消息
-        last_message = self.db.query(Message)\
-            .filter(Message.conversation_id == conversation_id)\
-            .order_by(desc(Message.created_at))\
-            .first()
-        
-        if last_message:
-            content = last_message.content
-            return content[:50] + "..." if len(content) > 50 else content
-        return ""
+        content = self.db.scalar(last_message_content_select(conversation_id))
+        return message_preview(content) if content is not None else ""
     
     def generate_smart_title(self, conversation_id: str, first_message: str) -> str:
         """智能生成对话标题"""
-        title = self._extract_title_from_message(first_message)
+        title = extract_title(first_message)
         self.update_conversation_title(conversation_id, title)
         return title
     
-    def _extract_title_from_message(self, message: str) -> str:
-        """从消息中提取标题"""
-        message = message.strip()
-        
-        if len(message) <= 20:
-            return message
-        
-        # 常见的标题关键词
-        title_keywords = [
-            "如何", "怎么", "为什么", "是什么", "介绍", "说明", "解释",
-            "写一篇", "写一个", "生成", "创建", "制作", "设计",
-            "帮忙", "请帮我", "帮我", "需要", "想要", "想了解"
-        ]
-        
-        # 检查是否包含标题关键词
-        for keyword in title_keywords:
-            if keyword in message:
-                keyword_index = message.find(keyword)
-                if keyword_index >= 0:
-                    start_index = max(0, keyword_index)
-                    end_index = min(len(message), start_index + 30)
-                    title_candidate = message[start_index:end_index].strip()
-                    if len(title_candidate) > 5:
-                        return title_candidate[:20] + "..." if len(title_candidate) > 20 else title_candidate
-        
-        # 如果没有找到关键词，提取前20个字符
-        title = message[:20].strip()
-        if len(message) > 20:
-            title += "..."
-        
-        return title
-    
     # 消息相关操作
     def add_message(self, conversation_id: str, role: str, content: str, 
                    tool_call: Optional[dict] = None, user_id: Optional[str] = None) -> Message:
-        """添加消息"""
-        # 获取消息序列号
-        message_count = self.db.query(Message)\
-            .filter(Message.conversation_id == conversation_id)\
-            .count()
-        
-        message = Message(
-            conversation_id=conversation_id,
-            role=role,
-            content=content,
-            tool_call=tool_call,
-            sequence=message_count + 1
-        )
-        
-        self.db.add(message)
-        self.db.commit()
-        self.db.refresh(message)
-        
-        # 更新对话的更新时间
-        conversation = self.get_conversation(conversation_id)
-        if conversation:
-            conversation.updated_at = datetime.now()
-            self.db.commit()
-            
+        """添加消息
+
+        单事务完成：原子递增 conversations.next_sequence 分配序号（UPDATE ... RETURNING，
+        同时持有该对话的写锁，并发追加不会拿到相同序号）→ 插入消息 → 首条消息时生成标题 → 一次提交。
+        """
+        now = datetime.now()
+        try:
+            row = self.db.execute(next_sequence_update(conversation_id, content, now)).first()
+            if row is not None:
+                sequence, title = row[0] - 1, row[1]
+            else:
+                # 对话记录不存在（历史遗留数据），退回按已有最大序号分配
+                sequence, title = (self.db.scalar(max_sequence_select(conversation_id)) or 0) + 1, None
+
+            message = Message(
+                conversation_id=conversation_id,
+                role=role,
+                content=content,
+                tool_call=tool_call,
+                created_at=now,
+                sequence=sequence
+            )
+            self.db.add(message)
+
             # 如果是第一条消息且标题是默认的，智能生成标题
-            if message_count == 0 and conversation.title == "新对话":
-                self.generate_smart_title(conversation_id, content)
-        
+            if sequence == 1 and title == "新对话":
+                self.db.execute(title_update(conversation_id, content))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
         return message
     
     def get_messages(self, conversation_id: str, limit: int = 1000) -> List[Message]:
@@ -146,11 +307,40 @@ class DatabaseService:
             .limit(limit)\
             .all()
     
+    def get_message_window(self, conversation_id: str, after: Optional[int] = None, before: Optional[int] = None,
+                           limit: int = 1000, tail: bool = False,
+                           columns: Optional[Sequence[str]] = None) -> List[Dict]:
+        """按 sequence 取一段消息，按时间正序返回 dict（不构造 ORM 对象）
+
+        - after / before：keyset 边界（不含），走 (conversation_id, sequence) 索引
+        - tail=True 取满足条件的最新 limit 条，否则取最早的 limit 条
+        - columns 只查询指定列，默认全部列
+        """
+        stmt, names = message_window_select(conversation_id, after, before, limit, tail, columns)
+        return message_rows_to_dicts(self.db.execute(stmt).all(), names, tail)
+    
+    def update_conversation_summary(self, conversation_id: str, summary: str, summary_upto: int) -> bool:
+        """更新对话的滚动摘要及其覆盖到的消息序号"""
+        conversation = self.get_conversation(conversation_id)
+        if conversation:
+            conversation.summary = summary
+            conversation.summary_upto = summary_upto
+            self.db.commit()
+            return True
+        return False
+    
     def clear_conversation_messages(self, conversation_id: str) -> bool:
         """清空对话消息"""
         self.db.query(Message)\
             .filter(Message.conversation_id == conversation_id)\
             .delete()
+        conversation = self.get_conversation(conversation_id)
+        if conversation:
+            conversation.summary = None
+            conversation.summary_upto = 0
+            conversation.next_sequence = 1
+            conversation.message_count = 0
+            conversation.last_message_preview = ""
         self.db.commit()
         return True
     
@@ -158,147 +348,63 @@ class DatabaseService:
     def create_file_record(self, conversation_id: str, file_name: str, file_path: str, 
                           file_size: int, file_format: str, file_info: dict = None,
                           analysis_data: dict = None, insights: str = None) -> dict:
-        """创建文件记录"""
+        """创建文件记录；分析结果写入 file_analysis 表，与文件记录同一事务提交"""
         try:
-            file_id = str(uuid.uuid4())
-            created_at = datetime.now()
-            
-            # 安全的 JSON 序列化
-            def safe_json_dump(data):
-                try:
-                    return json.dumps(data, ensure_ascii=False) if data else None
-                except (TypeError, ValueError):
-                    return None  # 如果序列化失败，返回 None
-
-            file_info_json = safe_json_dump(file_info)
-            analysis_data_json = safe_json_dump(analysis_data)
-            
-            sql = '''
-            INSERT INTO file_records 
-            (id, conversation_id, file_name, file_path, file_size, file_format, 
-             file_info, analysis_data, insights, created_at, updated_at, is_active)
-            VALUES (:id, :conversation_id, :file_name, :file_path, :file_size, :file_format, 
-                    :file_info, :analysis_data, :insights, :created_at, :updated_at, :is_active)
-            '''
-            
-            # 参数传递为字典
-            params = {
-                "id": file_id,
-                "conversation_id": conversation_id,
-                "file_name": file_name,
-                "file_path": file_path,
-                "file_size": file_size,
-                "file_format": file_format,
-                "file_info": file_info_json,
-                "analysis_data": analysis_data_json,
-                "insights": insights,
-                "created_at": created_at,
-                "updated_at": created_at,
-                "is_active": True
-            }
-            
-            # 执行插入操作
-            self.db.execute(text(sql), params)
+            now = datetime.now()
+            record = FileRecord(
+                id=str(uuid.uuid4()),
+                conversation_id=conversation_id,
+                file_name=file_name,
+                file_path=file_path,
+                file_size=file_size,
+                file_format=file_format,
+                file_info=file_info or None,
+                insights=insights,
+                created_at=now,
+                updated_at=now,
+                is_active=True
+            )
+            self.db.add(record)
+            analysis = encode_analysis(analysis_data)
+            if analysis:
+                self.db.add(FileAnalysis(file_id=record.id, data=analysis, created_at=record.created_at))
             self.db.commit()
             
-            return {
-                "id": file_id,
-                "conversation_id": conversation_id,
-                "file_name": file_name,
-                "file_path": file_path,
-                "file_size": file_size,
-                "file_format": file_format,
-                "file_info": file_info,
-                "analysis_data": analysis_data,
-                "insights": insights,
-                "created_at": created_at.isoformat(),
-                "updated_at": created_at.isoformat(),
-                "is_active": True
-            }
+            result = record.to_dict()
+            result["analysis_data"] = analysis_data
+            return result
         except Exception as e:
             self.db.rollback()
             raise Exception(f"创建文件记录失败: {str(e)}")
-    def get_files_by_conversation(self, conversation_id: str, limit: int = 100) -> List[dict]:
-        """根据对话ID获取文件列表"""
-        try:
-            sql = f'''
-            SELECT id, conversation_id, file_name, file_path, file_size, file_format,
-                file_info, analysis_data, insights, created_at, updated_at, is_active
-            FROM file_records 
-            WHERE conversation_id = :conversation_id AND is_active = 1 
-            ORDER BY created_at DESC 
-            LIMIT {limit}
-            '''
-            
-            results = self.db.execute(text(sql), {"conversation_id": conversation_id}).fetchall()
-            files = []
 
-            for result in results:
-                def safe_json_load(val):
-                    if not val:
-                        return None
-                    try:
-                        return json.loads(val)
-                    except json.JSONDecodeError:
-                        return {"raw": val}
-                
-                files.append({
-                    "id": result[0],
-                    "conversation_id": result[1],
-                    "file_name": result[2],
-                    "file_path": result[3],
-                    "file_size": result[4],
-                    "file_format": result[5],
-                    "file_info": safe_json_load(result[6]),
-                    "analysis_data": safe_json_load(result[7]),
-                    "insights": result[8],
-                    "created_at": result[9].isoformat() if hasattr(result[9], "isoformat") else str(result[9]),
-                    "updated_at": result[10].isoformat() if hasattr(result[10], "isoformat") else str(result[10]),
-                    "is_active": bool(result[11]) if result[11] is not None else True
-                })
-            
-            return files
+    def get_files_by_conversation(self, conversation_id: str, limit: int = 100,
+                                  columns: Optional[Sequence[str]] = None) -> List[dict]:
+        """根据对话ID获取文件列表（不含分析结果；columns 只查询指定列，file_info 只在被选中时解码）"""
+        try:
+            return file_rows_to_dicts(self.db.execute(files_by_conversation_select(conversation_id, limit, columns)))
         except Exception as e:
             raise Exception(f"获取文件列表失败: {str(e)}")
         
-    def get_file_by_id(self, file_id: str) -> Optional[dict]:
-        """根据文件ID获取文件记录"""
+    def get_file_by_id(self, file_id: str, include_analysis: bool = False) -> Optional[dict]:
+        """根据文件ID获取文件记录；include_analysis=True 时附带解码后的分析结果"""
         try:
-            sql = '''
-            SELECT id, conversation_id, file_name, file_path, file_size, file_format,
-                   file_info, analysis_data, insights, created_at, updated_at, is_active
-            FROM file_records 
-            WHERE id = ? AND is_active = 1
-            '''
-            
-            result = self.db.execute(text(sql), (file_id,)).fetchone()
-            
-            if result:
-                try:
-                    file_info = json.loads(result[6]) if result[6] else None
-                    analysis_data = json.loads(result[7]) if result[7] else None
-                except:
-                    file_info = result[6]
-                    analysis_data = result[7]
-                
-                return {
-                    "id": result[0],
-                    "conversation_id": result[1],
-                    "file_name": result[2],
-                    "file_path": result[3],
-                    "file_size": result[4],
-                    "file_format": result[5],
-                    "file_info": file_info,
-                    "analysis_data": analysis_data,
-                    "insights": result[8],
-                    "created_at": result[9].isoformat() if result[9] else None,
-                    "updated_at": result[10].isoformat() if result[10] else None,
-                    "is_active": bool(result[11]) if result[11] is not None else True
-                }
-            
-            return None
+            stmt = file_select().where(FileRecord.id == file_id, FileRecord.is_active == True)
+            files = file_rows_to_dicts(self.db.execute(stmt))
+            if not files:
+                return None
+            if include_analysis:
+                files[0]["analysis_data"] = self.get_file_analysis(file_id)
+            return files[0]
         except Exception as e:
             raise Exception(f"获取文件记录失败: {str(e)}")
+
+    def get_file_analysis(self, file_id: str, decode: bool = True):
+        """文件分析结果；decode=False 返回编码后的 JSON 原文（直接作为响应体，省去解码再编码）"""
+        data = self.db.query(FileAnalysis.data).filter(FileAnalysis.file_id == file_id).scalar()
+        if data is None:
+            return None
+        return json_codec.loads(data) if decode else data
+
     def delete_file_record(self, file_id: str) -> bool:
         """删除文件记录（软删除）"""
         try:
@@ -1,28 +1,47 @@
 import os
 import uuid
-from typing import Dict, List
+import asyncio
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
 from fastapi import UploadFile
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA, LLMChain
+from langchain.chains import RetrievalQA
 from langchain_openai.chat_models.base import BaseChatOpenAI
 from langchain.docstore.document import Document
-from queue import Queue
-import threading
+from langchain.docstore.document import Document as LCDocument
 import pdfplumber
 import pandas as pd
 from docx import Document
 from pptx import Presentation
 from unstructured.partition.auto import partition
-import jieba
 from collections import Counter
 import re
 from datetime import datetime
-from app.services.db_service import DatabaseService
-from app.database import SessionLocal
+from app.services.chat_repository import chat_repository
 from app.utils.llm_helper import llm_helper 
+from app.services.retrieval_engine import EngineRetriever, default_settings
+from app.services.retrieval_orchestrator import retrieval_orchestrator
+from app.utils.sse import sse_event
+from app.services.answer_cache import answer_cache
+from app.config import ENTITY_TOP_N, ENTITY_MAX_POSITIONS
+from app.services.text_analysis import text_analyzer, SENTENCE_SPLIT_RE
+from app.services.storage_service import stream_to_file, UploadTooLarge
+
+FILE_QA_SYSTEM_PROMPT = """你是一个专业的知识问答助手，请根据知识上下文和对话历史回答用户问题。
+如果无法根据内容回答，请回复 "根据现有知识无法回答该问题"。"""
+
+
+# 实体类型 -> 匹配规则（None 表示暂未实现，结果恒为空）
+ENTITY_PATTERNS = {
+    "dates": re.compile(r'\d{4}[-年]\d{1,2}[-月]\d{1,2}[日]?'),
+    "numbers": re.compile(r'\d+(?:\.\d+)?'),
+    "organizations": None,
+    "persons": None,
+}
+ENTITY_KINDS = tuple(ENTITY_PATTERNS)
+
 
 class FileService:
     def __init__(self):
@@ -30,24 +49,17 @@ class FileService:
         self.supported_formats = {'.pdf', '.docx', '.xlsx', '.xls', '.txt', '.pptx'}
         # 确保上传目录存在
         os.makedirs(self.upload_dir, exist_ok=True)
-        self.db_service = None
         # 🔥 持久化目录
         self.vector_dir = "./vectorstores"
         self.embeddings = HuggingFaceEmbeddings(model_name="shibing624/text2vec-base-chinese")
         
-    def _get_db_service(self):
-        """获取数据库服务实例"""
-        if not self.db_service:
-            db = SessionLocal()
-            self.db_service = DatabaseService(db)
-        return self.db_service
     # =========================
     # 🔥 1. 构建向量库
     # =========================
     def build_vector_store(self, file_id: str, full_text: str):
         """为某个文件构建向量库"""
         splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        docs = [Document(page_content=chunk, metadata={"file_id": file_id})
+        docs = [LCDocument(page_content=chunk, metadata={"file_id": file_id})
                 for chunk in splitter.split_text(full_text)]
         
         vector_db = Chroma.from_documents(
@@ -68,8 +80,12 @@ class FileService:
     # 🔥 2. 非流式文件问答
     # =========================
     def ask_file(self, file_id: str, question: str) -> dict:
+        # 文件向量库建好后不再变化，版本固定为 0
+        cached = answer_cache.get(f"file:{file_id}", 0, question)
+        if cached is not None:
+            return cached
         vector_db = self._get_vectorstore(file_id)
-        retriever = vector_db.as_retriever(search_type="mmr", search_kwargs={"k": 5})
+        retriever = EngineRetriever(db=vector_db, settings=default_settings(), k=5)
 
         
 
@@ -95,7 +111,7 @@ class FileService:
         )
 
         result = qa_chain({"query": question})
-        return {
+        answer = {
             "answer": result["result"],
             "sources": [
                 {
@@ -104,81 +120,72 @@ class FileService:
                 } for doc in result.get("source_documents", [])
             ]
         }
+        answer_cache.put(f"file:{file_id}", 0, question, answer)
+        return answer
     # =========================
     # 🔥 3. 流式问答（带对话历史）
     # =========================
-    def ask_file_stream(self, file_id: str, messages: List[dict], summary_text: str):
+    def _retrieve_file(self, file_id: str, query: str, k: int = 5) -> List[LCDocument]:
         vector_db = self._get_vectorstore(file_id)
-        retriever = vector_db.as_retriever(search_type="mmr", search_kwargs={"k": 5})
-        
-        query = messages[-1]["content"]
-        docs = retriever.get_relevant_documents(query)
-        context = "\n".join([doc.page_content for doc in docs])
-        history = "\n".join([f"{m['role']}：{m['content']}" for m in messages[:-1]])
+        retriever = EngineRetriever(db=vector_db, settings=default_settings(), k=k)
+        return retriever.get_relevant_documents(query)
 
-        PROMPT_TEMPLATE = """
-        你是一个专业的知识问答助手，请根据以下知识上下文和对话历史回答用户问题。
-        如果无法根据内容回答，请回复 "根据现有知识无法回答该问题"。
+    async def _conversation_summary(self, file_id: str) -> str:
+        record = await chat_repository.get_file_by_id(file_id, columns=("id", "conversation_id"))
+        if not record:
+            return ""
+        summary, _ = await chat_repository.get_summary_state(record["conversation_id"])
+        return summary
 
-        【知识上下文】
-        {context}
+    async def ask_file_stream(self, file_id: str, messages: List[dict], summary_text: str = "") -> AsyncGenerator[str, None]:
+        """文件问答流式输出（SSE）。
 
-        【历史摘要】
-        {summary}
-
-        【历史对话】
-        {history}
-
-        【当前问题】
-        {question}
+        检索在共享线程池中执行，生成走 llm_helper 的异步流，不再为每个请求起线程。
+        生成器按需拉取 token（客户端消费慢时不会堆积）；客户端断开时生成器被关闭，
+        同时关闭上游 LLM 流。
         """
-        chain = LLMChain(
-            llm=llm_helper.llm,
-            prompt=PromptTemplate(
-                input_variables=["context", "summary", "history", "question"],
-                template=PROMPT_TEMPLATE
-            )
-        )
-
-        q = Queue()
-
-        def _callback(token):
-            q.put(token)
-
-        def run_chain():
-            try:
-                chain.run({
-                    "context": context,
-                    "summary": summary_text,
-                    "history": history,
-                    "question": query
-                })
-            finally:
-                q.put(None)
+        query = messages[-1]["content"]
+        if not summary_text:
+            # 未显式传入时，使用文件所属对话的滚动摘要
+            summary_text = await self._conversation_summary(file_id)
+        loop = asyncio.get_running_loop()
+        try:
+            docs = await loop.run_in_executor(retrieval_orchestrator.executor, self._retrieve_file, file_id, query)
+        except Exception as e:
+            yield sse_event("error", {"content": f"文件检索失败: {str(e)}"})
+            return
+        context = "\n".join([doc.page_content for doc in docs])
 
-        threading.Thread(target=run_chain).start()
+        # 稳定到易变：固定指令 → 历史摘要 → 历史对话 → 本轮检索上下文 + 问题，便于命中前缀缓存
+        prompt_messages = [{"role": "system", "content": FILE_QA_SYSTEM_PROMPT}]
+        if summary_text:
+            prompt_messages.append({"role": "system", "content": f"【历史摘要】\n{summary_text}"})
+        prompt_messages += [{"role": m["role"], "content": m["content"]} for m in messages[:-1]]
+        prompt_messages.append({"role": "user", "content": f"【知识上下文】\n{context}\n\n【当前问题】\n{query}"})
 
-        def token_stream():
-            while True:
-                token = q.get()
-                if token is None:
-                    break
-                yield f"data: {token}\n\n"
-
-        return token_stream()
+        stream = llm_helper.chat_completion_stream(prompt_messages)
+        try:
+            async for chunk in stream:
+                if chunk.get("type") == "stream_chunk":
+                    yield sse_event("token", {"content": chunk["content"]})
+                elif chunk.get("type") == "error":
+                    yield sse_event("error", {"content": chunk.get("content", "")})
+                    return
+            yield sse_event("done", {})
+        finally:
+            await stream.aclose()
 
-    async def save_upload_file(self, file: UploadFile, conversation_id: str) -> str:
-        """保存上传的文件"""
+    async def save_upload_file(self, file: UploadFile, conversation_id: str) -> Tuple[str, str]:
+        """流式保存上传的文件，返回 (文件路径, sha256)"""
         try:
             file_extension = os.path.splitext(file.filename)[1].lower()
             unique_filename = f"{conversation_id}_{uuid.uuid4()}{file_extension}"
             file_path = os.path.join(self.upload_dir, unique_filename)
             
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
-            return file_path
+            _, sha256 = await stream_to_file(file, file_path)
+            return file_path, sha256
+        except UploadTooLarge:
+            raise
         except Exception as e:
             raise Exception(f"保存文件失败: {str(e)}")
     
@@ -427,7 +434,8 @@ class FileService:
         ]
 
         try:
-            response = await llm_helper.chat_completion(messages)
+            # 中文约 1 字 ≈ 1 token，留少量余量即可
+            response = await llm_helper.chat_completion(messages, temperature=0.3, max_tokens=max_length + 100, cache=True)
             summary = response["choices"][0]["message"]["content"].strip()
             return summary
         except Exception as e:
@@ -437,12 +445,15 @@ class FileService:
         try:
             full_text = content_data.get("full_text", "")
             word_count, character_count = len(full_text.split()), len(full_text)
-            keywords = self._extract_keywords(full_text)
-            entities = self._extract_entities(full_text)
+            # 分词（长文本走进程池）与实体抽取都是 CPU 密集，放到线程里并发执行，不阻塞事件循环
+            doc, entities = await asyncio.gather(
+                asyncio.to_thread(text_analyzer.document, full_text),
+                asyncio.to_thread(self._extract_entities, full_text),
+            )
+            keywords = self._extract_keywords(doc.tokens)
             summaries = {
-                "summary_100": self._generate_summary(full_text, 100),
-                "summary_300": self._generate_summary(full_text, 300),
-                "summary_1000": self._generate_summary(full_text, 1000),
+                f"summary_{length}": self._generate_summary(full_text, length, doc.sentences)
+                for length in (100, 300, 1000)
             }
             # 可选：调用大模型做更自然的摘要（如果接了 LLM）
             try:
@@ -466,29 +477,73 @@ class FileService:
         except Exception as e:
             raise Exception(f"分析文件内容失败: {str(e)}")
     
-    def _extract_keywords(self, text: str) -> List[Dict]:
+    def _extract_keywords(self, tokens: List[str]) -> List[Dict]:
+        """按词频取关键词，tokens 为文档的分词结果（text_analyzer.document）"""
         try:
-            words = jieba.lcut(text)
-            filtered = [w for w in words if len(w) > 1 and w.isalpha()]
+            filtered = [w for w in tokens if len(w) > 1 and w.isalpha()]
             freq = Counter(filtered)
             return [{"word": w, "frequency": f} for w, f in freq.most_common(20)]
         except Exception:
             return [{"word": "关键词提取失败", "frequency": 0}]
     
-    def _extract_entities(self, text: str) -> Dict:
+    def _extract_entities(self, text: str, top_n: int = ENTITY_TOP_N) -> Dict:
+        """实体统计（紧凑结构）：每类实体只保留总数、去重数和出现最多的 top_n 个值及其前几处位置。
+
+        数字密集的文档（财报、表格）原样保存全部匹配会有几十万个字符串，完整列表通过 iter_entities 按需获取。
+        """
         try:
-            return {
-                "dates": re.findall(r'\d{4}[-年]\d{1,2}[-月]\d{1,2}[日]?', text),
-                "numbers": re.findall(r'\d+(?:\.\d+)?', text),
-                "organizations": [],
-                "persons": []
-            }
+            return {kind: self._summarize_matches(text, kind, top_n) for kind in ENTITY_KINDS}
         except Exception as e:
             return {"error": f"实体识别失败: {str(e)}"}
+
+    @staticmethod
+    def _summarize_matches(text: str, kind: str, top_n: int) -> Dict:
+        pattern = ENTITY_PATTERNS.get(kind)
+        counts: Counter = Counter()
+        positions: Dict[str, List[int]] = {}
+        if pattern is not None:
+            for match in pattern.finditer(text):
+                value = match.group()
+                counts[value] += 1
+                offsets = positions.setdefault(value, [])
+                if len(offsets) < ENTITY_MAX_POSITIONS:
+                    offsets.append(match.start())
+        return {
+            "count": sum(counts.values()),
+            "distinct": len(counts),
+            "top": [
+                {"value": value, "count": count, "positions": positions[value]}
+                for value, count in counts.most_common(top_n)
+            ],
+            "truncated": len(counts) > top_n,
+        }
+
+    @staticmethod
+    def iter_entities(text: str, kind: str):
+        """逐个产出 (实体值, 字符位置)，供按需获取完整实体列表"""
+        pattern = ENTITY_PATTERNS.get(kind)
+        if pattern is None:
+            return
+        for match in pattern.finditer(text):
+            yield match.group(), match.start()
+
+    def get_entities(self, file_path: str, kind: str, offset: int = 0, limit: int = 1000) -> Dict:
+        """从原文件重新抽取某类实体的完整列表（分页），不依赖已存储的分析结果"""
+        if kind not in ENTITY_KINDS:
+            raise ValueError(f"未知的实体类型: {kind}，可选: {', '.join(ENTITY_KINDS)}")
+        full_text = self.extract_content(file_path).get("full_text", "")
+        items, total = [], 0
+        for value, position in self.iter_entities(full_text, kind):
+            if offset <= total < offset + limit:
+                items.append({"value": value, "position": position})
+            total += 1
+        return {"kind": kind, "total": total, "offset": offset, "limit": limit, "items": items}
     
-    def _generate_summary(self, text: str, max_length: int) -> str:
+    def _generate_summary(self, text: str, max_length: int, sentences: Optional[List[str]] = None) -> str:
+        """取开头若干整句；sentences 为已切分好的句子，多个长度的摘要共用一次切分"""
         try:
-            sentences = re.split(r'[。！？.!?]', text)
+            if sentences is None:
+                sentences = SENTENCE_SPLIT_RE.split(text)
             summary, length = "", 0
             for s in sentences:
                 if s.strip() and length + len(s) <= max_length:
@@ -502,8 +557,9 @@ class FileService:
     
     async def process_upload_and_analyze(self, file: UploadFile, conversation_id: str) -> Dict:
         try:
-            file_path = await self.save_upload_file(file, conversation_id)
+            file_path, sha256 = await self.save_upload_file(file, conversation_id)
             file_info = self.get_file_info(file_path, file.filename)
+            file_info["sha256"] = sha256
             content_data = self.extract_content(file_path)
             analysis_data = await self.analyze_content(content_data, file_info)
             insights = self._generate_insights(file_info, analysis_data, content_data)
@@ -521,6 +577,8 @@ class FileService:
                 "insights": insights,
                 "success": True
             }
+        except UploadTooLarge:
+            raise
         except Exception as e:
             return {"error": str(e), "success": False}
     
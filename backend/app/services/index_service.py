@@ -1,9 +1,15 @@
 import os
+import uuid
 from typing import Dict, List, Optional
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.docstore.document import Document
 from app.config import KB_VECTOR_DIR as VECTOR_DIR, EMBEDDING_MODEL
+from app.services.retrieval_engine import retrieval_engine, EngineRetriever, SETTINGS_FILE
+from app.services.lexical_index import LexicalIndex
+from app.services.answer_cache import answer_cache
+
+VERSION_FILE = "version"
 
 
 class IndexService:
@@ -15,18 +21,36 @@ class IndexService:
         os.makedirs(path, exist_ok=True)
         return path
 
+    def kb_version(self, kb: str) -> int:
+        """KB 内容版本号，每次写入递增；用于缓存 key，保证写入后旧答案不再命中。"""
+        try:
+            with open(os.path.join(VECTOR_DIR, kb, VERSION_FILE), "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_version(self, kb: str):
+        version = self.kb_version(kb) + 1
+        with open(os.path.join(self._vs_dir(kb), VERSION_FILE), "w", encoding="utf-8") as f:
+            f.write(str(version))
+        answer_cache.invalidate(kb)
+
     def _db(self, kb: str) -> Chroma:
         return Chroma(embedding_function=self.embeddings, persist_directory=self._vs_dir(kb))
 
     def upsert_docs(self, kb: str, docs: List[Document]) -> Dict:
         vs_dir = self._vs_dir(kb)
+        # 向量库与倒排索引共用 chunk_id，便于混合检索融合
+        ids = [str(uuid.uuid4()) for _ in docs]
         if os.path.exists(os.path.join(vs_dir, "chroma.sqlite3")):
             db = self._db(kb)
-            db.add_documents(docs)
+            db.add_documents(docs, ids=ids)
             db.persist()
         else:
-            db = Chroma.from_documents(docs, embedding=self.embeddings, persist_directory=vs_dir)
+            db = Chroma.from_documents(docs, embedding=self.embeddings, ids=ids, persist_directory=vs_dir)
             db.persist()
+        LexicalIndex(vs_dir).add(ids, docs)
+        self._bump_version(kb)
         return {"chunks": len(docs)}
 
     def delete_file(self, kb: str, file_name: str) -> bool:
@@ -34,13 +58,33 @@ class IndexService:
             db = self._db(kb)
             db.delete(where={"kb": kb, "file": file_name})
             db.persist()
+            LexicalIndex(self._vs_dir(kb)).delete_file(file_name)
+            self._bump_version(kb)
             return True
         except Exception:
             return False
 
-    def retriever(self, kb: str, k: int = 5):
-        db = self._db(kb)
-        return db.as_retriever(search_type="mmr", search_kwargs={"k": max(1, k)})
+    def retriever(self, kb: str, k: int = 5, strategy: Optional[str] = None, fetch_k: Optional[int] = None):
+        """按 KB 的检索配置构建检索器；strategy / fetch_k 可临时覆盖。"""
+        settings = retrieval_engine.get_settings(kb)
+        if strategy:
+            settings["strategy"] = strategy
+        if fetch_k:
+            settings["fetch_k"] = fetch_k
+        return EngineRetriever(db=self._db(kb), settings=settings, k=max(1, k))
+
+    def search(self, kb: str, query: str, k: int = 5, query_vector: Optional[List[float]] = None) -> List[Document]:
+        """按 KB 的检索配置检索，与 retriever(kb, k).get_relevant_documents(query) 相同；
+        query_vector 已算好时直接复用。"""
+        return retrieval_engine.search(self._db(kb), query, max(1, k), retrieval_engine.get_settings(kb),
+                                       query_vector=query_vector)
+
+    def search_by_vector(self, kb: str, query_vector: List[float], k: int, query: Optional[str] = None):
+        """用已计算好的查询向量检索单个 KB，返回 [(Document, distance)]；KB 无索引时返回空列表。"""
+        if not os.path.exists(os.path.join(VECTOR_DIR, kb, "chroma.sqlite3")):
+            return []
+        settings = retrieval_engine.get_settings(kb)
+        return retrieval_engine.search_by_vector(self._db(kb), query_vector, k, settings, query=query)
 
     def total_chunks(self, kb: str) -> int:
         try:
@@ -63,6 +107,8 @@ class IndexService:
         if os.path.exists(vs_dir):
             for root, dirs, files in os.walk(vs_dir, topdown=False):
                 for n in files:
+                    if root == vs_dir and n in (SETTINGS_FILE, VERSION_FILE):
+                        continue  # 保留 KB 检索配置与版本号
                     try:
                         os.remove(os.path.join(root, n))
                     except Exception:
@@ -72,6 +118,7 @@ class IndexService:
                         os.rmdir(os.path.join(root, d))
                     except Exception:
                         pass
+        self._bump_version(kb)
 
 
 index_service = IndexService()
@@ -0,0 +1,136 @@
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import jieba
+from langchain.docstore.document import Document
+
+from app.config import HYBRID_RRF_K, LEXICAL_EXACT_TERMS
+
+LEXICAL_FILE = "lexical.sqlite3"
+
+_TOKEN_RE = re.compile(r"\w", re.UNICODE)
+# 产品编号 / 型号（AX-1000、SKU_12.5）：字母数字组成且至少含一位数字，视为精确词查询
+_EXACT_CODE_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9\-_./#]{1,31}$")
+_DIGIT_RE = re.compile(r"\d")
+
+
+def tokenize(text: str) -> List[str]:
+    """jieba 分词，去掉空白与标点，英文统一小写。"""
+    return [w.lower() for w in jieba.lcut(text or "") if _TOKEN_RE.search(w)]
+
+
+def looks_exact(query: str, terms=LEXICAL_EXACT_TERMS) -> bool:
+    """编号类查询或 LEXICAL_EXACT_TERMS 中登记的名称走精确短语查询；
+    普通短查询（如 2~6 个汉字的问题）不在此列，仍做向量 + BM25 融合"""
+    q = (query or "").strip()
+    if _EXACT_CODE_RE.match(q) and _DIGIT_RE.search(q):
+        return True
+    return q.lower() in terms
+
+
+def _phrase(tokens: List[str]) -> str:
+    return '"' + " ".join(tokens).replace('"', '""') + '"'
+
+
+def rrf_fuse(rankings: List[List[Tuple[str, Document]]], k: int, rrf_k: int = HYBRID_RRF_K) -> List[Document]:
+    """Reciprocal-rank fusion：score = Σ 1 / (rrf_k + rank)，各路结果按 key 去重合并。"""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, (key, doc) in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=lambda key: -scores[key])
+    return [docs[key] for key in ordered[:k]]
+
+
+class LexicalIndex:
+    """基于 SQLite FTS5 的倒排索引，入库时用 jieba 分词，查询用 BM25 排序。
+
+    每个向量库目录下一份 lexical.sqlite3，与 Chroma 共享 chunk_id。
+    每次操作单独打开连接，线程安全；FTS5 不可用时所有查询返回空结果（退化为纯向量检索）。
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, LEXICAL_FILE)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+                "chunk_id UNINDEXED, file UNINDEXED, content UNINDEXED, metadata UNINDEXED, tokens)"
+            )
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def add(self, ids: List[str], docs: List[Document]):
+        rows = [
+            (
+                chunk_id,
+                (doc.metadata or {}).get("file", ""),
+                doc.page_content,
+                json.dumps(doc.metadata or {}, ensure_ascii=False),
+                " ".join(tokenize(doc.page_content)),
+            )
+            for chunk_id, doc in zip(ids, docs)
+        ]
+        if not rows:
+            return
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO chunks (chunk_id, file, content, metadata, tokens) VALUES (?, ?, ?, ?, ?)", rows
+                )
+        except sqlite3.OperationalError as e:
+            print(f"倒排索引写入失败: {e}")
+
+    def delete_file(self, file_name: str):
+        if not self.exists():
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM chunks WHERE file = ?", (file_name,))
+        except sqlite3.OperationalError as e:
+            print(f"倒排索引删除失败: {e}")
+
+    def search(self, query: str, k: int = 5, exact: bool = False) -> List[Tuple[str, Document, float]]:
+        """BM25 检索，返回 [(chunk_id, Document, bm25)]，bm25 越小越相关。
+
+        exact=True 时按短语匹配（编号、名称），否则按分词后的 OR 查询。
+        """
+        if not self.exists():
+            return []
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        if exact:
+            match = _phrase(tokens)
+        else:
+            match = " OR ".join(_phrase([t]) for t in dict.fromkeys(tokens))
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT chunk_id, content, metadata, bm25(chunks) AS score FROM chunks "
+                    "WHERE chunks MATCH ? ORDER BY score LIMIT ?",
+                    (match, max(1, k)),
+                ).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"倒排索引查询失败: {e}")
+            return []
+        results = []
+        for chunk_id, content, metadata, score in rows:
+            meta = json.loads(metadata) if metadata else {}
+            meta.setdefault("chunk_id", chunk_id)
+            results.append((chunk_id, Document(page_content=content, metadata=meta), float(score)))
+        return results
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from app.config import (
+    MESSAGE_GROUP_COMMIT,
+    MESSAGE_GROUP_COMMIT_WINDOW_MS,
+    MESSAGE_GROUP_COMMIT_MAX_BATCH,
+)
+from app.database import async_session_scope
+from app.services.chat_repository import chat_repository
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """消息写入的 group commit。
+
+    开启后 add_message 只把消息放进队列并等待结果；后台写入协程收集一个时间窗口内（或攒满 max_batch 条）
+    的消息，在同一个事务里依次追加、只提交一次，突发写入时多条消息共享一次 fsync。
+    同一对话的消息按入队顺序写入，序号语义与逐条写入一致。批量提交失败时逐条重试，只让真正出错的消息返回 False。
+    队列在写入器的整个生命周期内只有一个；写入协程意外退出时在同一个队列上重启，已入队的消息不会丢失。
+    关闭时直接调用 chat_repository.add_message。
+    """
+
+    def __init__(self, enabled: bool = MESSAGE_GROUP_COMMIT, window_ms: int = MESSAGE_GROUP_COMMIT_WINDOW_MS,
+                 max_batch: int = MESSAGE_GROUP_COMMIT_MAX_BATCH):
+        self.enabled = enabled
+        self.window = max(0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.messages = 0
+
+    async def add_message(self, conversation_id: str, message: Dict) -> bool:
+        if not self.enabled:
+            return await chat_repository.add_message(conversation_id, message)
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((conversation_id, message, future))
+        return await future
+
+    def _ensure_worker(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+            self._worker.add_done_callback(self._on_worker_done)
+
+    def _on_worker_done(self, task: asyncio.Task):
+        if task.cancelled() or task is not self._worker:
+            return
+        logger.error("消息写入协程异常退出，在同一队列上重新启动", exc_info=task.exception())
+        self._worker = None
+        self._ensure_worker()
+
+    async def _run(self):
+        while True:
+            batch: List[Tuple[str, Dict, asyncio.Future]] = []
+            try:
+                await self._collect(batch)
+                results = await self._flush(batch)
+            except BaseException as e:
+                # 已出队的消息不能让调用方一直等下去
+                results = [e] * len(batch)
+                raise
+            finally:
+                self._resolve(batch, results)
+
+    async def _collect(self, batch: List[Tuple[str, Dict, asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                # 窗口已过，只收走已经在排队的
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _flush(self, batch: List[Tuple[str, Dict, asyncio.Future]]) -> List[bool]:
+        try:
+            async with async_session_scope() as db:
+                for conversation_id, message, _ in batch:
+                    await chat_repository.append_message(db, conversation_id, message)
+                await db.commit()
+            results = [True] * len(batch)
+        except Exception:
+            logger.exception("批量写入 %d 条消息失败，逐条重试", len(batch))
+            results = [await chat_repository.add_message(cid, message) for cid, message, _ in batch]
+
+        self.batches += 1
+        self.messages += len(batch)
+        return results
+
+    def _resolve(self, batch: List[Tuple[str, Dict, asyncio.Future]], results: List):
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                if isinstance(result, asyncio.CancelledError):
+                    future.cancel()
+                elif isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self._queue.task_done()
+
+    async def drain(self):
+        """等待队列中的消息写完并停止写入协程（应用关闭时调用）"""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        self._worker = None
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "batches": self.batches,
+            "messages": self.messages,
+            "avg_batch": round(self.messages / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+# 全局消息写入器实例
+message_writer = GroupCommitWriter()
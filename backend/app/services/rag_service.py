@@ -1,14 +1,36 @@
 import os
 import io
-from typing import Dict, List
+import time
+import asyncio
+from functools import partial
+from typing import AsyncGenerator, Dict, List, Optional
 from fastapi import UploadFile
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
+from langchain.docstore.document import Document
 
 from app.utils.llm_helper import llm_helper
+from app.utils.sse import sse_event
 from app.services import storage_service, extraction_service, chunking_service
 from app.services.index_service import index_service
-from app.config import KB_UPLOADS_DIR, KB_VECTOR_DIR
+from app.services.retrieval_engine import retrieval_engine
+from app.services.retrieval_orchestrator import retrieval_orchestrator, federated_orchestrator
+from app.services.answer_cache import answer_cache
+from app.config import (
+    KB_UPLOADS_DIR,
+    KB_VECTOR_DIR,
+    FEDERATED_MAX_KBS,
+    FEDERATED_PER_KB_K,
+)
+
+# 固定指令放在 system 消息、检索上下文放在 user 消息，跨请求共享前缀以命中服务端缓存
+RAG_SYSTEM_PROMPT = """你是一个检索增强问答助手。请严格依据提供的知识片段回答问题。
+若无法从知识片段中得到答案，回复："根据现有知识无法回答该问题"。"""
+
+RAG_PROMPT = """
+上下文：
+{context}
+
+问题：{question}
+"""
 
 
 class RAGService:
@@ -20,6 +42,8 @@ class RAGService:
         # 复用现有 FileService 支持格式
         from app.services.file_service import file_service as _fs
         self.supported_formats = _fs.supported_formats
+        # 正在计算中的文档分析任务 {(kb, file): Task}
+        self._summary_tasks: Dict[tuple, asyncio.Future] = {}
 
     def _kb_dir(self, kb_name: str) -> str:
         return storage_service.kb_dir(kb_name)
@@ -66,6 +90,7 @@ class RAGService:
                 shutil.rmtree(vs_dir, ignore_errors=True)
         except Exception:
             ok = False
+        answer_cache.invalidate(kb_name)
         return {"success": ok, "name": kb_name}
 
     def rename_kb(self, old_name: str, new_name: str) -> Dict:
@@ -84,21 +109,28 @@ class RAGService:
             os.rename(old_vs, new_vs)
         else:
             os.makedirs(new_vs, exist_ok=True)
+        answer_cache.invalidate(old_name)
+        answer_cache.invalidate(new_name)
         return {"success": True, "old": old_name, "new": new_name}
 
     async def upload_to_kb(self, kb_name: str, file: UploadFile) -> Dict:
         ext = os.path.splitext(file.filename)[1].lower()
         if ext not in self.supported_formats:
             return {"success": False, "error": f"不支持的文件格式: {ext}"}
-        # Save
-        save_path = storage_service.save_to_kb(kb_name, file)
+        # Save（流式写盘 + sha256；相同内容已在库中时不重复入库）
+        saved = await storage_service.save_to_kb(kb_name, file)
+        save_path = saved["path"]
+        if saved["duplicate_of"] is not None:
+            return {"success": True, "file_name": saved["duplicate_of"], "kb": kb_name, "chunks": 0,
+                    "size": saved["size"], "sha256": saved["sha256"], "duplicate_of": saved["duplicate_of"]}
         # Extract + chunk
         extracted = extraction_service.extract(save_path)
         full_text = chunking_service.text_from_extracted(extracted)
         docs = chunking_service.chunk_from_text(full_text, kb_name, file.filename)
         # Upsert
         index_service.upsert_docs(kb_name, docs)
-        return {"success": True, "file_name": file.filename, "kb": kb_name, "chunks": len(docs), "size": os.path.getsize(save_path)}
+        return {"success": True, "file_name": file.filename, "kb": kb_name, "chunks": len(docs),
+                "size": saved["size"], "sha256": saved["sha256"], "duplicate_of": None}
 
     def status(self, kb_name: str) -> Dict:
         try:
@@ -107,30 +139,162 @@ class RAGService:
         except Exception:
             return {"kb": kb_name, "doc_chunks": 0, "ready": False}
 
-    def query(self, kb_name: str, question: str, top_k: int = 5) -> Dict:
-        retriever = index_service.retriever(kb_name, top_k)
-        prompt_str = """
-你是一个检索增强问答助手。请严格依据提供的知识片段回答问题。
-若无法从知识片段中得到答案，回复："根据现有知识无法回答该问题"。
+    def cache_stats(self) -> Dict:
+        return answer_cache.stats()
 
-上下文：
-{context}
+    def get_retrieval_settings(self, kb_name: str) -> Dict:
+        return {"kb": kb_name, **retrieval_engine.get_settings(kb_name)}
 
-问题：{question}
-"""
-        chain = RetrievalQA.from_chain_type(
-            llm=llm_helper.llm,
-            chain_type="stuff",
-            retriever=retriever,
-            chain_type_kwargs={
-                "prompt": PromptTemplate(template=prompt_str, input_variables=["context", "question"]) 
-            },
-            return_source_documents=True
+    def update_retrieval_settings(self, kb_name: str, strategy: str = None, fetch_k: int = None,
+                                  lambda_mult: float = None) -> Dict:
+        settings = retrieval_engine.update_settings(kb_name, strategy=strategy, fetch_k=fetch_k, lambda_mult=lambda_mult)
+        return {"kb": kb_name, **settings}
+
+    async def _retrieve(self, kb_name: str, question: str, top_k: int,
+                        query_vector: Optional[List[float]] = None) -> List[Document]:
+        """检索是阻塞调用（embedding + 向量库），放到检索线程池执行；已有问题向量时不再重复 embedding。"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            retrieval_orchestrator.executor, partial(index_service.search, kb_name, question, top_k, query_vector)
         )
-        result = chain({"query": question})
+
+    @staticmethod
+    def _rag_messages(docs: List[Document], question: str) -> List[Dict]:
+        context = "\n\n".join(d.page_content for d in docs)
+        return [
+            {"role": "system", "content": RAG_SYSTEM_PROMPT},
+            {"role": "user", "content": RAG_PROMPT.format(context=context, question=question)},
+        ]
+
+    @staticmethod
+    def _sources(docs: List[Document]) -> List[Dict]:
+        return [{"content": d.page_content[:300], "metadata": d.metadata} for d in docs]
+
+    async def _cache_lookup(self, kb_name: str, question: str, top_k: int):
+        """返回 (缓存 key 参数, 问题向量, 命中结果)。
+
+        开启语义匹配时对原始问题计算一次向量：缓存查找用它，未命中时检索也直接复用。
+        """
+        version = index_service.kb_version(kb_name)
+        query_vector = None
+        if answer_cache.enabled and answer_cache.semantic:
+            loop = asyncio.get_running_loop()
+            query_vector = await loop.run_in_executor(
+                retrieval_orchestrator.executor, index_service.embeddings.embed_query, question
+            )
+        key = (kb_name, version, question)
+        return key, query_vector, answer_cache.get(*key, query_vector=query_vector, top_k=top_k)
+
+    async def query(self, kb_name: str, question: str, top_k: int = 5) -> Dict:
+        key, query_vector, cached = await self._cache_lookup(kb_name, question, top_k)
+        if cached is not None:
+            return {**cached, "cached": True}
+        docs = await self._retrieve(kb_name, question, top_k, query_vector)
+        response = await llm_helper.chat_completion(self._rag_messages(docs, question), temperature=0.7)
+        result = {
+            "answer": response["choices"][0]["message"]["content"],
+            "sources": self._sources(docs),
+        }
+        answer_cache.put(*key, result, query_vector=query_vector, top_k=top_k)
+        return {**result, "cached": False}
+
+    async def query_stream(self, kb_name: str, question: str, top_k: int = 5) -> AsyncGenerator[str, None]:
+        """流式问答（SSE）：先推送 sources，再逐 token 推送答案，最后推送 done。"""
+        try:
+            key, query_vector, cached = await self._cache_lookup(kb_name, question, top_k)
+            if cached is not None:
+                yield sse_event("sources", {"sources": cached["sources"]})
+                yield sse_event("token", {"content": cached["answer"]})
+                yield sse_event("done", {"answer": cached["answer"], "cached": True})
+                return
+            docs = await self._retrieve(kb_name, question, top_k, query_vector)
+        except Exception as e:
+            yield sse_event("error", {"content": f"知识库检索失败: {str(e)}"})
+            return
+        sources = self._sources(docs)
+        yield sse_event("sources", {"sources": sources})
+
+        answer = ""
+        # 客户端断开或提前返回时立即关闭上游流，释放并发名额与连接
+        stream = llm_helper.chat_completion_stream(self._rag_messages(docs, question), temperature=0.7)
+        try:
+            async for chunk in stream:
+                if chunk.get("type") == "stream_chunk":
+                    answer += chunk["content"]
+                    yield sse_event("token", {"content": chunk["content"]})
+                elif chunk.get("type") == "error":
+                    yield sse_event("error", {"content": chunk.get("content", "")})
+                    return
+        finally:
+            await stream.aclose()
+        answer_cache.put(*key, {"answer": answer, "sources": sources}, query_vector=query_vector, top_k=top_k)
+        yield sse_event("done", {"answer": answer, "cached": False})
+
+    def _all_kb_names(self) -> List[str]:
+        if not os.path.exists(self.kb_root):
+            return []
+        return sorted(n for n in os.listdir(self.kb_root) if os.path.isdir(os.path.join(self.kb_root, n)))
+
+    async def federated_query(self, question: str, kbs: Optional[List[str]] = None, top_k: int = 5,
+                              with_answer: bool = True) -> Dict:
+        """多 KB 联合检索：查询向量只算一次，各 KB 并行检索，按归一化分数合并。
+
+        单次请求最多检索 FEDERATED_MAX_KBS 个 KB，每个 KB 取 FEDERATED_PER_KB_K 条并单独超时，
+        总耗时约等于最慢的一个 KB。各 KB 阶段在 federated_orchestrator 的专用线程池中执行，
+        不与聊天轮次的检索争抢线程。
+        """
+        names = list(dict.fromkeys(kbs)) if kbs else self._all_kb_names()
+        truncated = len(names) > FEDERATED_MAX_KBS
+        names = names[:FEDERATED_MAX_KBS]
+        top_k = max(1, top_k)
+        per_kb_k = max(1, min(top_k, FEDERATED_PER_KB_K))
+
+        loop = asyncio.get_running_loop()
+        query_vector = await loop.run_in_executor(
+            federated_orchestrator.executor, index_service.embeddings.embed_query, question
+        )
+        stages = {kb: partial(index_service.search_by_vector, kb, query_vector, per_kb_k, question) for kb in names}
+        results, stats = await federated_orchestrator.run(stages)
+
+        # 同一 embedding 空间下距离可比：先转为相似度，再在合并池内做 min-max 归一化
+        pool = []
+        for kb in names:
+            hits = results.get(kb) or []
+            known = [1.0 / (1.0 + d) for _, d in hits if d is not None]
+            floor = min(known) if known else 0.0
+            for doc, dist in hits:
+                pool.append((kb, doc, 1.0 / (1.0 + dist) if dist is not None else floor))
+        if pool:
+            hi = max(score for _, _, score in pool)
+            lo = min(score for _, _, score in pool)
+            span = (hi - lo) or 1.0
+            pool = [(kb, doc, (score - lo) / span) for kb, doc, score in pool]
+        pool.sort(key=lambda item: -item[2])
+        merged = pool[:top_k]
+
+        answer = None
+        if with_answer:
+            if merged:
+                context = "\n\n".join(f"[{kb}] {doc.page_content}" for kb, doc, _ in merged)
+                response = await llm_helper.chat_completion(
+                    messages=[
+                        {"role": "system", "content": RAG_SYSTEM_PROMPT},
+                        {"role": "user", "content": RAG_PROMPT.format(context=context, question=question)},
+                    ],
+                    temperature=0.3,
+                )
+                answer = response["choices"][0]["message"]["content"]
+            else:
+                answer = "根据现有知识无法回答该问题"
         return {
-            "answer": result.get("result", ""),
-            "sources": [{"content": d.page_content[:300], "metadata": d.metadata} for d in result.get("source_documents", [])]
+            "answer": answer,
+            "sources": [
+                {"kb": kb, "content": doc.page_content[:300], "metadata": doc.metadata, "score": round(score, 4)}
+                for kb, doc, score in merged
+            ],
+            "kbs": names,
+            "truncated": truncated,
+            "retrieval": stats,
         }
 
     def list_documents(self, kb_name: str) -> List[Dict]:
@@ -149,6 +313,7 @@ class RAGService:
         removed_file = True
         if not keep_file:
             removed_file = storage_service.delete_kb_file(kb_name, file_name)
+            storage_service.delete_summary(kb_name, file_name)
         return {"success": True, "kb": kb_name, "file": file_name, "removed_file": removed_file, "removed_vectors": removed_vectors}
 
     def rebuild_index(self, kb_name: str) -> Dict:
@@ -203,12 +368,35 @@ class RAGService:
         }
         return {"file": file_name, "kb": kb_name, "preview": snippet, "meta": meta}
 
-    async def summarize_document(self, kb_name: str, file_name: str) -> Dict:
+    async def summarize_document(self, kb_name: str, file_name: str, refresh: bool = False) -> Dict:
+        """返回文档分析结果：优先读取入库时物化的结果，refresh=True 或文件变化时重新计算"""
+        if not refresh:
+            # 校验指纹时可能要对整个文件重新计算 sha256，放到线程里
+            stored = await asyncio.to_thread(storage_service.load_summary, kb_name, file_name)
+            if stored is not None:
+                return stored
+        return await self.materialize_summary(kb_name, file_name)
+
+    async def materialize_summary(self, kb_name: str, file_name: str) -> Dict:
+        """计算并持久化文档分析结果；同一文档并发请求共享一次计算"""
+        key = (kb_name, file_name)
+        task = self._summary_tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_document(kb_name, file_name))
+            self._summary_tasks[key] = task
+            task.add_done_callback(lambda _: self._summary_tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _analyze_document(self, kb_name: str, file_name: str) -> Dict:
         kb_dir = self._kb_dir(kb_name)
         fpath = os.path.join(kb_dir, file_name)
         if not os.path.exists(fpath) or not os.path.isfile(fpath):
             raise FileNotFoundError("文档不存在")
-        extracted = extraction_service.extract(fpath)
+        # 指纹（可能整文件哈希）与解析都是阻塞 I/O / CPU，放到线程里，不占事件循环
+        fingerprint, extracted = await asyncio.gather(
+            asyncio.to_thread(storage_service.file_fingerprint, fpath),
+            asyncio.to_thread(extraction_service.extract, fpath),
+        )
         try:
             size = os.path.getsize(fpath)
             ext = os.path.splitext(fpath)[1].lower()
@@ -217,13 +405,17 @@ class RAGService:
         file_info = {"file_name": file_name, "file_size": size, "file_format": ext}
         from app.services.analysis_service import analyze
         analysis = await analyze(extracted, file_info)
-        return {
+        result = {
             "file": file_name,
             "kb": kb_name,
             "statistics": analysis.get("statistics", {}),
             "keywords": analysis.get("keywords", []),
             "summaries": analysis.get("summaries", {}),
+            "fingerprint": fingerprint,
+            "generated_at": int(time.time()),
         }
+        await asyncio.to_thread(storage_service.save_summary, kb_name, file_name, result)
+        return result
 
     def _extract_all_text(self, kb_name: str, file_name: str) -> str:
         kb_dir = self._kb_dir(kb_name)
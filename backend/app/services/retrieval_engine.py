@@ -0,0 +1,204 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from app.services.lexical_index import LexicalIndex, looks_exact, rrf_fuse
+from app.config import (
+    KB_VECTOR_DIR as VECTOR_DIR,
+    RETRIEVAL_STRATEGY,
+    RETRIEVAL_FETCH_K,
+    MMR_LAMBDA,
+    RERANK_MODEL,
+)
+
+STRATEGIES = ("similarity", "mmr", "rerank", "hybrid", "keyword")
+SETTINGS_FILE = "retrieval.json"
+
+
+def default_settings() -> Dict:
+    return {
+        "strategy": RETRIEVAL_STRATEGY if RETRIEVAL_STRATEGY in STRATEGIES else "similarity",
+        "fetch_k": RETRIEVAL_FETCH_K,
+        "lambda_mult": MMR_LAMBDA,
+    }
+
+
+def mmr_select(query_vec: np.ndarray, cand_vecs: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """向量化 MMR：每轮只做一次 (n, d) @ (d,) 的矩阵运算，增量维护与已选集合的最大相似度。"""
+    n = cand_vecs.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    q = query_vec / (np.linalg.norm(query_vec) or 1.0)
+    norms = np.linalg.norm(cand_vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    cands = cand_vecs / norms
+
+    relevance = cands @ q
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_sim = cands @ cands[first]
+    picked = np.zeros(n, dtype=bool)
+    picked[first] = True
+    while len(selected) < min(k, n):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        scores[picked] = -np.inf
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        picked[idx] = True
+        np.maximum(max_sim, cands @ cands[idx], out=max_sim)
+    return selected
+
+
+class RetrievalEngine:
+    """可配置的检索引擎：ANN top-k / 向量化 MMR / ANN + 本地重排 / BM25 + 向量混合 / 纯 BM25。"""
+
+    def __init__(self):
+        self._reranker = None
+        self._reranker_failed = False
+
+    # ===== Per-KB settings =====
+    def _settings_path(self, kb: str) -> str:
+        return os.path.join(VECTOR_DIR, kb, SETTINGS_FILE)
+
+    def get_settings(self, kb: str) -> Dict:
+        settings = default_settings()
+        try:
+            with open(self._settings_path(kb), "r", encoding="utf-8") as f:
+                settings.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+        return settings
+
+    def update_settings(self, kb: str, strategy: Optional[str] = None, fetch_k: Optional[int] = None,
+                        lambda_mult: Optional[float] = None) -> Dict:
+        if strategy is not None and strategy not in STRATEGIES:
+            raise ValueError(f"不支持的检索策略: {strategy}，可选: {', '.join(STRATEGIES)}")
+        settings = self.get_settings(kb)
+        if strategy is not None:
+            settings["strategy"] = strategy
+        if fetch_k is not None:
+            settings["fetch_k"] = max(1, int(fetch_k))
+        if lambda_mult is not None:
+            settings["lambda_mult"] = min(1.0, max(0.0, float(lambda_mult)))
+        path = self._settings_path(kb)
+        # 只在保存时创建目录；读取时文件不存在即返回默认值
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False)
+        return settings
+
+    # ===== Reranker =====
+    def _get_reranker(self):
+        """按需加载本地 CrossEncoder；未配置或加载失败时返回 None（退化为 ANN 顺序）。"""
+        if not RERANK_MODEL or self._reranker_failed:
+            return None
+        if self._reranker is None:
+            try:
+                from sentence_transformers import CrossEncoder
+                self._reranker = CrossEncoder(RERANK_MODEL)
+            except Exception as e:
+                print(f"重排模型加载失败，使用 ANN 顺序: {e}")
+                self._reranker_failed = True
+                return None
+        return self._reranker
+
+    # ===== Search =====
+    def _lexical(self, db) -> Optional[LexicalIndex]:
+        directory = getattr(db, "_persist_directory", None)
+        return LexicalIndex(directory) if directory else None
+
+    def keyword_search(self, db, query: str, k: int) -> List[Tuple[str, Document, float]]:
+        """纯 BM25 检索，不需要 embedding；编号或登记的名称优先短语匹配。"""
+        lexical = self._lexical(db)
+        if lexical is None:
+            return []
+        hits = lexical.search(query, k, exact=True) if looks_exact(query) else []
+        return hits or lexical.search(query, k)
+
+    def search_by_vector(self, db, query_vector: Optional[List[float]], k: int, settings: Dict,
+                         query: Optional[str] = None) -> List[Tuple[Document, Optional[float]]]:
+        """在 Chroma collection 上检索，返回 [(Document, distance)]，distance 越小越相关。
+
+        仅由倒排索引命中（hybrid / keyword）的结果 distance 为 None。
+        """
+        strategy = settings.get("strategy", "similarity")
+        k = max(1, k)
+        fetch_k = max(k, int(settings.get("fetch_k") or k))
+        if strategy == "keyword":
+            return [(doc, None) for _, doc, _ in self.keyword_search(db, query or "", k)]
+
+        n_results = k if strategy == "similarity" else fetch_k
+        include = ["documents", "metadatas", "distances"]
+        if strategy == "mmr":
+            include.append("embeddings")
+        got = db._collection.query(query_embeddings=[query_vector], n_results=n_results, include=include)
+        ids = (got.get("ids") or [[]])[0]
+        texts = (got.get("documents") or [[]])[0]
+        metas = (got.get("metadatas") or [[]])[0]
+        dists = (got.get("distances") or [[]])[0]
+        candidates = []
+        for i, chunk_id in enumerate(ids):
+            meta = dict(metas[i] or {})
+            meta.setdefault("chunk_id", chunk_id)
+            candidates.append((chunk_id, Document(page_content=texts[i], metadata=meta), float(dists[i])))
+
+        if strategy == "hybrid":
+            lexical_hits = self.keyword_search(db, query, fetch_k) if query else []
+            distance_of = {chunk_id: dist for chunk_id, _, dist in candidates}
+            fused = rrf_fuse(
+                [[(chunk_id, doc) for chunk_id, doc, _ in candidates],
+                 [(chunk_id, doc) for chunk_id, doc, _ in lexical_hits]],
+                k,
+            )
+            return [(doc, distance_of.get(doc.metadata.get("chunk_id"))) for doc in fused]
+
+        order = list(range(len(candidates)))
+        if strategy == "mmr" and candidates:
+            cand_vecs = np.asarray(got["embeddings"][0], dtype=np.float32)
+            order = mmr_select(np.asarray(query_vector, dtype=np.float32), cand_vecs, k,
+                               float(settings.get("lambda_mult", MMR_LAMBDA)))
+        elif strategy == "rerank" and candidates:
+            reranker = self._get_reranker()
+            if reranker is not None and query:
+                scores = reranker.predict([(query, doc.page_content) for _, doc, _ in candidates])
+                order = sorted(order, key=lambda i: -float(scores[i]))
+        return [(candidates[i][1], candidates[i][2]) for i in order[:k]]
+
+    def search(self, db, query: str, k: int, settings: Dict,
+               query_vector: Optional[List[float]] = None) -> List[Document]:
+        """query_vector 为调用方已算好的查询向量（如答案缓存查找时算的），传入时不再重复 embedding"""
+        strategy = settings.get("strategy", "similarity")
+        if strategy == "keyword":
+            return [doc for _, doc, _ in self.keyword_search(db, query, k)]
+        if strategy == "hybrid" and looks_exact(query):
+            # 编号或 LEXICAL_EXACT_TERMS 中的名称：倒排索引命中即返回，省掉 embedding 调用；其余查询一律融合
+            lexical = self._lexical(db)
+            hits = lexical.search(query, k, exact=True) if lexical else []
+            if hits:
+                return [doc for _, doc, _ in hits]
+        if query_vector is None:
+            query_vector = db._embedding_function.embed_query(query)
+        return [doc for doc, _ in self.search_by_vector(db, query_vector, k, settings, query=query)]
+
+
+class EngineRetriever(BaseRetriever):
+    """LangChain 兼容的检索器包装，供 chain / get_relevant_documents 使用。"""
+
+    db: Any
+    settings: Dict
+    k: int = 5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return retrieval_engine.search(self.db, query, self.k, self.settings)
+
+
+# 全局检索引擎实例
+retrieval_engine = RetrievalEngine()
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.config import RETRIEVAL_WORKERS, RETRIEVAL_STAGE_TIMEOUT, FEDERATED_MAX_KBS, FEDERATED_KB_TIMEOUT
+
+
+class RetrievalOrchestrator:
+    """并发执行聊天轮次中的各个检索阶段。
+
+    - 每个阶段都是阻塞调用（向量检索 / embedding），放到线程池执行，不占用事件循环
+    - 每个阶段单独超时，超时或异常时返回降级值，不影响其他阶段
+    - 返回每个阶段的耗时与状态，整体耗时取决于最慢的阶段而不是各阶段之和
+    注意：超时只是不再等待结果，线程中的调用会自然结束后被丢弃。
+    """
+
+    def __init__(self, max_workers: int = RETRIEVAL_WORKERS, default_timeout: float = RETRIEVAL_STAGE_TIMEOUT,
+                 thread_name_prefix: str = "retrieval"):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.default_timeout = default_timeout
+
+    async def _run_stage(self, name: str, fn: Callable[[], Any], timeout: float, fallback: Any):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            result = await asyncio.wait_for(loop.run_in_executor(self.executor, fn), timeout)
+        except asyncio.TimeoutError:
+            result, status = fallback, "timeout"
+        except Exception as e:
+            print(f"检索阶段 {name} 失败: {e}")
+            result, status = fallback, "error"
+        latency_ms = round((time.perf_counter() - start) * 1000, 1)
+        return name, result, {"latency_ms": latency_ms, "status": status}
+
+    async def run(self, stages: Dict[str, Callable[[], Any]],
+                  timeouts: Optional[Dict[str, float]] = None,
+                  fallback: Any = None) -> Tuple[Dict[str, Any], Dict[str, Dict]]:
+        """并发运行所有阶段，返回 (各阶段结果, 各阶段耗时统计)。
+
+        fallback 为超时/失败时的降级结果，默认为空列表。
+        """
+        timeouts = timeouts or {}
+        tasks = [
+            self._run_stage(
+                name,
+                fn,
+                timeouts.get(name, self.default_timeout),
+                [] if fallback is None else fallback,
+            )
+            for name, fn in stages.items()
+        ]
+        results: Dict[str, Any] = {}
+        stats: Dict[str, Dict] = {}
+        for name, result, stat in await asyncio.gather(*tasks):
+            results[name] = result
+            stats[name] = stat
+        return results, stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局检索编排器实例
+retrieval_orchestrator = RetrievalOrchestrator()
+
+# 多 KB 联合检索专用：线程数等于单次请求的 KB 上限，各 KB 阶段不与聊天检索共用线程、提交后即可开始执行，
+# 单 KB 超时计的是检索本身而不是排队时间
+federated_orchestrator = RetrievalOrchestrator(
+    max_workers=FEDERATED_MAX_KBS, default_timeout=FEDERATED_KB_TIMEOUT, thread_name_prefix="federated"
+)
@@ -1,7 +1,22 @@
 import os
-from typing import Dict, List
+import json
+import uuid
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Tuple
 from fastapi import UploadFile
-from app.config import KB_UPLOADS_DIR
+from app.config import KB_UPLOADS_DIR, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE
+
+SUMMARIES_DIR = ".summaries"  # 每个 KB 目录下存放文档分析结果、内容哈希和上传中的临时文件
+HASH_SUFFIX = ".sha256"
+
+
+class UploadTooLarge(Exception):
+    """上传超过大小上限（路由层转换为 413）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"文件超过大小上限 {round(max_bytes / (1024 * 1024), 1)} MB")
 
 
 def _ensure_dir(path: str):
@@ -14,17 +29,57 @@ def kb_dir(kb_name: str) -> str:
     return path
 
 
-def save_to_kb(kb_name: str, file: UploadFile) -> str:
-    """Save an UploadFile to KB folder and return absolute path."""
+async def stream_to_file(file: UploadFile, dest_path: str, max_bytes: int = UPLOAD_MAX_BYTES,
+                         chunk_size: int = UPLOAD_CHUNK_SIZE) -> Tuple[int, str]:
+    """把上传分块写入 dest_path，边写边计算 sha256，返回 (字节数, sha256)。
+
+    内存占用恒定为一个块；客户端声明的大小或已写入的字节数超过 max_bytes 时立即中止并删除已写部分。
+    磁盘写入放到线程中执行，不阻塞事件循环。
+    """
+    if max_bytes and getattr(file, "size", None) and file.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    digest = hashlib.sha256()
+    size = 0
+    out = await asyncio.to_thread(open, dest_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        out.close()
+        os.remove(dest_path)
+        raise
+    await asyncio.to_thread(out.close)
+    return size, digest.hexdigest()
+
+
+async def save_to_kb(kb_name: str, file: UploadFile) -> Dict:
+    """流式保存上传到 KB 目录，返回 {path, size, sha256, duplicate_of}。
+
+    内容哈希作为去重键：KB 中已有相同内容的文件（包括同名且未修改的重复上传）时不再保存第二份，
+    duplicate_of 为已有文件名，path 指向已有文件。
+    """
     folder = kb_dir(kb_name)
+    meta_dir = os.path.join(folder, SUMMARIES_DIR)
+    _ensure_dir(meta_dir)
+    tmp_path = os.path.join(meta_dir, f".{uuid.uuid4().hex}.part")
+    size, sha256 = await stream_to_file(file, tmp_path)
+
+    duplicate = find_by_hash(kb_name, sha256)
+    if duplicate is not None:
+        os.remove(tmp_path)
+        return {"path": os.path.join(folder, duplicate), "size": size, "sha256": sha256, "duplicate_of": duplicate}
+
     save_path = os.path.join(folder, file.filename)
-    content = file.file.read() if hasattr(file, 'file') else None
-    if content is None or len(content) == 0:
-        # Fallback to await read in async context caller; but try .read()
-        content = getattr(file, 'read', lambda: b"")()
-    with open(save_path, "wb") as f:
-        f.write(content)
-    return save_path
+    os.replace(tmp_path, save_path)
+    _record_hash(save_path, sha256)
+    return {"path": save_path, "size": size, "sha256": sha256, "duplicate_of": None}
 
 
 def list_kb_files(kb_name: str) -> List[Dict]:
@@ -58,3 +113,82 @@ def delete_kb_file(kb_name: str, file_name: str) -> bool:
         except Exception:
             return False
     return False
+
+
+def _hash_path(path: str) -> str:
+    return os.path.join(os.path.dirname(path), SUMMARIES_DIR, os.path.basename(path) + HASH_SUFFIX)
+
+
+def _record_hash(path: str, sha256: str):
+    """记录文件内容哈希，附带大小和修改时间用于判断记录是否仍然有效"""
+    st = os.stat(path)
+    hash_path = _hash_path(path)
+    _ensure_dir(os.path.dirname(hash_path))
+    with open(hash_path, "w", encoding="utf-8") as f:
+        f.write(f"{sha256} {st.st_size} {st.st_mtime_ns}")
+
+
+def _recorded_hash(path: str) -> Optional[str]:
+    try:
+        with open(_hash_path(path), "r", encoding="utf-8") as f:
+            sha256, size, mtime_ns = f.read().split()
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return sha256 if int(size) == st.st_size and int(mtime_ns) == st.st_mtime_ns else None
+
+
+def file_fingerprint(path: str) -> str:
+    """文件指纹（内容 sha256）。上传时已顺带计算并记录；文件被替换或没有记录时重新计算一次"""
+    sha256 = _recorded_hash(path)
+    if sha256 is None:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        _record_hash(path, sha256)
+    return sha256
+
+
+def find_by_hash(kb_name: str, sha256: str) -> Optional[str]:
+    """按内容哈希查找 KB 中已有的文件，返回文件名"""
+    folder = kb_dir(kb_name)
+    for name in os.listdir(folder):
+        fpath = os.path.join(folder, name)
+        if os.path.isfile(fpath) and _recorded_hash(fpath) == sha256:
+            return name
+    return None
+
+
+def _summary_path(kb_name: str, file_name: str) -> str:
+    return os.path.join(kb_dir(kb_name), SUMMARIES_DIR, f"{file_name}.json")
+
+
+def load_summary(kb_name: str, file_name: str) -> Optional[Dict]:
+    """读取已物化的文档分析结果；指纹与当前文件不一致时视为过期，返回 None"""
+    path = _summary_path(kb_name, file_name)
+    fpath = os.path.join(kb_dir(kb_name), file_name)
+    if not os.path.exists(path) or not os.path.isfile(fpath):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if data.get("fingerprint") == file_fingerprint(fpath) else None
+
+
+def save_summary(kb_name: str, file_name: str, data: Dict):
+    path = _summary_path(kb_name, file_name)
+    _ensure_dir(os.path.dirname(path))
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def delete_summary(kb_name: str, file_name: str):
+    for path in (_summary_path(kb_name, file_name), _hash_path(os.path.join(kb_dir(kb_name), file_name))):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,113 @@
+import asyncio
+from typing import Dict, List, Set
+
+from app.config import (
+    SUMMARY_ENABLED,
+    SUMMARY_TRIGGER_MESSAGES,
+    SUMMARY_KEEP_RECENT,
+    SUMMARY_MAX_TOKENS,
+)
+from app.services.chat_repository import chat_repository
+from app.utils.context_builder import count_tokens
+from app.utils.llm_helper import llm_helper
+
+# 每次从高水位之后按时间正序取的消息数（早于它们的都已折叠，单轮折叠量另由 _batch 限制）
+PENDING_PAGE = 1000
+
+SUMMARY_PROMPT = """你负责维护一段对话的滚动摘要。请把【新增对话】合并进【已有摘要】，输出更新后的完整摘要。
+要求：
+- 保留用户的目标、偏好、约束条件、已确认的结论和关键数据
+- 删除寒暄和重复内容，不要编造对话中没有的信息
+- 使用第三人称、简洁的条目式中文，不超过 {max_chars} 字
+
+【已有摘要】
+{summary}
+
+【新增对话】
+{dialogue}
+
+【更新后的摘要】"""
+
+
+class ConversationSummarizer:
+    """增量滚动摘要。
+
+    每轮对话结束后在后台检查：未被摘要覆盖的消息超过 trigger 条时，把除最近 keep_recent
+    条以外的消息折叠进摘要，并把高水位（summary_upto）推进到最后折叠的消息序号。
+    组装提示词时只需 摘要 + 高水位之后的消息。
+    """
+
+    def __init__(self, enabled: bool = SUMMARY_ENABLED, trigger: int = SUMMARY_TRIGGER_MESSAGES,
+                 keep_recent: int = SUMMARY_KEEP_RECENT, max_tokens: int = SUMMARY_MAX_TOKENS):
+        self.enabled = enabled
+        self.trigger = max(1, trigger)
+        self.keep_recent = max(0, keep_recent)
+        self.max_tokens = max_tokens
+        self._running: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, conversation_id: str):
+        """在后台触发一次摘要检查；同一对话已有任务在跑时跳过"""
+        if not self.enabled or conversation_id in self._running:
+            return
+        self._running.add(conversation_id)
+        task = asyncio.create_task(self._run(conversation_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, conversation_id: str):
+        try:
+            await self.summarize(conversation_id)
+        except Exception as e:
+            print(f"对话摘要失败({conversation_id}): {e}")
+        finally:
+            self._running.discard(conversation_id)
+
+    async def summarize(self, conversation_id: str, force: bool = False) -> bool:
+        """折叠旧消息进摘要，返回是否更新了摘要"""
+        summary, summary_upto = await chat_repository.get_summary_state(conversation_id)
+        pending = await chat_repository.get_messages_after(
+            conversation_id, summary_upto, limit=PENDING_PAGE, columns=("role", "content", "sequence")
+        )
+        if not force and len(pending) <= self.trigger:
+            return False
+        # 取满一页说明后面还有更新的消息，最近几条不在这一页里，不必再留
+        keep = self.keep_recent if len(pending) < PENDING_PAGE else 0
+        to_fold = self._batch(pending[:-keep] if keep else pending)
+        if not to_fold:
+            return False
+
+        new_summary = await self._fold(summary, to_fold)
+        return await chat_repository.update_summary(conversation_id, new_summary, to_fold[-1]["sequence"])
+
+    def _batch(self, messages: List[Dict]) -> List[Dict]:
+        """单次折叠的输入设上限（老的长对话分多轮追平），至少折叠一条"""
+        budget = self.max_tokens * 8
+        batch: List[Dict] = []
+        for m in messages:
+            budget -= count_tokens(m["content"])
+            if batch and budget < 0:
+                break
+            batch.append(m)
+        return batch
+
+    async def _fold(self, summary: str, messages: List[Dict]) -> str:
+        dialogue = "\n".join(
+            f"{'用户' if m['role'] == 'user' else '助手'}：{m['content']}" for m in messages
+        )
+        prompt = SUMMARY_PROMPT.format(max_chars=self.max_tokens, summary=summary or "无", dialogue=dialogue)
+        response = await llm_helper.chat_completion(
+            [{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=self.max_tokens,
+        )
+        return response["choices"][0]["message"]["content"].strip()
+
+    async def drain(self):
+        """等待正在执行的摘要任务结束（应用关闭时调用）"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+# 全局对话摘要器实例
+conversation_summarizer = ConversationSummarizer()
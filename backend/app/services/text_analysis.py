@@ -0,0 +1,133 @@
+import hashlib
+import multiprocessing
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import jieba
+
+from app.config import TOKENIZE_WORKERS, TOKENIZE_PARALLEL_CHARS, TOKEN_CACHE_ENTRIES
+
+SENTENCE_SPLIT_RE = re.compile(r'[。！？.!?]')
+
+
+def _init_worker():
+    """进程池工作进程的初始化函数：加载词典（模块级函数，spawn 时按名字导入，不需要 pickle 对象）"""
+    jieba.initialize()
+
+
+def _noop():
+    """预热用的空任务"""
+
+
+def _tokenize_chunk(text: str) -> List[str]:
+    """进程池中执行的分词（模块级函数，便于 pickle）"""
+    return jieba.lcut(text)
+
+
+def _split_for_workers(text: str, parts: int) -> List[str]:
+    """按换行切成大致等长的若干段，不在词语中间截断"""
+    size = max(1, len(text) // parts)
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            newline = text.find("\n", end)
+            end = len(text) if newline == -1 else newline + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+class DocumentTokens:
+    """一篇文档的分词结果与句子切分，分析流程的各步骤共用，避免重复扫描全文"""
+
+    def __init__(self, text: str, tokens: List[str]):
+        self.text = text
+        self.tokens = tokens
+        self._sentences: Optional[List[str]] = None
+
+    @property
+    def sentences(self) -> List[str]:
+        if self._sentences is None:
+            self._sentences = SENTENCE_SPLIT_RE.split(self.text)
+        return self._sentences
+
+
+class TextAnalyzer:
+    """jieba 分词服务。
+
+    - preload() 在应用启动时加载词典并启动进程池（否则第一次分词的请求要多等 1~2 秒，第一次并行分词还要再等工作进程启动）
+    - 超过 parallel_chars 的长文本按行切段，交给进程池并行分词（jieba 是纯 Python，线程无法并行）；
+      进程池用 spawn 启动，每个工作进程初始化时各自加载一次词典。
+      注意 spawn 出的工作进程会重新导入启动进程的 __main__ 模块：用 `uvicorn main:app` 启动时那只是 uvicorn 的入口；
+      用 `python main.py` 启动时则会在每个工作进程里再执行一遍 main.py 顶层（导入全部路由、MemoryManager、嵌入模型），
+      这种启动方式下请设置 TOKENIZE_WORKERS=1 关闭进程池
+    - 分词结果按文本 sha1 缓存最近 cache_entries 篇，同一文档的关键词、摘要、再次分析都不再重新分词
+    阻塞调用，异步代码中请放到线程里执行。
+    """
+
+    def __init__(self, workers: int = TOKENIZE_WORKERS, parallel_chars: int = TOKENIZE_PARALLEL_CHARS,
+                 cache_entries: int = TOKEN_CACHE_ENTRIES):
+        self.workers = max(1, workers)
+        self.parallel_chars = parallel_chars
+        self.cache_entries = max(1, cache_entries)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[str, DocumentTokens]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def preload(self):
+        """加载本进程词典；启用进程池时每个工作进程提交一个空任务并等待，让 _init_worker 在启动阶段执行完"""
+        jieba.initialize()
+        if self.workers > 1:
+            pool = self._get_pool()
+            for future in [pool.submit(_noop) for _ in range(self.workers)]:
+                future.result()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._pool
+
+    def tokenize(self, text: str) -> List[str]:
+        if self.workers > 1 and len(text) >= self.parallel_chars:
+            chunks = _split_for_workers(text, self.workers * 2)
+            tokens: List[str] = []
+            for part in self._get_pool().map(_tokenize_chunk, chunks):
+                tokens.extend(part)
+            return tokens
+        return jieba.lcut(text)
+
+    def document(self, text: str) -> DocumentTokens:
+        """取文档的分词结果（命中缓存则不再分词）"""
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        doc = DocumentTokens(text, self.tokenize(text))
+        with self._lock:
+            self._cache[key] = doc
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return doc
+
+    def stats(self) -> Dict:
+        return {"workers": self.workers, "pool_started": self._pool is not None, "cached_documents": len(self._cache)}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# 全局分词服务实例
+text_analyzer = TextAnalyzer()
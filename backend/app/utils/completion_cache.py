@@ -0,0 +1,99 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from app.config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_TTL
+
+
+def completion_key(model: str, params: Dict, messages: List[Dict]) -> str:
+    """缓存 key：模型 + 生成参数 + 消息内容的 sha256"""
+    payload = json.dumps(
+        {"model": model, "params": params, "messages": [[m["role"], m["content"]] for m in messages]},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """LLM 响应缓存接口；get 未命中返回 None。可替换为其他后端（如 Redis）。"""
+
+    enabled = False
+
+    def get(self, key: str) -> Optional[Dict]:
+        return None
+
+    def put(self, key: str, value: Dict, ttl: Optional[int] = None):
+        pass
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled}
+
+
+class SQLiteCompletionCache(CompletionCache):
+    """基于本地 SQLite 的响应缓存，进程重启后仍然有效。
+
+    每次操作单独打开连接，线程安全；过期条目在读取时忽略，写入时顺带清理。
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: int = LLM_CACHE_TTL, enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0}
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM completions WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        with self._lock:
+            self._stats["hits" if row else "misses"] += 1
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, value: Dict, ttl: Optional[int] = None):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now + (ttl if ttl is not None else self.ttl)),
+            )
+        with self._lock:
+            self._stats["writes"] += 1
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM completions")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "enabled": self.enabled,
+            **stats,
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,158 @@
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.config import CHAT_CONTEXT_TOKENS, CHAT_KNOWLEDGE_RATIO, CHAT_TOKEN_ENCODING
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+MESSAGE_OVERHEAD = 4  # role / 分隔符等固定开销
+MIN_PARTIAL_TOKENS = 64  # 剩余预算太少时不再截断塞入
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """按 CHAT_TOKEN_ENCODING 首次使用时加载 tiktoken 编码（可能需要联网下载词表）；
+    未配置、未安装或加载失败时返回 None，使用估算"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                if CHAT_TOKEN_ENCODING:
+                    try:
+                        import tiktoken  # type: ignore
+                        _encoding = tiktoken.get_encoding(CHAT_TOKEN_ENCODING)
+                    except Exception as e:
+                        print(f"加载 tiktoken 编码 {CHAT_TOKEN_ENCODING} 失败，改用估算: {e}")
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]) + "…"
+    # 估算模式：二分找到不超预算的最长前缀
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + "…"
+
+
+class ContextBuilder:
+    """按 token 预算组装对话上下文。
+
+    预算分配顺序（即优先级）：system > 固定上下文 > 最新一条消息 > 检索知识 > 更早的对话 > 历史摘要。
+    - 最新一条消息（本轮用户输入）必定保留，超出预算时截断
+    - 检索知识最多占预算的 knowledge_ratio，按检索顺序放入，放不下的截断或丢弃
+    - 更早的对话从新往旧放，放不下的丢弃
+    - 剩余预算放历史摘要
+
+    输出顺序与预算优先级无关，按稳定性从高到低排列，使相邻两轮的提示词共享尽量长的前缀，
+    便于命中服务端的前缀缓存（DeepSeek context caching）：
+        system → 固定上下文（如关联的知识库） → 历史摘要 → 历史对话 → 本轮检索知识 → 最新消息
+    每轮都会变化的检索结果放在最新消息之前，不打断前面的公共前缀。
+    """
+
+    def __init__(self, budget: int = CHAT_CONTEXT_TOKENS, knowledge_ratio: float = CHAT_KNOWLEDGE_RATIO):
+        self.budget = budget
+        self.knowledge_ratio = knowledge_ratio
+
+    def build(self, history: List[Dict], system: Optional[str] = None,
+              knowledge: Optional[List[Tuple[str, List[str]]]] = None,
+              summary: Optional[str] = None, pinned: Optional[str] = None) -> Tuple[List[Dict], Dict]:
+        """history 为按时间顺序的 [{"role", "content"}]；knowledge 为 [(标题, [片段...])]；
+        pinned 为跨轮次不变的上下文（如关联知识库的说明）。
+
+        返回 (messages, report)，report 记录预算使用与被丢弃的内容数量。
+        """
+        remaining = self.budget
+        report = {"budget": self.budget, "dropped_knowledge": 0, "dropped_turns": 0, "summary_used": False}
+
+        system_msgs: List[Dict] = []
+        for text in (system, pinned):
+            if text:
+                content = truncate_to_tokens(text, remaining - MESSAGE_OVERHEAD)
+                system_msgs.append({"role": "system", "content": content})
+                remaining -= count_tokens(content) + MESSAGE_OVERHEAD
+
+        # 1. 最新一条消息
+        latest: List[Dict] = []
+        if history:
+            msg = history[-1]
+            content = msg["content"]
+            if count_tokens(content) + MESSAGE_OVERHEAD > remaining:
+                content = truncate_to_tokens(content, remaining - MESSAGE_OVERHEAD)
+            latest.append({**msg, "content": content})
+            remaining -= count_tokens(content) + MESSAGE_OVERHEAD
+
+        # 2. 检索知识
+        knowledge_left = min(remaining, int(self.budget * self.knowledge_ratio))
+        knowledge_msgs: List[Dict] = []
+        for title, segments in knowledge or []:
+            header = f"【{title}】"
+            picked: List[str] = []
+            cost = count_tokens(header) + MESSAGE_OVERHEAD
+            for i, seg in enumerate(segments):
+                seg_tokens = count_tokens(seg)
+                if cost + seg_tokens <= knowledge_left:
+                    picked.append(seg)
+                    cost += seg_tokens
+                    continue
+                partial = knowledge_left - cost
+                if partial >= MIN_PARTIAL_TOKENS:
+                    picked.append(truncate_to_tokens(seg, partial))
+                    cost = knowledge_left
+                report["dropped_knowledge"] += len(segments) - len(picked)
+                break
+            if picked:
+                knowledge_msgs.append({"role": "system", "content": header + "\n" + "\n".join(picked)})
+                knowledge_left -= cost
+                remaining -= cost
+
+        # 3. 更早的对话（从新到旧）
+        earlier = history[:-1]
+        turns: List[Dict] = []
+        for idx, msg in enumerate(reversed(earlier)):
+            tokens = count_tokens(msg["content"]) + MESSAGE_OVERHEAD
+            if tokens > remaining:
+                report["dropped_turns"] = len(earlier) - idx
+                break
+            turns.append(msg)
+            remaining -= tokens
+        turns.reverse()
+
+        # 4. 历史摘要
+        summary_msgs: List[Dict] = []
+        if summary and remaining - MESSAGE_OVERHEAD >= MIN_PARTIAL_TOKENS:
+            content = truncate_to_tokens(f"【历史摘要】\n{summary}", remaining - MESSAGE_OVERHEAD)
+            summary_msgs.append({"role": "system", "content": content})
+            remaining -= count_tokens(content) + MESSAGE_OVERHEAD
+            report["summary_used"] = True
+
+        report["used"] = self.budget - remaining
+        return system_msgs + summary_msgs + turns + knowledge_msgs + latest, report
+
+
+# 全局上下文构建器实例
+context_builder = ContextBuilder()
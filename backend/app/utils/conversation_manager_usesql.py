@@ -1,79 +1,76 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Sequence
 from datetime import datetime
+from contextlib import contextmanager
 from app.services.db_service import DatabaseService
-from app.database import SessionLocal
+from app.database import session_scope
 
 class ConversationManagerUseSql:
-    def __init__(self):
-        # 使用数据库服务
-        self.db_service = None
+    """对话管理：每次调用在独立的会话作用域内完成，不在请求 / 线程之间共享 Session"""
     
-    def _get_db_service(self):
-        """获取数据库服务实例"""
-        if not self.db_service:
-            db = SessionLocal()
-            self.db_service = DatabaseService(db)
-        return self.db_service
+    @contextmanager
+    def _db_service(self):
+        """获取数据库服务实例（调用结束即关闭会话）"""
+        with session_scope() as db:
+            yield DatabaseService(db)
     
     def create_conversation(self, title: Optional[str] = None) -> str:
         """创建新对话"""
-        db_service = self._get_db_service()
-        conversation = db_service.create_conversation(title or "新对话")
-        return conversation.id
+        with self._db_service() as db_service:
+            conversation = db_service.create_conversation(title or "新对话")
+            return conversation.id
     
-    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
-        """获取对话"""
-        db_service = self._get_db_service()
-        conversation = db_service.get_conversation(conversation_id)
-        if conversation:
-            conv_dict = conversation.to_dict()
-            # 添加消息列表
-            messages = db_service.get_messages(conversation_id)
-            conv_dict["messages"] = [msg.to_dict() for msg in messages]
-            return conv_dict
-        return None
+    def get_conversation(self, conversation_id: str, include_messages: bool = True) -> Optional[Dict]:
+        """获取对话；include_messages=False 时只返回对话本身"""
+        with self._db_service() as db_service:
+            conversation = db_service.get_conversation(conversation_id)
+            if conversation:
+                conv_dict = conversation.to_dict()
+                if include_messages:
+                    # 添加消息列表
+                    conv_dict["messages"] = db_service.get_message_window(conversation_id)
+                return conv_dict
+            return None
     
     def get_all_conversations(self) -> List[Dict]:
         """获取所有对话列表"""
-        db_service = self._get_db_service()
-        conversations = db_service.get_conversations()
-        return [conv.to_dict() for conv in conversations]
+        with self._db_service() as db_service:
+            conversations = db_service.get_conversations()
+            return [conv.to_dict() for conv in conversations]
     
     def add_message(self, conversation_id: str, message: Dict) -> bool:
         """添加消息到对话"""
-        db_service = self._get_db_service()
         try:
-            db_service.add_message(
-                conversation_id=conversation_id,
-                role=message["role"],
-                content=message["content"],
-                tool_call=message.get("tool_call")
-            )
+            with self._db_service() as db_service:
+                db_service.add_message(
+                    conversation_id=conversation_id,
+                    role=message["role"],
+                    content=message["content"],
+                    tool_call=message.get("tool_call")
+                )
             return True
         except Exception as e:
             print(f"添加消息失败: {e}")
             return False
     
-    def get_messages(self, conversation_id: str) -> List[Dict]:
-        """获取对话消息"""
-        db_service = self._get_db_service()
-        messages = db_service.get_messages(conversation_id)
-        return [msg.to_dict() for msg in messages]
+    def get_messages(self, conversation_id: str, columns: Optional[Sequence[str]] = None) -> List[Dict]:
+        """获取对话消息（最多 1000 条），columns 指定时只取这些字段"""
+        with self._db_service() as db_service:
+            return db_service.get_message_window(conversation_id, columns=columns)
     
     def update_conversation_title(self, conversation_id: str, title: str) -> bool:
         """更新对话标题"""
-        db_service = self._get_db_service()
-        return db_service.update_conversation_title(conversation_id, title)
+        with self._db_service() as db_service:
+            return db_service.update_conversation_title(conversation_id, title)
     
     def delete_conversation(self, conversation_id: str) -> bool:
         """删除对话"""
-        db_service = self._get_db_service()
-        return db_service.delete_conversation(conversation_id)
+        with self._db_service() as db_service:
+            return db_service.delete_conversation(conversation_id)
     
     def get_conversation_preview(self, conversation_id: str) -> Optional[str]:
         """获取对话预览"""
-        db_service = self._get_db_service()
-        return db_service.get_conversation_preview(conversation_id)
+        with self._db_service() as db_service:
+            return db_service.get_conversation_preview(conversation_id)
 
     def generate_smart_title(self, conversation_id: str) -> str:
         """智能生成对话标题"""
@@ -130,67 +127,6 @@ class ConversationManagerUseSql:
             title += "..."
         
         return title
-    
-    def extract_report_info(self, conversation_id: str) -> Dict:
-        """从对话中提取报告信息"""
-        messages = self.get_messages(conversation_id)
-        
-        report_info = {
-            "topic": "",
-            "requirements": [],
-            "data_points": [],
-            "conclusions": [],
-            "raw_content": ""
-        }
-        
-        # 分析对话内容，提取报告要素
-        for message in messages:
-            if message["role"] == "user":
-                content = message["content"].lower()
-                report_info["raw_content"] += f"用户: {message['content']}\n"
-                
-                # 提取主题
-                if not report_info["topic"]:
-                    if any(keyword in content for keyword in ["报告", "分析", "研究", "总结"]):
-                        # 从消息中提取主题
-                        report_info["topic"] = self._extract_topic(message["content"])
-                
-                # 提取需求
-                if any(keyword in content for keyword in ["需要", "要求", "希望", "想要"]):
-                    report_info["requirements"].append(message["content"])
-                
-                # 提取数据点
-                if any(keyword in content for keyword in ["数据", "统计", "数字", "百分比"]):
-                    report_info["data_points"].append(message["content"])
-                
-                # 提取结论观点
-                if any(keyword in content for keyword in ["结论", "总结", "认为", "觉得"]):
-                    report_info["conclusions"].append(message["content"])
-            
-            elif message["role"] == "assistant":
-                report_info["raw_content"] += f"助手: {message['content']}\n"
-        
-        # 如果没有明确主题，使用对话标题
-        if not report_info["topic"]:
-            conversation = self.get_conversation(conversation_id)
-            if conversation:
-                report_info["topic"] = conversation.get("title", "未命名报告")
-        
-        return report_info
-        
-    def _extract_topic(self, content: str) -> str:
-        """从内容中提取主题"""
-        # 简单的主题提取逻辑
-        keywords = ["关于", "有关", "针对", "对于"]
-        for keyword in keywords:
-            if keyword in content:
-                start_idx = content.find(keyword) + len(keyword)
-                # 提取后面的内容作为主题
-                topic = content[start_idx:].strip()
-                if topic:
-                    return topic[:50] + "..." if len(topic) > 50 else topic
-        
-        # 如果没有找到关键词，返回前30个字符
-        return content[:30] + "..." if len(content) > 30 else content
+
 # 全局对话管理器实例
 conversation_manager = ConversationManagerUseSql()
\ No newline at end of file
@@ -0,0 +1,27 @@
+import json
+from typing import Any, Union
+
+try:  # orjson 可选：编解码大 dict 比标准库快数倍；未安装时回退到 json
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """非标准类型：numpy / pandas 标量取 Python 值，其余转成字符串"""
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+def dumps(data: Any) -> str:
+    """编码为 JSON 字符串（保留中文）"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, default=_default)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,166 @@
+import asyncio
+import random
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+import openai
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """异步令牌桶限流：rate 为每秒补充的令牌数，capacity 为突发上限；rate <= 0 表示不限流。"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def is_retryable(error: Exception) -> bool:
+    """429 / 5xx / 超时 / 连接错误可重试，其余（鉴权、参数错误等）直接失败。"""
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    try:
+        value = response.headers.get("retry-after") if response is not None else None
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """指数退避 + full jitter。"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_delay(error: Exception, attempt: int, base: float, cap: float) -> float:
+    """服务端给出 Retry-After 时按它等待（不超过 cap），否则指数退避。"""
+    delay = retry_after(error)
+    return min(cap, delay) if delay is not None else backoff_delay(attempt, base, cap)
+
+
+async def with_retries(call: Callable[[], Awaitable[T]], max_retries: int, base: float, cap: float) -> T:
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            await asyncio.sleep(retry_delay(e, attempt, base, cap))
+            attempt += 1
+
+
+async def stream_with_retries(open_stream: Callable[[], AsyncIterator[T]], max_retries: int,
+                              base: float, cap: float) -> AsyncIterator[T]:
+    """流式调用的重试：只在尚未产出任何分片时重新发起，已输出内容后出错直接抛出，避免向调用方重复推送。"""
+    attempt = 0
+    while True:
+        emitted = False
+        stream = open_stream()
+        try:
+            async for item in stream:
+                emitted = True
+                yield item
+            return
+        except Exception as e:
+            if emitted or attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = retry_delay(e, attempt, base, cap)
+        finally:
+            await stream.aclose()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def hedged(call: Callable[[], Awaitable[T]], delay: float) -> T:
+    """对冲请求：首个请求 delay 秒内未完成则再发一个，取先成功者并取消另一个；delay <= 0 表示关闭。"""
+    if delay <= 0:
+        return await call()
+    primary = asyncio.create_task(call())
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    pending = {primary, asyncio.create_task(call())}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def extract_usage(message) -> Optional[Dict]:
+    """从 LangChain 返回的消息 / 流式分片中取出 token 用量。
+
+    DeepSeek 在 usage 中返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens；
+    OpenAI 风格为 prompt_tokens_details.cached_tokens（LangChain 归一化为 input_token_details.cache_read）。
+    流式分片的原始 usage 由 llm_helper 的 ChatOpenAI 子类放进 response_metadata["token_usage"]，读法相同。
+    """
+    raw = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    normalized = getattr(message, "usage_metadata", None) or {}
+    if not raw and not normalized:
+        return None
+    prompt_tokens = raw.get("prompt_tokens", normalized.get("input_tokens", 0)) or 0
+    hit = raw.get("prompt_cache_hit_tokens")
+    if hit is None:
+        hit = (raw.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if hit is None:
+        hit = (normalized.get("input_token_details") or {}).get("cache_read", 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": raw.get("completion_tokens", normalized.get("output_tokens", 0)) or 0,
+        "cache_hit_tokens": hit or 0,
+    }
+
+
+class UsageStats:
+    """累计 token 用量与前缀缓存命中情况，用于衡量提示词布局带来的节省。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cache_hit_tokens": 0}
+
+    def record(self, usage: Optional[Dict]):
+        if not usage:
+            return
+        with self._lock:
+            self._totals["calls"] += 1
+            for key in ("prompt_tokens", "completion_tokens", "cache_hit_tokens"):
+                self._totals[key] += usage.get(key, 0)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            totals = dict(self._totals)
+        prompt = totals["prompt_tokens"]
+        totals["cache_hit_ratio"] = round(totals["cache_hit_tokens"] / prompt, 4) if prompt else 0.0
+        return totals
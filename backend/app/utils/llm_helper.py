@@ -1,36 +1,126 @@
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from typing import List, Dict, AsyncGenerator
+from typing import List, Dict, AsyncGenerator, Optional
 import asyncio
-from app.config import DEEPSEEK_API_KEY, BASE_URL
+import httpx
+from app.config import (
+    DEEPSEEK_API_KEY,
+    BASE_URL,
+    LLM_MODEL,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_CONCURRENCY,
+    LLM_RATE_LIMIT_RPS,
+    LLM_RATE_LIMIT_BURST,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE,
+    LLM_RETRY_MAX,
+    LLM_TIMEOUT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_HEDGE_DELAY,
+)
+from app.utils.completion_cache import CompletionCache, SQLiteCompletionCache, completion_key
+from app.utils.llm_client import (
+    TokenBucket, UsageStats, with_retries, stream_with_retries, hedged, extract_usage,
+)
+
+class _DeepSeekChatOpenAI(ChatOpenAI):
+    """流式分片的 usage 经 LangChain 归一化后会丢掉 DeepSeek 的 prompt_cache_hit_tokens，
+    这里把原始 usage 放进分片的 response_metadata["token_usage"]（与非流式响应相同的位置），供 extract_usage 读取"""
+
+    def _convert_chunk_to_generation_chunk(self, chunk, default_chunk_class, base_generation_info):
+        generation_chunk = super()._convert_chunk_to_generation_chunk(chunk, default_chunk_class, base_generation_info)
+        usage = chunk.get("usage") if isinstance(chunk, dict) else None
+        if generation_chunk is not None and usage:
+            generation_chunk.message.response_metadata["token_usage"] = usage
+        return generation_chunk
 
 class LLMHelper:
-    def __init__(self):
-        self.llm = ChatOpenAI(
-            model_name="deepseek-chat",
+    """DeepSeek（OpenAI 兼容）调用封装。
+
+    - 共享连接池的 httpx 客户端（同步 / 异步各一个），在 lifespan 关闭时释放
+    - 并发信号量 + 令牌桶限流，避免突发请求触发 429
+    - 429 / 5xx / 超时按指数退避 + jitter 重试；非流式调用可选对冲请求削减长尾
+    base_url / api_key 可注入，便于对接本地的 OpenAI 兼容测试服务。
+    """
+
+    def __init__(self, api_key: Optional[str] = DEEPSEEK_API_KEY, base_url: str = BASE_URL, model: str = LLM_MODEL,
+                 cache: Optional[CompletionCache] = None):
+        self.model = model
+        self.cache = cache if cache is not None else SQLiteCompletionCache()
+        limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        timeout = httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        self.http_client = httpx.Client(limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        self.llm = _DeepSeekChatOpenAI(
+            model_name=model,
             temperature=0.7,
-            openai_api_key=DEEPSEEK_API_KEY,
-            base_url=BASE_URL,
-            max_tokens=2000   # ✅ 在这里设置
+            openai_api_key=api_key,
+            base_url=base_url,
+            max_tokens=2000,   # ✅ 在这里设置
+            max_retries=0,     # 重试由本类统一处理
+            stream_usage=True, # 流式调用也返回 usage，用于统计缓存命中
+            timeout=LLM_TIMEOUT,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
         )
-    
-    async def chat_completion(self, messages: List[Dict], temperature: float = 0.7) -> Dict:
-        """调用 DeepSeek Chat Completion API"""
+        self._semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self._bucket = TokenBucket(LLM_RATE_LIMIT_RPS, LLM_RATE_LIMIT_BURST)
+        self.usage = UsageStats()
+
+    @staticmethod
+    def _to_langchain(messages: List[Dict]) -> list:
+        # 转换消息格式
+        langchain_messages = []
+        for msg in messages:
+            if msg["role"] == "user":
+                langchain_messages.append(HumanMessage(content=msg["content"]))
+            elif msg["role"] == "assistant":
+                langchain_messages.append(AIMessage(content=msg["content"]))
+            elif msg["role"] == "system":
+                langchain_messages.append(SystemMessage(content=msg["content"]))
+        return langchain_messages
+
+    @staticmethod
+    def _call_params(temperature: float, max_tokens: Optional[int], stop: Optional[List[str]]) -> Dict:
+        """单次调用的生成参数，覆盖 ChatOpenAI 上的默认值"""
+        params = {"temperature": temperature}
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        if stop:
+            params["stop"] = stop
+        return params
+
+    async def _guarded_invoke(self, langchain_messages: list, params: Dict):
+        async with self._semaphore:
+            await self._bucket.acquire()
+            return await self.llm.ainvoke(langchain_messages, **params)
+
+    async def chat_completion(self, messages: List[Dict], temperature: float = 0.7,
+                              max_tokens: Optional[int] = None, stop: Optional[List[str]] = None,
+                              cache: bool = False, cache_ttl: Optional[int] = None) -> Dict:
+        """调用 DeepSeek Chat Completion API
+
+        temperature / max_tokens / stop 按次生效；max_tokens 不传时使用默认的 2000。
+        cache=True 时先查响应缓存（key 为模型 + 参数 + 消息哈希），未命中再请求并写入缓存。
+        """
         try:
-            # 转换消息格式
-            langchain_messages = []
-            for msg in messages:
-                if msg["role"] == "user":
-                    langchain_messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    langchain_messages.append(AIMessage(content=msg["content"]))
-                elif msg["role"] == "system":
-                    langchain_messages.append(SystemMessage(content=msg["content"]))
-            
-            # 调用 LLM
-            response = await self.llm.ainvoke(langchain_messages)
-            
-            return {
+            langchain_messages = self._to_langchain(messages)
+            params = self._call_params(temperature, max_tokens, stop)
+            cache_key = None
+            if cache and self.cache.enabled:
+                cache_key = completion_key(self.model, params, messages)
+                cached = await asyncio.to_thread(self.cache.get, cache_key)
+                if cached is not None:
+                    return cached
+
+            # 调用 LLM（限流 + 重试 + 可选对冲）
+            response = await with_retries(
+                lambda: hedged(lambda: self._guarded_invoke(langchain_messages, params), LLM_HEDGE_DELAY),
+                LLM_MAX_RETRIES, LLM_RETRY_BASE, LLM_RETRY_MAX,
+            )
+            self.usage.record(extract_usage(response))
+
+            result = {
                 "choices": [{
                     "message": {
                         "content": response.content,
@@ -38,37 +128,56 @@ class LLMHelper:
                     }
                 }]
             }
+            if cache_key is not None:
+                await asyncio.to_thread(self.cache.put, cache_key, result, cache_ttl)
+            return result
         except Exception as e:
             raise Exception(f"DeepSeek API 调用失败: {str(e)}")
-    
-    async def chat_completion_stream(self, messages: List[Dict], temperature: float = 0.7) -> AsyncGenerator[Dict, None]:
-        """流式调用 DeepSeek Chat Completion API"""
-        try:
-            # 转换消息格式
-            langchain_messages = []
-            for msg in messages:
-                if msg["role"] == "user":
-                    langchain_messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    langchain_messages.append(AIMessage(content=msg["content"]))
-                elif msg["role"] == "system":
-                    langchain_messages.append(SystemMessage(content=msg["content"]))
-            
-            # 流式调用 LLM
-            async for chunk in self.llm.astream(langchain_messages):
+
+    async def _guarded_stream(self, langchain_messages: list, params: Dict) -> AsyncGenerator[str, None]:
+        """持有并发名额与限流令牌的单次流式调用，只产出非空内容"""
+        async with self._semaphore:
+            await self._bucket.acquire()
+            async for chunk in self.llm.astream(langchain_messages, **params):
+                # usage 随最后一个（内容为空的）分片返回
+                self.usage.record(extract_usage(chunk))
                 if chunk.content:
-                    yield {
-                        "type": "stream_chunk",
-                        "content": chunk.content
-                    }
-                    
+                    yield chunk.content
+
+    async def chat_completion_stream(self, messages: List[Dict], temperature: float = 0.7,
+                                     max_tokens: Optional[int] = None,
+                                     stop: Optional[List[str]] = None) -> AsyncGenerator[Dict, None]:
+        """流式调用 DeepSeek Chat Completion API
+
+        只在尚未输出任何 token 时重试，避免向调用方重复推送内容。
+        """
+        langchain_messages = self._to_langchain(messages)
+        params = self._call_params(temperature, max_tokens, stop)
+        stream = stream_with_retries(
+            lambda: self._guarded_stream(langchain_messages, params),
+            LLM_MAX_RETRIES, LLM_RETRY_BASE, LLM_RETRY_MAX,
+        )
+        try:
+            async for content in stream:
+                yield {
+                    "type": "stream_chunk",
+                    "content": content
+                }
         except Exception as e:
             yield {
                 "type": "error",
                 "content": f"DeepSeek API 流式调用失败: {str(e)}"
             }
+        finally:
+            await stream.aclose()
+
+    def usage_stats(self) -> Dict:
+        """累计 token 用量与前缀缓存命中率"""
+        return {**self.usage.snapshot(), "completion_cache": self.cache.stats()}
+
     async def close(self):
-            # 如果没有需要清理的内容，就留空
-            pass
+        """释放连接池（在应用 lifespan 结束时调用）"""
+        await self.http_async_client.aclose()
+        self.http_client.close()
 # 全局 LLM Helper 实例
-llm_helper = LLMHelper()
\ No newline at end of file
+llm_helper = LLMHelper()
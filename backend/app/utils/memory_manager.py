@@ -5,13 +5,27 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.docstore.document import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import WebBaseLoader
+import logging
 import os
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from app.config import MEMORY_HYBRID
+from app.services.lexical_index import LexicalIndex, looks_exact, rrf_fuse
+from app.utils.rwlock import ReadWriteLock
+
+logger = logging.getLogger(__name__)
 
 class MemoryManager:
     def __init__(self, persist_dir="faiss_index"):
         self.embeddings = HuggingFaceEmbeddings( model_name="shibing624/text2vec-base-chinese")
         self.persist_dir = persist_dir
         self.vectorstore = None
+        # 检索在线程池中并发执行：检索之间共享读锁，写入（add_documents / save_local）独占写锁
+        self._lock = ReadWriteLock()
+        # 后台写入单独一个线程：写入本就串行（持有写锁），也不占用检索线程池
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-write")
+        # 与 FAISS 共用 chunk_id 的 BM25 倒排索引
+        self.lexical = LexicalIndex(persist_dir)
         self.splitter = RecursiveCharacterTextSplitter(
                         chunk_size=800,
                         chunk_overlap=120,
@@ -30,24 +44,55 @@ class MemoryManager:
             self.vectorstore = None
         return self.vectorstore
     def _ensure_store(self):
+        """首次使用时加载本地索引；加载会替换 vectorstore，放在写锁内"""
         if self.vectorstore is None:
-            self.create_or_load()
+            with self._lock.write():
+                if self.vectorstore is None:
+                    self.create_or_load()
         
     def add_texts(self, texts):
-        self._ensure_store()
         docs = [Document(page_content=t) for t in texts]
         if not docs:
             return
         # 切块后再入库
         chunks = self.splitter.split_documents(docs)
 
-        if self.vectorstore is None:
-        # 首次创建
-            self.vectorstore = FAISS.from_documents(docs, self.embeddings)
-        else:
-            self.vectorstore.add_documents(chunks)
-        
-        self.vectorstore.save_local(self.persist_dir)
+        self._ensure_store()
+        with self._lock.write():
+            if self.vectorstore is None:
+            # 首次创建
+                to_add = docs
+                ids = self._assign_ids(to_add)
+                self.vectorstore = FAISS.from_documents(to_add, self.embeddings, ids=ids)
+            else:
+                to_add = chunks
+                ids = self._assign_ids(to_add)
+                self.vectorstore.add_documents(to_add, ids=ids)
+
+            self.vectorstore.save_local(self.persist_dir)
+            self.lexical.add(ids, to_add)
+
+    def add_texts_background(self, texts) -> Future:
+        """在后台线程写入长期记忆，不阻塞调用方；失败时记录日志"""
+        future = self._writer.submit(self.add_texts, texts)
+        future.add_done_callback(self._log_write_failure)
+        return future
+
+    @staticmethod
+    def _log_write_failure(future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("写入长期记忆失败", exc_info=future.exception())
+
+    def shutdown(self):
+        """等待尚未完成的后台写入（应用关闭时调用）"""
+        self._writer.shutdown(wait=True)
+
+    @staticmethod
+    def _assign_ids(docs: List[Document]) -> List[str]:
+        ids = [str(uuid.uuid4()) for _ in docs]
+        for chunk_id, doc in zip(ids, docs):
+            doc.metadata["chunk_id"] = chunk_id
+        return ids
 
     def add_urls(self, urls: List[str]):
         urls = [u for u in urls if u and u.strip()]
@@ -60,9 +105,25 @@ class MemoryManager:
 
     def search(self, query, k=5):
         self._ensure_store()
-        if self.vectorstore is None:
-            return []
-        return self.vectorstore.similarity_search(query, k=k)
+        with self._lock.read():
+            if MEMORY_HYBRID and looks_exact(query):
+                # 编号/名称等精确词：倒排索引命中即返回，不做 embedding
+                hits = self.lexical.search(query, k, exact=True)
+                if hits:
+                    return [doc for _, doc, _ in hits]
+            if self.vectorstore is None:
+                return []
+            if not MEMORY_HYBRID:
+                return self.vectorstore.similarity_search(query, k=k)
+            vector_docs = self.vectorstore.similarity_search(query, k=k * 2)
+            lexical_hits = self.lexical.search(query, k * 2)
+            if not lexical_hits:
+                return vector_docs[:k]
+            return rrf_fuse(
+                [[(d.metadata.get("chunk_id") or d.page_content, d) for d in vector_docs],
+                 [(chunk_id, d) for chunk_id, d, _ in lexical_hits]],
+                k,
+            )
     
     def as_retriever(self, k: int = 5):
         self._ensure_store()
@@ -0,0 +1,14 @@
+import json
+from typing import Any
+
+
+def sse_event(event: str, data: Any) -> str:
+    """格式化一条 Server-Sent Event。"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # 关闭 nginx 缓冲，保证逐 token 推送
+}
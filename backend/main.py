@@ -17,10 +17,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from app.routes.chat import router as chat_router
+import asyncio
+from app.routes.chat import router as chat_router, memory_manager
 from app.routes.rag import router as rag_router
 from app.utils.llm_helper import llm_helper
-from app.database import init_db
+from app.database import init_db, pool_status, async_engine
+from app.services.retrieval_orchestrator import retrieval_orchestrator, federated_orchestrator
+from app.services.summary_service import conversation_summarizer
+from app.services.message_writer import message_writer
+from app.services.text_analysis import text_analyzer
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -28,12 +33,21 @@ async def lifespan(app: FastAPI):
     print("正在启动 AI Agent...")
     # 初始化数据库
     init_db()
+    # 预加载 jieba 词典并启动分词进程池，避免第一次文件分析 / 词法索引请求承担加载耗时
+    await asyncio.to_thread(text_analyzer.preload)
     
     yield
     
     # 关闭时的清理操作
     print("正在关闭 AI Agent...")
+    await conversation_summarizer.drain()
+    await message_writer.drain()
+    await asyncio.to_thread(memory_manager.shutdown)
     await llm_helper.close()
+    retrieval_orchestrator.shutdown()
+    federated_orchestrator.shutdown()
+    text_analyzer.shutdown()
+    await async_engine.dispose()
 
 
 # 创建 FastAPI 应用
@@ -67,9 +81,11 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "db_pool": pool_status(), "message_writer": message_writer.stats()}
 
 if __name__ == "__main__":
+    # 生产环境请用 `uvicorn main:app` 启动：分词进程池（spawn）的工作进程会重新导入 __main__，
+    # 以本文件为入口时每个工作进程都要再加载一遍全部路由和模型，见 TextAnalyzer
     import uvicorn
     uvicorn.run(
         "main:app",
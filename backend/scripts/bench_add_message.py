@@ -0,0 +1,107 @@
+"""消息追加基准：对比 DatabaseService.add_message（单事务 + next_sequence）与旧的 COUNT(*) 多次提交写法，
+并用多线程并发追加同一对话验证序号分配无冲突、无空洞。
+
+用法（在 backend 目录下）：
+    python -m scripts.bench_add_message --conversations 20 --messages 200 --threads 8
+默认使用临时 SQLite 文件；可通过 --database-url 指定其他库（会写入测试数据）。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--conversations", type=int, default=20)
+parser.add_argument("--messages", type=int, default=200, help="每个对话追加的消息数")
+parser.add_argument("--threads", type=int, default=8, help="并发追加同一对话的线程数")
+parser.add_argument("--database-url", default="")
+args = parser.parse_args()
+
+# 必须在导入 app.database 之前设置，引擎在导入时创建
+_tmpdir = tempfile.mkdtemp(prefix="bench_add_message_")
+os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+
+from sqlalchemy import func  # noqa: E402
+
+from app.database import SessionLocal, init_db  # noqa: E402
+from app.models import Conversation, Message  # noqa: E402
+from app.services.db_service import DatabaseService  # noqa: E402
+
+
+def legacy_add_message(db, conversation_id: str, role: str, content: str):
+    """改造前的写法：COUNT(*) 取序号，插入、更新时间分两次提交"""
+    count = db.query(Message).filter(Message.conversation_id == conversation_id).count()
+    message = Message(conversation_id=conversation_id, role=role, content=content, sequence=count + 1)
+    db.add(message)
+    db.commit()
+    db.refresh(message)
+    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    conversation.updated_at = func.now()
+    db.commit()
+
+
+def run_sequential(label: str, append) -> float:
+    db = SessionLocal()
+    service = DatabaseService(db)
+    conversation_ids = [service.create_conversation(f"bench-{label}-{i}").id for i in range(args.conversations)]
+    start = time.perf_counter()
+    for n in range(args.messages):
+        for cid in conversation_ids:
+            append(db, service, cid, f"第 {n} 条消息")
+    elapsed = time.perf_counter() - start
+    db.close()
+    total = args.conversations * args.messages
+    print(f"{label:<10}{total:>10}{elapsed:>10.2f}{total / elapsed:>12.0f}")
+    return elapsed
+
+
+def run_concurrent() -> bool:
+    db = SessionLocal()
+    conversation_id = DatabaseService(db).create_conversation("bench-concurrent").id
+    db.close()
+    errors = []
+
+    def worker():
+        session = SessionLocal()
+        service = DatabaseService(session)
+        try:
+            for n in range(args.messages // args.threads or 1):
+                service.add_message(conversation_id, "user", f"并发消息 {n}")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    db = SessionLocal()
+    sequences = [s for (s,) in db.query(Message.sequence).filter(Message.conversation_id == conversation_id)]
+    next_sequence = db.query(Conversation.next_sequence).filter(Conversation.id == conversation_id).scalar()
+    db.close()
+    ok = (not errors and sorted(sequences) == list(range(1, len(sequences) + 1))
+          and next_sequence == len(sequences) + 1)
+    print(f"concurrent: threads={args.threads} messages={len(sequences)} errors={len(errors)} "
+          f"sequences_contiguous={'yes' if ok else 'NO'}")
+    for e in errors[:3]:
+        print(f"  error: {e}")
+    return ok
+
+
+def main():
+    init_db()
+    print(f"database={os.environ['DATABASE_URL']}")
+    print(f"{'path':<10}{'messages':>10}{'secs':>10}{'msgs/sec':>12}")
+    legacy = run_sequential("legacy", lambda db, service, cid, text: legacy_add_message(db, cid, "user", text))
+    current = run_sequential("append", lambda db, service, cid, text: service.add_message(cid, "user", text))
+    print(f"speedup: {legacy / current:.2f}x")
+    sys.exit(0 if run_concurrent() else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""异步 DB 基准：N 个模拟 WebSocket 会话并发“追加用户消息 → 取历史 → 追加 AI 回复”，
+对比同步 DatabaseService（在事件循环里直接阻塞）与 await chat_repository 两种写法的
+总耗时和事件循环延迟（一个 10ms 定时器的实际唤醒偏差，反映其他连接被卡住多久）。
+
+用法（在 backend 目录下）：
+    python -m scripts.bench_async_db --sockets 50 --turns 20
+默认使用临时 SQLite 文件；可通过 --database-url 指定其他库（会写入测试数据）。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sockets", type=int, default=50, help="并发会话数")
+parser.add_argument("--turns", type=int, default=20, help="每个会话的对话轮数")
+parser.add_argument("--history", type=int, default=40, help="每轮读取的历史条数")
+parser.add_argument("--database-url", default="")
+args = parser.parse_args()
+
+# 必须在导入 app.database 之前设置，引擎在导入时创建
+_tmpdir = tempfile.mkdtemp(prefix="bench_async_db_")
+os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+
+from app.database import init_db, async_engine, session_scope  # noqa: E402
+from app.services.db_service import DatabaseService  # noqa: E402
+from app.services.chat_repository import chat_repository  # noqa: E402
+
+TICK = 0.01
+
+
+async def monitor_loop(lags: list, stop: asyncio.Event):
+    """每 TICK 秒醒一次，记录超出预期的唤醒延迟"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(max(0.0, loop.time() - start - TICK))
+
+
+def sync_add(conversation_id: str, role: str, content: str):
+    with session_scope() as db:
+        DatabaseService(db).add_message(conversation_id, role, content)
+
+
+def sync_history(conversation_id: str):
+    """与 chat_repository.get_history_context 相同的两次查询，同步执行"""
+    with session_scope() as db:
+        service = DatabaseService(db)
+        conversation = service.get_conversation(conversation_id)
+        return service.get_message_window(
+            conversation_id, after=conversation.summary_upto or 0, limit=args.history, tail=True,
+            columns=("role", "content"),
+        )
+
+
+async def sync_socket(n: int):
+    with session_scope() as db:
+        conversation_id = DatabaseService(db).create_conversation(f"bench-sync-{n}").id
+    for turn in range(args.turns):
+        sync_add(conversation_id, "user", f"问题 {turn}")
+        sync_history(conversation_id)
+        await asyncio.sleep(0)  # 模拟 LLM 流式输出期间让出事件循环
+        sync_add(conversation_id, "assistant", f"回答 {turn}")
+
+
+async def async_socket(n: int):
+    conversation_id = await chat_repository.create_conversation(f"bench-async-{n}")
+    for turn in range(args.turns):
+        await chat_repository.add_message(conversation_id, {"role": "user", "content": f"问题 {turn}"})
+        await chat_repository.get_history_context(conversation_id, args.history)
+        await asyncio.sleep(0)
+        await chat_repository.add_message(conversation_id, {"role": "assistant", "content": f"回答 {turn}"})
+
+
+async def run(label: str, socket):
+    lags: list = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(socket(n) for n in range(args.sockets)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if len(lags) >= 100 else (lags[-1] if lags else 0.0)
+    mean = statistics.mean(lags) if lags else 0.0
+    messages = args.sockets * args.turns * 2
+    print(f"{label:<8}{elapsed:>9.2f}{messages / elapsed:>11.0f}{len(lags):>8}"
+          f"{mean * 1000:>11.1f}{p99 * 1000:>10.1f}{(lags[-1] if lags else 0) * 1000:>10.1f}")
+
+
+async def main():
+    init_db()
+    print(f"database={os.environ['DATABASE_URL']} sockets={args.sockets} turns={args.turns}")
+    print(f"{'path':<8}{'secs':>9}{'msgs/sec':>11}{'ticks':>8}{'lag_mean':>11}{'lag_p99':>10}{'lag_max':>10}  (ms)")
+    await run("sync", sync_socket)
+    await run("async", async_socket)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""检索策略基准：在固定的 fixture KB 上比较各检索策略（similarity / mmr / rerank / hybrid / keyword）的延迟与命中率。
+
+用法（在 backend 目录下）：
+    python -m scripts.bench_retrieval                 # 使用 EMBEDDING_MODEL
+    python -m scripts.bench_retrieval --fake-embeddings --docs 2000
+"""
+import argparse
+import hashlib
+import random
+import statistics
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+
+from app.services.retrieval_engine import retrieval_engine, default_settings, STRATEGIES
+from app.services.lexical_index import LexicalIndex
+
+ATTRS = ["价格", "保修期", "产地", "重量", "功率", "材质"]
+FILLER = "该产品面向企业用户，支持批量采购与定制服务。售后团队提供全天候技术支持。"
+
+
+class HashEmbeddings(Embeddings):
+    """离线用的字符 bigram 哈希向量，只用于对比策略开销，不代表真实效果。"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for i in range(len(text) - 1):
+            h = int(hashlib.md5(text[i:i + 2].encode("utf-8")).hexdigest()[:8], 16)
+            vec[h % self.dim] += 1.0
+        norm = np.linalg.norm(vec) or 1.0
+        return (vec / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def build_fixture(n_docs: int, seed: int = 42):
+    rnd = random.Random(seed)
+    docs, queries = [], []
+    for i in range(n_docs):
+        code = f"AX-{1000 + i}"
+        attr = ATTRS[i % len(ATTRS)]
+        value = f"{rnd.randint(1, 999)}"
+        text = f"产品 {code} 的{attr}是 {value}。{FILLER}"
+        docs.append(Document(page_content=text, metadata={"kb": "bench", "file": f"{code}.txt"}))
+        queries.append((f"{code} 的{attr}是多少", text))
+    return docs, queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--fake-embeddings", action="store_true")
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        embeddings = HashEmbeddings()
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        from app.config import EMBEDDING_MODEL
+        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+    docs, queries = build_fixture(args.docs)
+    queries = random.Random(7).sample(queries, min(args.queries, len(queries)))
+    with tempfile.TemporaryDirectory() as tmp:
+        ids = [f"chunk-{i}" for i in range(len(docs))]
+        db = Chroma.from_documents(docs, embedding=embeddings, ids=ids, persist_directory=tmp)
+        LexicalIndex(tmp).add(ids, docs)
+        query_vectors = [embeddings.embed_query(q) for q, _ in queries]
+
+        print(f"docs={args.docs} queries={len(queries)} k={args.k} fetch_k={args.fetch_k}")
+        print(f"{'strategy':<12}{'p50(ms)':>10}{'p95(ms)':>10}{'hit@k':>8}")
+        for strategy in STRATEGIES:
+            settings = {**default_settings(), "strategy": strategy, "fetch_k": args.fetch_k}
+            latencies, hits = [], 0
+            for (query, expected), qv in zip(queries, query_vectors):
+                start = time.perf_counter()
+                results = retrieval_engine.search_by_vector(db, qv, args.k, settings, query=query)
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += any(doc.page_content == expected for doc, _ in results)
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(f"{strategy:<12}{statistics.median(latencies):>10.2f}{p95:>10.2f}{hits / len(queries):>8.2%}")
+
+
+if __name__ == "__main__":
+    main()
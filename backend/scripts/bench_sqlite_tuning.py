@@ -0,0 +1,91 @@
+"""SQLite 写入压测：对比默认连接参数、WAL/synchronous=NORMAL/busy_timeout 等 PRAGMA、
+以及再叠加 group commit 三种配置下的消息写入吞吐（msgs/sec）和失败数（database is locked 等）。
+
+每种配置在独立子进程、独立的临时库里运行（PRAGMA 与 group commit 在导入时读取环境变量）：
+N 个并发写者各自向自己的对话追加 M 条消息，全部经 message_writer.add_message 写入。
+
+用法（在 backend 目录下）：
+    python -m scripts.bench_sqlite_tuning --writers 32 --messages 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = {
+    "baseline": {"SQLITE_PRAGMAS": "false", "MESSAGE_GROUP_COMMIT": "false"},
+    "pragmas": {"SQLITE_PRAGMAS": "true", "MESSAGE_GROUP_COMMIT": "false"},
+    "group": {"SQLITE_PRAGMAS": "true", "MESSAGE_GROUP_COMMIT": "true"},
+}
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--writers", type=int, default=32, help="并发写者数")
+parser.add_argument("--messages", type=int, default=100, help="每个写者追加的消息数")
+parser.add_argument("--mode", choices=sorted(MODES), help="只运行一种配置（子进程内部使用）")
+args = parser.parse_args()
+
+
+async def run_mode() -> dict:
+    from app.database import init_db, async_engine
+    from app.services.chat_repository import chat_repository
+    from app.services.message_writer import message_writer
+
+    init_db()
+    conversation_ids = [await chat_repository.create_conversation(f"bench-{n}") for n in range(args.writers)]
+    failures = 0
+
+    async def writer(conversation_id: str):
+        nonlocal failures
+        for n in range(args.messages):
+            ok = await message_writer.add_message(conversation_id, {"role": "user", "content": f"压测消息 {n}"})
+            failures += 0 if ok else 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(cid) for cid in conversation_ids))
+    elapsed = time.perf_counter() - start
+    await message_writer.drain()
+    await async_engine.dispose()
+
+    total = args.writers * args.messages
+    return {
+        "elapsed": elapsed,
+        "written": total - failures,
+        "failures": failures,
+        "avg_batch": message_writer.stats()["avg_batch"],
+    }
+
+
+def spawn(mode: str) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix=f"bench_sqlite_{mode}_")
+    env = dict(os.environ, **MODES[mode])
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    env.pop("ASYNC_DATABASE_URL", None)
+    cmd = [sys.executable, "-m", "scripts.bench_sqlite_tuning", "--mode", mode,
+           "--writers", str(args.writers), "--messages", str(args.messages)]
+    out = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    if args.mode:
+        print(json.dumps(asyncio.run(run_mode())))
+        return
+
+    print(f"writers={args.writers} messages/writer={args.messages}")
+    print(f"{'mode':<10}{'written':>9}{'failed':>8}{'secs':>9}{'msgs/sec':>11}{'avg_batch':>11}")
+    results = {}
+    for mode in MODES:
+        r = results[mode] = spawn(mode)
+        print(f"{mode:<10}{r['written']:>9}{r['failures']:>8}{r['elapsed']:>9.2f}"
+              f"{r['written'] / r['elapsed']:>11.0f}{r['avg_batch']:>11}")
+    base = results["baseline"]["written"] / results["baseline"]["elapsed"]
+    for mode in ("pragmas", "group"):
+        print(f"{mode} vs baseline: {results[mode]['written'] / results[mode]['elapsed'] / base:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""文档分析基准：对比改造前的写法（单线程 jieba.lcut + 三种长度的摘要各切一次句子）
+与 text_analyzer（进程池并行分词 + 分词/句子切分只做一次并缓存）。
+
+用法（在 backend 目录下）：
+    python -m scripts.bench_text_analysis --size-mb 1 --workers 4
+    python -m scripts.bench_text_analysis --file path/to/document.txt
+"""
+import argparse
+import os
+import random
+import re
+import time
+from collections import Counter
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--file", default="", help="UTF-8 文本文件，默认生成随机中文文本")
+parser.add_argument("--size-mb", type=float, default=1.0)
+parser.add_argument("--workers", type=int, default=0, help="进程池大小，默认取 TOKENIZE_WORKERS")
+args = parser.parse_args()
+
+if args.workers:
+    os.environ["TOKENIZE_WORKERS"] = str(args.workers)
+os.environ.setdefault("TOKENIZE_PARALLEL_CHARS", "100000")
+
+import jieba  # noqa: E402
+
+from app.services.text_analysis import text_analyzer  # noqa: E402
+
+WORDS = ["人工智能", "数据", "分析", "报告", "营业收入", "同比增长", "公司", "市场", "模型", "用户",
+         "产品", "研发", "投入", "季度", "利润", "风险", "客户", "平台", "服务", "技术"]
+
+
+def sample_text(size_mb: float) -> str:
+    rng = random.Random(0)
+    target = int(size_mb * 1024 * 1024 / 3)  # UTF-8 下中文约 3 字节/字
+    parts, length = [], 0
+    while length < target:
+        sentence = "".join(rng.choice(WORDS) for _ in range(rng.randint(5, 15))) + rng.choice("。！？")
+        if rng.random() < 0.1:
+            sentence += "\n"
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+
+def legacy(text: str):
+    words = jieba.lcut(text)
+    Counter(w for w in words if len(w) > 1 and w.isalpha()).most_common(20)
+    for _ in (100, 300, 1000):
+        re.split(r'[。！？.!?]', text)
+
+
+def current(text: str):
+    doc = text_analyzer.document(text)
+    Counter(w for w in doc.tokens if len(w) > 1 and w.isalpha()).most_common(20)
+    for _ in (100, 300, 1000):
+        doc.sentences
+
+
+def timed(fn, text: str) -> float:
+    start = time.perf_counter()
+    fn(text)
+    return time.perf_counter() - start
+
+
+def main():
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = sample_text(args.size_mb)
+    print(f"chars={len(text)} workers={text_analyzer.workers}")
+
+    text_analyzer.preload()
+    # 启动进程池并让各工作进程加载词典，模拟应用启动后的稳态
+    text_analyzer.tokenize("预热" * (text_analyzer.parallel_chars // 2 + 1))
+
+    base = timed(legacy, text)
+    cold = timed(current, text)
+    warm = timed(current, text)
+    print(f"{'path':<16}{'secs':>8}{'speedup':>9}")
+    print(f"{'legacy':<16}{base:>8.2f}{1:>9.2f}")
+    print(f"{'parallel':<16}{cold:>8.2f}{base / cold:>9.2f}")
+    print(f"{'cached':<16}{warm:>8.3f}{base / max(warm, 1e-6):>9.0f}")
+
+    same = jieba.lcut(text) == text_analyzer.document(text).tokens
+    print(f"tokens_identical={'yes' if same else 'NO'}")
+    text_analyzer.shutdown()
+
+
+if __name__ == "__main__":
+    main()
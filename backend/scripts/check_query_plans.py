@@ -0,0 +1,104 @@
+"""热点查询的执行计划检查：对每条热点查询执行 EXPLAIN QUERY PLAN，出现全表扫描（SCAN <table>）
+或需要额外排序（USE TEMP B-TREE FOR ORDER BY）即视为退化，以非零状态码退出。
+
+检查的是 db_service 中的语句构造函数生成的语句本身（DatabaseService 与 AsyncChatRepository 执行的就是它们），
+不是手写副本，查询改动后计划检查自动跟上。
+
+用法（在 backend 目录下）：
+    python -m scripts.check_query_plans                      # 临时库：建表 + 迁移后检查
+    python -m scripts.check_query_plans --database-url sqlite:///./ai_agent.db   # 检查已有库（会先执行迁移）
+新增热点查询时把语句提成 db_service 中的构造函数，并在 HOT_QUERIES 中补充一条。
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+from app.database import configure_sqlite, init_db
+from app.services.db_service import (
+    conversations_select,
+    conversation_page_select,
+    encode_cursor,
+    message_window_select,
+    last_message_content_select,
+    max_sequence_select,
+    next_sequence_update,
+    files_by_conversation_select,
+)
+
+CURSOR = encode_cursor(datetime(2024, 1, 1), "c")
+
+HOT_QUERIES = {
+    "message window (ORDER BY sequence)":
+        message_window_select("c")[0],
+    "messages after summary mark (ascending)":
+        message_window_select("c", after=10)[0],
+    "recent turns after summary mark (tail)":
+        message_window_select("c", after=10, limit=30, tail=True, columns=("role", "content"))[0],
+    "message page before sequence (projection)":
+        message_window_select("c", before=500, limit=101, tail=True, columns=("role", "content", "sequence"))[0],
+    "max sequence of conversation":
+        max_sequence_select("c"),
+    "append: allocate next_sequence":
+        next_sequence_update("c", "预览", datetime(2024, 1, 1)),
+    "conversation preview (last message by created_at)":
+        last_message_content_select("c"),
+    "active conversations by updated_at":
+        conversations_select(),
+    "user's active conversations by updated_at":
+        conversations_select(user_id="u"),
+    "conversation list page (keyset)":
+        conversation_page_select(limit=50, cursor=CURSOR),
+    "user's conversation list page (keyset)":
+        conversation_page_select(user_id="u", limit=50, cursor=CURSOR),
+    "file records by conversation":
+        files_by_conversation_select("c"),
+}
+
+
+def regressions(plan_rows) -> list:
+    problems = []
+    for row in plan_rows:
+        detail = row[-1]
+        # "SCAN t USING [COVERING] INDEX ..." 是按索引顺序遍历，可以接受；裸 SCAN 才是全表扫描
+        if detail.startswith("SCAN ") and "USING" not in detail:
+            problems.append(detail)
+        if "USE TEMP B-TREE" in detail:
+            problems.append(detail)
+    return problems
+
+
+def explain(conn, stmt) -> list:
+    """对语句执行 EXPLAIN QUERY PLAN（绑定参数内联为字面量），返回计划行"""
+    sql = str(stmt.compile(conn.engine, compile_kwargs={"literal_binds": True}))
+    return conn.execute(text("EXPLAIN QUERY PLAN " + sql)).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default="")
+    args = parser.parse_args(argv)
+
+    # 使用独立引擎，不依赖导入 app.database 时的 DATABASE_URL
+    url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+    check_engine = create_engine(url)
+    configure_sqlite(check_engine)
+    init_db(check_engine)
+    failed = False
+    with check_engine.connect() as conn:
+        for name, stmt in HOT_QUERIES.items():
+            plan = explain(conn, stmt)
+            problems = regressions(plan)
+            print(f"[{'FAIL' if problems else ' OK '}] {name}")
+            for row in plan:
+                print(f"         {row[-1]}")
+            failed = failed or bool(problems)
+    check_engine.dispose()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
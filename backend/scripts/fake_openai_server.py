@@ -0,0 +1,110 @@
+"""本地 OpenAI 兼容测试服务，用于验证 LLMHelper 的限流 / 重试 / 对冲 / 流式行为，
+以及提示词布局对前缀缓存命中（usage.prompt_cache_hit_tokens）的影响。
+
+用法（在 backend 目录下）：
+    python -m scripts.fake_openai_server --port 9999 --latency 0.2 --fail-rate 0.3
+然后让应用指向它：
+    BASE_URL=http://127.0.0.1:9999/v1 DEEPSEEK_API_KEY=test uvicorn main:app
+或在代码中直接构造：LLMHelper(api_key="test", base_url="http://127.0.0.1:9999/v1")
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake OpenAI")
+settings = {"latency": 0.0, "slow_rate": 0.0, "slow_latency": 5.0, "fail_rate": 0.0}
+stats = {"requests": 0, "rate_limited": 0}
+_seen_prompts = []
+
+
+def _prompt_usage(body: dict) -> dict:
+    """粗略模拟前缀缓存：与历史请求的最长公共前缀按 64 token 对齐计为命中（约 4 字符 / token）"""
+    prompt = json.dumps(body.get("messages") or [], ensure_ascii=False)
+    best = max((len(os.path.commonprefix([prompt, prev])) for prev in _seen_prompts), default=0)
+    _seen_prompts.append(prompt)
+    del _seen_prompts[:-64]
+    prompt_tokens = max(1, len(prompt) // 4)
+    hit = min(prompt_tokens, (best // 4) // 64 * 64)
+    return {"prompt_tokens": prompt_tokens, "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt_tokens - hit}
+
+
+def _reply_text(body: dict) -> str:
+    last = (body.get("messages") or [{}])[-1].get("content", "")
+    return f"echo: {last[:200]}"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    if random.random() < settings["fail_rate"]:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after": "0.1"},
+            content={"error": {"message": "rate limited", "type": "rate_limit_error"}},
+        )
+    slow = random.random() < settings["slow_rate"]
+    await asyncio.sleep(settings["slow_latency"] if slow else settings["latency"])
+
+    text = _reply_text(body)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    model = body.get("model", "fake")
+    usage = _prompt_usage(body)
+    usage.update(completion_tokens=len(text), total_tokens=usage["prompt_tokens"] + len(text))
+
+    if not body.get("stream"):
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def events():
+        for ch in text:
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": ch}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(0.005)
+        end = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage,
+        }
+        yield f"data: {json.dumps(end)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--latency", type=float, default=0.0, help="正常请求延迟（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="慢请求比例，用于验证对冲")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 429 的比例，用于验证重试")
+    args = parser.parse_args()
+    settings.update(latency=args.latency, slow_rate=args.slow_rate,
+                    slow_latency=args.slow_latency, fail_rate=args.fail_rate)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
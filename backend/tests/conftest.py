@@ -0,0 +1,33 @@
+"""测试公共设置：在导入 app.database 之前指向临时 SQLite 库（引擎在导入时创建）。"""
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmpdir = tempfile.mkdtemp(prefix="backend_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+import pytest  # noqa: E402
+
+
+_loop = asyncio.new_event_loop()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    from app.database import init_db, async_engine
+    init_db()
+    yield
+    _loop.run_until_complete(async_engine.dispose())
+    _loop.close()
+
+
+def run_async(coro):
+    """在整个测试会话共用的事件循环中执行协程。
+
+    异步引擎的连接池与首次连接锁绑定在创建它们的事件循环上，不能每个测试各开一个 asyncio.run。
+    """
+    return _loop.run_until_complete(coro)
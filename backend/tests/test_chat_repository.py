@@ -0,0 +1,131 @@
+import asyncio
+
+from conftest import run_async
+
+from app.database import session_scope
+from app.services.chat_repository import chat_repository
+from app.services.db_service import DatabaseService
+
+
+def test_add_message_assigns_contiguous_sequences():
+    async def scenario():
+        conversation_id = await chat_repository.create_conversation()
+        await asyncio.gather(*(
+            chat_repository.add_message(conversation_id, {"role": "user", "content": f"消息 {n}"})
+            for n in range(20)
+        ))
+        messages = await chat_repository.get_message_window(conversation_id, columns=("sequence",))
+        conversation = await chat_repository.get_conversation(conversation_id)
+        return [m["sequence"] for m in messages], conversation
+
+    sequences, conversation = run_async(scenario())
+    assert sequences == list(range(1, 21))
+    assert conversation["message_count"] == 20
+    assert conversation["title"] == "消息 0"
+
+
+def test_concurrent_sockets_do_not_serialize():
+    """多个模拟 WebSocket 并发读写时，DB 调用相互重叠，事件循环上的其他任务持续得到调度"""
+    sockets, turns = 8, 5
+    in_flight = {"now": 0, "max": 0}
+    ticks = []
+
+    async def tracked(coro):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        try:
+            return await coro
+        finally:
+            in_flight["now"] -= 1
+
+    async def socket(n: int):
+        conversation_id = await chat_repository.create_conversation(f"socket-{n}")
+        for turn in range(turns):
+            await tracked(chat_repository.add_message(conversation_id, {"role": "user", "content": f"问题 {turn}"}))
+            await tracked(chat_repository.get_history_context(conversation_id, 20))
+            await tracked(chat_repository.add_message(conversation_id, {"role": "assistant", "content": f"回答 {turn}"}))
+        return conversation_id
+
+    async def ticker(stop: asyncio.Event):
+        while not stop.is_set():
+            ticks.append(1)
+            await asyncio.sleep(0.001)
+
+    async def scenario():
+        stop = asyncio.Event()
+        tick_task = asyncio.create_task(ticker(stop))
+        conversation_ids = await asyncio.gather(*(socket(n) for n in range(sockets)))
+        stop.set()
+        await tick_task
+        return [
+            await chat_repository.get_message_window(cid, columns=("sequence",))
+            for cid in conversation_ids
+        ]
+
+    windows = run_async(scenario())
+    assert in_flight["max"] > 1
+    # 同步调用会在整段 DB I/O 期间占住事件循环，ticker 几乎得不到运行；异步时 DB I/O 期间 ticker 持续运行
+    assert len(ticks) > sockets * turns
+    for window in windows:
+        assert [m["sequence"] for m in window] == list(range(1, turns * 2 + 1))
+
+
+def test_list_conversations_keyset_pages():
+    async def scenario():
+        for n in range(5):
+            await chat_repository.create_conversation(f"page-{n}", user_id="pager")
+        first, cursor = await chat_repository.list_conversations(limit=3, user_id="pager")
+        second, end = await chat_repository.list_conversations(limit=3, cursor=cursor, user_id="pager")
+        return first, second, cursor, end
+
+    first, second, cursor, end = run_async(scenario())
+    assert len(first) == 3 and len(second) == 2
+    assert cursor is not None and end is None
+    assert not {c["id"] for c in first} & {c["id"] for c in second}
+
+
+def test_sync_and_async_reads_agree():
+    """DatabaseService 与 AsyncChatRepository 共用同一组查询语句，结果一致"""
+    async def scenario():
+        conversation_id = await chat_repository.create_conversation(user_id="parity")
+        for n in range(4):
+            await chat_repository.add_message(conversation_id, {"role": "user", "content": f"第 {n} 条"})
+        window = await chat_repository.get_message_window(conversation_id, after=1, limit=2, tail=True)
+        page, _ = await chat_repository.list_conversations(user_id="parity")
+        return conversation_id, window, page
+
+    conversation_id, window, page = run_async(scenario())
+    with session_scope() as db:
+        service = DatabaseService(db)
+        assert service.get_message_window(conversation_id, after=1, limit=2, tail=True) == window
+        assert service.list_conversation_page(user_id="parity")[0] == page
+    assert [m["sequence"] for m in window] == [3, 4]
+
+
+def test_add_message_failure_is_logged(caplog):
+    ok = run_async(chat_repository.add_message("missing", {"role": "user"}))
+    assert ok is False
+    assert "添加消息失败" in caplog.text
+
+
+def test_messages_after_starts_at_high_water_mark():
+    """摘要从高水位之后最早的消息开始折叠，不能跳过中间的旧消息"""
+    async def scenario():
+        conversation_id = await chat_repository.create_conversation()
+        for n in range(10):
+            await chat_repository.add_message(conversation_id, {"role": "user", "content": f"第 {n} 条"})
+        return await chat_repository.get_messages_after(conversation_id, 3, limit=4, columns=("sequence",))
+
+    assert [m["sequence"] for m in run_async(scenario())] == [4, 5, 6, 7]
+
+
+def test_extract_report_info_falls_back_to_title():
+    async def scenario():
+        conversation_id = await chat_repository.create_conversation("季度复盘")
+        await chat_repository.add_message(conversation_id, {"role": "user", "content": "你好"})
+        await chat_repository.add_message(conversation_id, {"role": "assistant", "content": "您好"})
+        return await chat_repository.extract_report_info(conversation_id)
+
+    report_info = run_async(scenario())
+    assert report_info["topic"] == "季度复盘"
+    assert report_info["raw_content"].startswith("用户: 你好")
@@ -0,0 +1,22 @@
+from app.utils.context_builder import ContextBuilder, count_tokens
+
+
+def test_latest_message_outranks_knowledge_and_order_keeps_stable_prefix():
+    builder = ContextBuilder(budget=300, knowledge_ratio=0.9)
+    history = [
+        {"role": "user", "content": "较早的问题"},
+        {"role": "assistant", "content": "较早的回答"},
+        {"role": "user", "content": "本轮问题" * 20},
+    ]
+    knowledge = [("资料", ["知识片段" * 100])]
+    messages, report = builder.build(history, system="系统提示", knowledge=knowledge, summary="摘要")
+
+    assert messages[-1] == history[-1]
+    assert messages[0]["content"] == "系统提示"
+    assert messages[-2]["content"].startswith("【资料】")
+    assert report["used"] <= 300
+
+
+def test_count_tokens_estimates_offline_by_default():
+    assert count_tokens("中文") == 2
+    assert count_tokens("abcd") == 1
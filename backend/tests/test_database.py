@@ -0,0 +1,16 @@
+from sqlalchemy import text
+
+from conftest import run_async
+
+from app.database import async_session_scope, pool_status
+
+
+def test_pool_status_reports_async_checkouts():
+    async def scenario():
+        async with async_session_scope() as db:
+            await db.execute(text("SELECT 1"))
+            return pool_status()
+
+    status = run_async(scenario())
+    assert status["async"]["checked_out"] == 1
+    assert status["async"]["max_overflow"] == status["sync"]["max_overflow"]
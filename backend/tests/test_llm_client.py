@@ -0,0 +1,186 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+openai = pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+
+from conftest import run_async  # noqa: E402
+
+from app.utils import llm_client  # noqa: E402
+from app.utils.llm_client import (  # noqa: E402
+    TokenBucket, backoff_delay, hedged, stream_with_retries, with_retries,
+)
+
+COMPLETION = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "fake",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "你好 世界"}, "finish_reason": "stop"}],
+}
+
+
+def fake_client(responses):
+    """经 httpx.MockTransport 依次返回给定响应的 OpenAI 客户端（SDK 自身不重试），返回 (client, 请求计数)"""
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        status, headers = responses[min(len(calls), len(responses)) - 1]
+        body = COMPLETION if status == 200 else {"error": {"message": f"status {status}"}}
+        return httpx.Response(status, headers=headers, json=body)
+
+    client = openai.AsyncOpenAI(
+        api_key="test", base_url="http://fake/v1", max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    return client, calls
+
+
+def create(client):
+    return lambda: client.chat.completions.create(model="fake", messages=[{"role": "user", "content": "hi"}])
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录退避时长而不真正等待"""
+    recorded = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args, **kwargs):
+        recorded.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(llm_client.asyncio, "sleep", fake_sleep)
+    return recorded
+
+
+def test_backoff_is_full_jitter_under_cap():
+    random.seed(0)
+    delays = [backoff_delay(3, base=0.5, cap=2.0) for _ in range(200)]
+    assert all(0 <= d <= 2.0 for d in delays)
+    assert len(set(delays)) > 100  # 随机抖动，不是固定值
+    assert max(backoff_delay(0, base=0.5, cap=2.0) for _ in range(200)) <= 0.5
+
+
+def test_retries_5xx_with_backoff_then_succeeds(sleeps):
+    client, calls = fake_client([(503, {}), (502, {}), (200, {})])
+    response = run_async(with_retries(create(client), max_retries=3, base=0.5, cap=8.0))
+    assert response.choices[0].message.content == "你好 世界"
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0
+
+
+def test_retry_after_header_is_honoured_and_capped(sleeps):
+    client, _ = fake_client([(429, {"retry-after": "0.25"}), (429, {"retry-after": "30"}), (200, {})])
+    run_async(with_retries(create(client), max_retries=3, base=0.5, cap=2.0))
+    assert sleeps == [0.25, 2.0]
+
+
+def test_client_errors_are_not_retried(sleeps):
+    client, calls = fake_client([(400, {}), (200, {})])
+    with pytest.raises(openai.BadRequestError):
+        run_async(with_retries(create(client), max_retries=3, base=0.5, cap=8.0))
+    assert len(calls) == 1 and sleeps == []
+
+
+def test_gives_up_after_max_retries(sleeps):
+    client, calls = fake_client([(503, {})])
+    with pytest.raises(openai.InternalServerError):
+        run_async(with_retries(create(client), max_retries=2, base=0.5, cap=8.0))
+    assert len(calls) == 3 and len(sleeps) == 2
+
+
+def test_stream_is_retried_before_first_token(sleeps):
+    client, calls = fake_client([(503, {}), (200, {})])
+
+    async def open_stream():
+        response = await create(client)()
+        for word in response.choices[0].message.content.split():
+            yield word
+
+    async def scenario():
+        return [w async for w in stream_with_retries(open_stream, max_retries=2, base=0.5, cap=8.0)]
+
+    assert run_async(scenario()) == ["你好", "世界"]
+    assert len(calls) == 2 and len(sleeps) == 1
+
+
+def test_stream_is_not_retried_after_first_token(sleeps):
+    opened = []
+
+    async def open_stream():
+        opened.append(1)
+        yield "partial"
+        raise openai.APIConnectionError(request=httpx.Request("POST", "http://fake/v1/chat/completions"))
+
+    async def scenario():
+        received = []
+        with pytest.raises(openai.APIConnectionError):
+            async for item in stream_with_retries(open_stream, max_retries=2, base=0.5, cap=8.0):
+                received.append(item)
+        return received
+
+    assert run_async(scenario()) == ["partial"]
+    assert len(opened) == 1 and sleeps == []
+
+
+def test_hedged_cancels_the_losing_call():
+    cancelled = []
+    started = []
+
+    async def call():
+        started.append(1)
+        if len(started) == 1:
+            try:
+                await asyncio.sleep(5)  # 首个请求卡在长尾
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return "primary"
+        return "hedge"
+
+    async def scenario():
+        result = await hedged(call, delay=0.05)
+        await asyncio.sleep(0)  # 让取消生效
+        return result
+
+    assert run_async(scenario()) == "hedge"
+    assert len(started) == 2 and cancelled == [1]
+
+
+def test_hedged_skips_the_hedge_when_primary_is_fast():
+    started = []
+
+    async def call():
+        started.append(1)
+        return "primary"
+
+    assert run_async(hedged(call, delay=0.5)) == "primary"
+    assert len(started) == 1
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    async def scenario():
+        start = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        burst = time.monotonic() - start
+        await bucket.acquire()  # 桶已空，需等约 1 / rate 秒补充
+        waited = time.monotonic() - start - burst
+        await asyncio.sleep(0.15)  # 空闲后补满到 capacity
+        refill_start = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        return burst, waited, time.monotonic() - refill_start
+
+    burst, waited, refilled = run_async(scenario())
+    assert burst < 0.02
+    assert waited >= 0.04
+    assert refilled < 0.02
@@ -0,0 +1,44 @@
+import pytest
+
+from conftest import run_async
+
+from app.services.chat_repository import chat_repository
+from app.services.message_writer import GroupCommitWriter
+
+
+def test_group_commit_writes_in_order():
+    async def scenario():
+        writer = GroupCommitWriter(enabled=True, window_ms=5, max_batch=8)
+        conversation_id = await chat_repository.create_conversation()
+        for n in range(3):
+            assert await writer.add_message(conversation_id, {"role": "user", "content": f"第 {n} 条"})
+        await writer.drain()
+        return await chat_repository.get_message_window(conversation_id, columns=("sequence", "content"))
+
+    assert [m["content"] for m in run_async(scenario())] == ["第 0 条", "第 1 条", "第 2 条"]
+
+
+def test_worker_crash_fails_batch_and_restarts_on_same_queue():
+    """写入协程异常退出时，已出队消息的调用方拿到异常；协程在同一个队列上重启，后续消息照常写入"""
+    async def scenario():
+        writer = GroupCommitWriter(enabled=True, window_ms=0, max_batch=1)
+        conversation_id = await chat_repository.create_conversation()
+        flush = writer._flush
+        crashes = []
+
+        async def crash_once(batch):
+            if not crashes:
+                crashes.append(batch)
+                raise RuntimeError("boom")
+            return await flush(batch)
+
+        writer._flush = crash_once
+        with pytest.raises(RuntimeError):
+            await writer.add_message(conversation_id, {"role": "user", "content": "丢失"})
+        queue = writer._queue
+        ok = await writer.add_message(conversation_id, {"role": "user", "content": "重启后"})
+        await writer.drain()
+        return ok, writer._queue is queue
+
+    ok, same_queue = run_async(scenario())
+    assert ok and same_queue
@@ -0,0 +1,11 @@
+import pytest
+
+from app.database import engine
+from scripts.check_query_plans import HOT_QUERIES, explain, regressions
+
+
+@pytest.mark.parametrize("name", list(HOT_QUERIES))
+def test_hot_query_uses_index(name):
+    """热点查询在迁移后的库上不出现全表扫描或额外排序"""
+    with engine.connect() as conn:
+        assert regressions(explain(conn, HOT_QUERIES[name])) == []
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from app.utils.rwlock import ReadWriteLock
+
+
+def test_readers_run_concurrently():
+    lock = ReadWriteLock()
+    barrier = threading.Barrier(3, timeout=2)
+
+    def reader():
+        with lock.read():
+            barrier.wait()  # 三个读者必须同时持有读锁才能通过
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not barrier.broken
+
+
+def test_writer_excludes_readers_and_is_not_starved():
+    lock = ReadWriteLock()
+    events = []
+    reader_in = threading.Event()
+
+    def long_reader():
+        with lock.read():
+            reader_in.set()
+            time.sleep(0.1)
+            events.append("read-1 done")
+
+    def writer():
+        with lock.write():
+            events.append("write")
+
+    def late_reader():
+        with lock.read():
+            events.append("read-2")
+
+    first = threading.Thread(target=long_reader)
+    first.start()
+    reader_in.wait()
+    w = threading.Thread(target=writer)
+    w.start()
+    time.sleep(0.02)  # 写者已在等待，后来的读者应排在写者之后
+    late = threading.Thread(target=late_reader)
+    late.start()
+    for t in (first, w, late):
+        t.join()
+    assert events == ["read-1 done", "write", "read-2"]
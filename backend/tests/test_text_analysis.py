@@ -0,0 +1,24 @@
+import jieba
+
+from app.services.text_analysis import TextAnalyzer
+
+
+def test_parallel_tokenize_matches_single_process():
+    """真正启动 spawn 进程池（初始化函数必须能被子进程按名字导入），结果与单进程分词一致"""
+    text = "人工智能正在改变数据分析的方式。\n公司本季度营业收入同比增长。\n" * 20
+    analyzer = TextAnalyzer(workers=2, parallel_chars=10)
+    try:
+        assert analyzer.tokenize(text) == jieba.lcut(text)
+        assert analyzer.stats()["pool_started"]
+    finally:
+        analyzer.shutdown()
+
+
+def test_preload_starts_every_worker():
+    analyzer = TextAnalyzer(workers=2)
+    try:
+        analyzer.preload()
+        assert analyzer.stats()["pool_started"]
+        assert len(analyzer._pool._processes) == 2
+    finally:
+        analyzer.shutdown()